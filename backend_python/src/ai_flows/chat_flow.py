@@ -2,7 +2,8 @@
 import asyncio
 from typing import AsyncGenerator
 from ..ai_schemas.chat_schema import ChatInputSchema, ChatOutputSchema
-from ..ai_config import genai  # Sử dụng cấu hình từ ai_config.py
+from ..services.llm_gateway import llm_gateway
+from ..services.model_registry import model_registry
 
 MODEL_NAME = "gemini-2.5-flash"
 
@@ -78,11 +79,7 @@ async def chat(input: ChatInputSchema) -> AsyncGenerator[str, None]:
         # "response_schema": ChatOutputSchema # Có thể bật nếu thư viện hỗ trợ
     }
 
-    model = genai.GenerativeModel(
-        model_name=MODEL_NAME,
-        generation_config=generation_config,
-        system_instruction=SYSTEM_INSTRUCTION
-    )
+    model = model_registry.get(MODEL_NAME, SYSTEM_INSTRUCTION, generation_config)
 
     # 2. Chuyển đổi lịch sử chat sang định dạng Gemini
     gemini_history = []
@@ -109,9 +106,23 @@ async def chat(input: ChatInputSchema) -> AsyncGenerator[str, None]:
              user_parts.append({"text": f"[User sent media: {media.url}]"})
 
     # 5. Gửi tin nhắn và stream kết quả
-    # send_message_async trả về một awaitable response, response này có thể iter khi stream=True
-    response = await chat_session.send_message_async(user_parts, stream=True)
+    async for text in stream_message(chat_session, user_parts):
+        yield text
+
 
-    async for chunk in response:
-        if chunk.text:
-            yield chunk.text
\ No newline at end of file
+async def stream_message(chat_session, user_parts) -> AsyncGenerator[str, None]:
+    """
+    Gửi tin nhắn vào ChatSession và yield từng đoạn text ngay khi model sinh ra.
+    Dùng chung cho chat flow và endpoint /api/chat/stream.
+    """
+    # send_message_async trả về một awaitable response, response này có thể iter khi stream=True
+    async for chunk in llm_gateway.stream(
+        lambda: chat_session.send_message_async(user_parts, stream=True)
+    ):
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunk cuối (finish_reason) có thể không chứa phần text nào
+            continue
+        if text:
+            yield text
\ No newline at end of file
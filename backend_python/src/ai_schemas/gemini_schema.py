@@ -0,0 +1,51 @@
+# src/ai_schemas/gemini_schema.py
+"""Convert Pydantic models into Gemini ``response_schema`` dicts.
+
+Gemini accepts only a subset of OpenAPI: no ``$ref`` / ``$defs``, no ``const``,
+no ``anyOf`` and no numeric / length bounds. Pydantic's JSON schema is inlined
+and reduced to ``type``, ``description``, ``enum``, ``nullable``, ``items``,
+``properties`` and ``required``; the bounds are still enforced when the
+response is validated with the same model.
+"""
+from typing import Any, Dict, Type
+
+from pydantic import BaseModel
+
+_KEPT_KEYS = ("type", "description", "enum")
+
+
+def _convert(node: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    if "$ref" in node:
+        return _convert(defs[node["$ref"].rsplit("/", 1)[-1]], defs)
+
+    # Optional[X] -> anyOf [X, null] -> X + nullable
+    variants = node.get("anyOf")
+    if variants:
+        non_null = [v for v in variants if v.get("type") != "null"]
+        if len(non_null) != 1:
+            raise ValueError("Gemini schemas do not support unions")
+        schema = _convert(non_null[0], defs)
+        if len(non_null) < len(variants):
+            schema["nullable"] = True
+        if "description" in node:
+            schema["description"] = node["description"]
+        return schema
+
+    schema = {key: node[key] for key in _KEPT_KEYS if key in node}
+    if "const" in node:
+        schema["enum"] = [node["const"]]
+        schema.setdefault("type", "string")
+    if "items" in node:
+        schema["items"] = _convert(node["items"], defs)
+    if "properties" in node:
+        schema["properties"] = {
+            name: _convert(prop, defs) for name, prop in node["properties"].items()
+        }
+        if node.get("required"):
+            schema["required"] = list(node["required"])
+    return schema
+
+
+def to_gemini_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    json_schema = model.model_json_schema()
+    return _convert(json_schema, json_schema.get("$defs", {}))
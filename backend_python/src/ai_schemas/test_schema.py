@@ -27,6 +27,7 @@ QuestionSchema = Union[MultipleChoiceQuestionSchema, TrueFalseQuestionSchema, Sh
 
 class TestSchema(BaseModel):
     title: str
+    description: Optional[str] = None
     parts: 'TestPartsSchema'
 
 class TestPartsSchema(BaseModel):
@@ -16,7 +16,11 @@ SessionLocal = sessionmaker(bind=engine, class_=Session, autocommit=False, autof
 
 
 def init_db() -> None:
-    """Create database tables if they do not exist."""
+    """Create database tables if they do not exist.
+
+    Existing tables are not altered: schema changes ship as one-off SQL
+    migrations (e.g. ``video_queue_migration.sql``), never from app startup.
+    """
     SQLModel.metadata.create_all(engine)
 
 
@@ -3,24 +3,38 @@ import re
 import uvicorn
 import json
 import os
-import hashlib 
+import hashlib
 from pathlib import Path
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from src.routes.node_progress import router as node_progress_router
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import List, Literal, Optional
-import PyPDF2
-from docx import Document
 from src.models import NodeProgress
-from src.supabase_client import supabase
+from src.supabase_client import db_latency, run_query
 
 # Import config
 from src.ai_config import genai
-from src.ai_flows.chat_flow import chat as chat_flow
+from src.ai_flows.chat_flow import chat as chat_flow, stream_message as stream_chat_message
 from src.ai_schemas.chat_schema import ChatInputSchema
 from src.services import rag_service
+from src.services.embedding_cache import query_embedding_cache
+from src.services.embedding_engine import embedding_engine
+from src.services.ingestion_queue import ingestion_queue
+from src.services.llm_gateway import llm_gateway
+from src.services.model_registry import model_registry
+from src.services.progress_buffer import progress_buffer
+from src.services.read_cache import read_cache_stats
+from src.services.response_cache import response_cache
+from src.services import structured_test
+from src.services.reference_corpus import ReferenceCorpus
+from src.services.test_pool import KNOWN_NODE_LABELS, node_test_pool
+from src.services.test_store import test_store
 from src.routes import student_profile
+from src.utils import json_repair
+from src.utils.file_utils import shutdown_process_pool
+from src.utils.json_stream import ChatStreamParser
 
 app = FastAPI(title="Math Tutor API")
 
@@ -37,72 +51,15 @@ app.add_middleware(
 app.include_router(node_progress_router)
 app.include_router(student_profile.router)
 
-# ===== DOCUMENT PROCESSING =====
+# Video dùng SQLModel: src.db báo lỗi ngay khi import nếu thiếu DATABASE_URL
+VIDEO_ENABLED = bool(os.getenv("DATABASE_URL"))
+if VIDEO_ENABLED:
+    from src.routes import video as video_routes
+    from src.services.video_service import video_poller, video_scheduler
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text from a PDF file"""
-    try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        print(f"Error reading PDF {pdf_path}: {e}")
-        return ""
-
-def extract_text_from_word(docx_path: str) -> str:
-    """Extract text from a Word (.docx) file"""
-    try:
-        doc = Document(docx_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    except Exception as e:
-        print(f"Error reading Word file {docx_path}: {e}")
-        return ""
-
-def extract_text_from_file(file_path: str) -> str:
-    """Extract text from PDF or Word file based on extension"""
-    file_path_obj = Path(file_path)
-    extension = file_path_obj.suffix.lower()
-    
-    if extension == '.pdf':
-        return extract_text_from_pdf(file_path)
-    elif extension in ['.docx', '.doc']:
-        return extract_text_from_word(file_path)
-    else:
-        print(f"Unsupported file format: {extension}")
-        return ""
-
-def load_reference_materials(folder_path: str, max_files: int = 5) -> str:
-    """Load and combine text from multiple PDF/Word files in a folder"""
-    folder = Path(folder_path)
-    if not folder.exists():
-        print(f"Warning: Folder {folder_path} does not exist")
-        return ""
-    
-    # Get both PDF and Word files
-    pdf_files = list(folder.glob("*.pdf"))
-    docx_files = list(folder.glob("*.docx"))
-    doc_files = list(folder.glob("*.doc"))
-    
-    all_files = (pdf_files + docx_files + doc_files)[:max_files]
-    
-    if not all_files:
-        print(f"Warning: No PDF or Word files found in {folder_path}")
-        return ""
-    
-    combined_text = ""
-    for file in all_files:
-        print(f"📄 Loading: {file.name}")
-        text = extract_text_from_file(str(file))
-        if text:
-            combined_text += f"\n\n=== TÀI LIỆU: {file.name} ===\n{text}\n"
-    
-    return combined_text
+    app.include_router(video_routes.router)
+else:
+    print("⚠️ DATABASE_URL chưa cấu hình, tắt các route /videos")
 
 # ===== PATHS CONFIGURATION =====
 
@@ -112,6 +69,8 @@ BASE_DIR = Path(__file__).parent.parent
 EXERCISES_FOLDER = BASE_DIR / "reference_materials" / "exercises"
 TESTS_FOLDER = BASE_DIR / "reference_materials" / "tests"
 GENERATED_TESTS_FOLDER = BASE_DIR / "generated_tests"  # ✅ thư mục cache đề thi
+REFERENCE_CACHE_FOLDER = BASE_DIR / ".cache" / "reference_corpus"
+REFERENCE_WATCH_INTERVAL_SECONDS = float(os.getenv("REFERENCE_WATCH_INTERVAL_SECONDS", "30"))
 
 # Tạo thư mục nếu chưa có
 for folder in [EXERCISES_FOLDER, TESTS_FOLDER, GENERATED_TESTS_FOLDER]:
@@ -121,6 +80,58 @@ print(f"📁 Exercises folder: {EXERCISES_FOLDER}")
 print(f"📁 Tests folder: {TESTS_FOLDER}")
 print(f"📁 Generated tests folder: {GENERATED_TESTS_FOLDER}")
 
+# Tài liệu tham khảo được trích xuất 1 lần lúc khởi động rồi phục vụ từ bộ nhớ
+exercise_corpus = ReferenceCorpus("exercises", EXERCISES_FOLDER, REFERENCE_CACHE_FOLDER)
+test_corpus = ReferenceCorpus("tests", TESTS_FOLDER, REFERENCE_CACHE_FOLDER)
+
+
+@app.on_event("startup")
+async def start_reference_corpora():
+    for corpus in (exercise_corpus, test_corpus):
+        await corpus.start(watch_interval_seconds=REFERENCE_WATCH_INTERVAL_SECONDS)
+
+
+@app.on_event("shutdown")
+async def stop_reference_corpora():
+    for corpus in (exercise_corpus, test_corpus):
+        await corpus.stop()
+
+
+@app.on_event("startup")
+async def start_progress_buffer():
+    await progress_buffer.start()
+
+
+@app.on_event("shutdown")
+async def stop_progress_buffer():
+    # Ghi nốt các update node_progress còn trong buffer
+    await progress_buffer.stop()
+
+
+@app.on_event("startup")
+async def start_video_scheduler():
+    if VIDEO_ENABLED:
+        # Cột hàng đợi (needed_at, lease_*, ...) do video_queue_migration.sql thêm, không chạy DDL ở đây
+        await video_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def stop_video_scheduler():
+    if VIDEO_ENABLED:
+        await video_scheduler.stop()
+        await video_poller.stop()
+
+
+@app.on_event("startup")
+async def start_ingestion_queue():
+    await ingestion_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_ingestion_queue():
+    await ingestion_queue.stop()
+    shutdown_process_pool()
+
 
 # ===== SYSTEM INSTRUCTIONS =====
 
@@ -359,6 +370,41 @@ TEST_SYSTEM_INSTRUCTION = """Bạn là chuyên gia biên soạn đề thi THPT Q
 
 SUMMARIZE_SYSTEM_INSTRUCTION = """Bạn là một giảng viên toán học chuyên tóm tắt kiến thức một cách súc tích."""
 
+NODE_TEST_SYSTEM_INSTRUCTION = """Bạn là hệ thống sinh đề kiểm tra toán chuẩn THPT."""
+
+# ===== MODEL CONFIGURATIONS =====
+# Mỗi cấu hình chỉ khởi tạo GenerativeModel 1 lần (xem model_registry)
+
+MODEL_NAME = "gemini-2.5-flash"
+
+CHAT_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json",
+}
+EXERCISE_GENERATION_CONFIG = {"temperature": 0.7}
+TEST_GENERATION_CONFIG = {"temperature": 0.6, "response_mime_type": "application/json"}
+SUMMARIZE_GENERATION_CONFIG = {"temperature": 0.5}
+GEOGEBRA_GENERATION_CONFIG = {"temperature": 0.3, "response_mime_type": "application/json"}
+ANALYZE_GENERATION_CONFIG = {"temperature": 0.6}
+
+MODEL_SPECS = [
+    (MODEL_NAME, CHAT_SYSTEM_INSTRUCTION, CHAT_GENERATION_CONFIG),
+    (MODEL_NAME, EXERCISE_SYSTEM_INSTRUCTION, EXERCISE_GENERATION_CONFIG),
+    (MODEL_NAME, TEST_SYSTEM_INSTRUCTION, structured_test.structured_config(TEST_GENERATION_CONFIG)),
+    (MODEL_NAME, NODE_TEST_SYSTEM_INSTRUCTION, structured_test.structured_config(TEST_GENERATION_CONFIG)),
+    (MODEL_NAME, SUMMARIZE_SYSTEM_INSTRUCTION, SUMMARIZE_GENERATION_CONFIG),
+    (MODEL_NAME, GEOGEBRA_SYSTEM_INSTRUCTION, GEOGEBRA_GENERATION_CONFIG),
+    (MODEL_NAME, None, ANALYZE_GENERATION_CONFIG),
+]
+
+
+@app.on_event("startup")
+async def warm_model_registry():
+    model_registry.warm(MODEL_SPECS)
+
 # ===== FASTAPI APP =====
 
 
@@ -465,24 +511,6 @@ class GenerateTestInput(BaseModel):
     numQuestions: int = 5       # số câu hỏi
 
 
-def get_test_cache_path(req: GenerateTestInput) -> Path:
-    """
-    Tạo đường dẫn file cache dựa trên nội dung request.
-    Hai request giống hệt nhau (userId/topic/difficulty/testType/numQuestions)
-    sẽ dùng chung một file cache.
-    """
-    key_data = {
-        "userId": req.userId,
-        "topic": req.topic,
-        "difficulty": req.difficulty,
-        "testType": req.testType,
-        "numQuestions": req.numQuestions,
-    }
-    key_str = json.dumps(key_data, ensure_ascii=False, sort_keys=True)
-    key_hash = hashlib.sha256(key_str.encode("utf-8")).hexdigest()[:16]
-    return GENERATED_TESTS_FOLDER / f"test_{key_hash}.json"
-
-
 # ===== HELPER FUNCTIONS =====
 
 def evaluate_node_status(score: float, has_opened: bool) -> str:
@@ -500,47 +528,6 @@ def evaluate_node_status(score: float, has_opened: bool) -> str:
 
     return "learning"
 
-# --- SỬA LỖI: HÀM DỌN DẸP JSON ---
-def clean_json_response(raw_text: str) -> str:
-    """
-    Tìm khối JSON đầu tiên trong chuỗi, loại bỏ ```json và các ký tự không hợp lệ.
-    """
-    if not raw_text:
-        return ""
-
-    # Tìm JSON trong chuỗi AI trả về
-    json_match = re.search(r"{[\s\S]*}", raw_text)
-    if not json_match:
-        print("❌ Không tìm thấy JSON trong output AI")
-        print("Raw response:", raw_text[:400])
-        return "" # Trả về chuỗi rỗng nếu không tìm thấy
-
-    json_text = json_match.group(0).strip()
-
-    # Loại ký tự điều khiển (nguyên nhân chính gây JSONDecodeError)
-    json_text = re.sub(r"[\x00-\x1F\x7F]", " ", json_text)
-    # Loại emoji và ký tự mở rộng Unicode
-    json_text = re.sub(r"[\U00010000-\U0010ffff]", "", json_text)
-    # Chuẩn hoá dấu ngoặc kép Unicode về ASCII
-    json_text = json_text.replace("“", "\"").replace("”", "\"")
-    json_text = json_text.replace("‘", "'").replace("’", "'")
-    # Loại bỏ xuống dòng thật và tab thật
-    json_text = json_text.replace("\n", " ").replace("\t", " ")
-    # Loại escape thừa dạng "\\n", "\\t"
-    json_text = json_text.replace("\\n", " ").replace("\\t", " ")
-
-    # Xử lý nếu AI trả về dạng ```json ... ``` hoặc ```...```
-    if json_text.startswith("```json"):
-        json_text = json_text[7:]
-    elif json_text.startswith("```"):
-        json_text = json_text[3:]
-    if json_text.endswith("```"):
-        json_text = json_text[:-3]
-
-    return json_text.strip()
-# --- KẾT THÚC HÀM DỌN DẸP JSON ---
-
-
 # ===== ENDPOINTS =====
 
 @app.get("/")
@@ -552,6 +539,7 @@ async def root():
         "supported_formats": ["PDF (.pdf)", "Word (.docx, .doc)"],
         "endpoints": [
             "/api/chat",
+            "/api/chat/stream",
             "/api/generate-exercises", 
             "/api/generate-test",
             "/api/process-document",
@@ -566,71 +554,97 @@ async def root():
         }
     }
 
-# ===== OPTIMIZATION: CACHED MODELS =====
-# We can initialize models globally if config is static, but here config varies slightly.
-# However, we can keep the client initialization lightweight.
-# The `genai.configure` is already done globally.
 
-# --- SỬA LỖI 1: TỐI ƯU HÓA TỐC ĐỘ CHAT ---
-@app.post("/api/chat")
-async def handle_chat(request: ChatInputSchema):
-    """Handle chat using a persistent ChatSession for speed."""
-    try:
-        generation_config = {
-            "temperature": 0.7,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 8192,
-            "response_mime_type": "application/json",
-        }
-
-        # 1) Xây dựng lại lịch sử cho Gemini ChatSession
-        gemini_history = []
-        gemini_history = []
-        for turn in request.history:
-            if not turn.content:
-                continue
-            mapped_role = "user" if turn.role == "user" else "model"
-            gemini_history.append(
-                {
-                    "role": mapped_role,
-                    "parts": [{"text": turn.content}],
-                }
-            )
+@app.get("/api/metrics")
+async def get_metrics():
+    """Số liệu vận hành của các subsystem (LLM gateway, corpus tài liệu...)."""
+    return {
+        "llm_gateway": llm_gateway.stats(),
+        "model_registry": model_registry.stats(),
+        "embeddings": embedding_engine.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "local_vector_index": rag_service.local_index.stats(),
+        "ingestion_queue": ingestion_queue.stats(),
+        "progress_buffer": progress_buffer.stats(),
+        "read_cache": read_cache_stats(),
+        "response_cache": response_cache.stats(),
+        "test_store": test_store.stats(),
+        "json_repair": json_repair.stats(),
+        "structured_tests": structured_test.stats(),
+        "node_test_pool": await node_test_pool.stats(),
+        "supabase_latency": db_latency.snapshot(),
+        "reference_corpus": {
+            "exercises": exercise_corpus.stats(),
+            "tests": test_corpus.stats(),
+        },
+    }
 
-        # 2) Khởi tạo ChatSession với lịch sử đã có
-        #    Điều này cho phép model duy trì ngữ cảnh mà không cần gửi lại toàn bộ
-        #    OPTIMIZATION: Initialize model here or use cached one
-        model = genai.GenerativeModel(
-            "gemini-2.5-flash",
-            generation_config=generation_config,
-            system_instruction=CHAT_SYSTEM_INSTRUCTION,
+async def _prepare_chat(request: ChatInputSchema):
+    """Dựng ChatSession (lịch sử + model dùng chung) và nội dung tin nhắn mới."""
+    # 1) Xây dựng lại lịch sử cho Gemini ChatSession
+    gemini_history = []
+    for turn in request.history:
+        if not turn.content:
+            continue
+        mapped_role = "user" if turn.role == "user" else "model"
+        gemini_history.append(
+            {
+                "role": mapped_role,
+                "parts": [{"text": turn.content}],
+            }
         )
-        chat = model.start_chat(history=gemini_history)
 
-        # 3) Chuẩn bị nội dung tin nhắn MỚI
-        # RAG INTEGRATION
-        context_text = ""
-        if request.userId:
-            print(f"🔍 Searching documents for user {request.userId}...")
-            docs = await rag_service.search_similar_documents(request.message, request.userId, purpose="chat")
-            if docs:
-                context_text = "\n\n=== THÔNG TIN THAM KHẢO TỪ TÀI LIỆU CỦA BẠN ===\n"
-                for d in docs:
-                    context_text += f"- [{d['file_name']}]: {d['content']}\n"
-                context_text += "==============================================\n"
-                print(f"✅ Found {len(docs)} relevant chunks")
+    # 2) Khởi tạo ChatSession với lịch sử đã có
+    #    Điều này cho phép model duy trì ngữ cảnh mà không cần gửi lại toàn bộ
+    model = model_registry.get(MODEL_NAME, CHAT_SYSTEM_INSTRUCTION, CHAT_GENERATION_CONFIG)
+    chat = model.start_chat(history=gemini_history)
+
+    # 3) Chuẩn bị nội dung tin nhắn MỚI
+    # RAG INTEGRATION
+    context_text = ""
+    if request.userId:
+        print(f"🔍 Searching documents for user {request.userId}...")
+        docs = await rag_service.search_similar_documents(request.message, request.userId, purpose="chat")
+        if docs:
+            context_text = "\n\n=== THÔNG TIN THAM KHẢO TỪ TÀI LIỆU CỦA BẠN ===\n"
+            for d in docs:
+                context_text += f"- [{d['file_name']}]: {d['content']}\n"
+            context_text += "==============================================\n"
+            print(f"✅ Found {len(docs)} relevant chunks")
+
+    user_prompt = f"""{CHAT_RESPONSE_BLUEPRINT}\n\n{context_text}\nHọc sinh vừa hỏi: {request.message}"""
+    user_parts = [{"text": user_prompt}]
+
+    if request.media:
+        for media in request.media:
+            user_parts.append({"media": {"url": media.url}})
+
+    return chat, user_parts
+
+
+def _normalize_geogebra(geogebra_block, message: str) -> dict:
+    """Chuẩn hoá khối geogebra của model; mặc định là không vẽ."""
+    if not isinstance(geogebra_block, dict):
+        geogebra_block = {}
+    commands = geogebra_block.get("commands")
+    return {
+        "should_draw": bool(geogebra_block.get("should_draw")),
+        "reason": geogebra_block.get("reason") or "",
+        "prompt": geogebra_block.get("prompt") or message,
+        "commands": commands if isinstance(commands, list) else [],
+    }
 
-        user_prompt = f"""{CHAT_RESPONSE_BLUEPRINT}\n\n{context_text}\nHọc sinh vừa hỏi: {request.message}"""
-        user_parts = [{"text": user_prompt}]
 
-        if request.media:
-            for media in request.media:
-                user_parts.append({"media": {"url": media.url}})
+# --- SỬA LỖI 1: TỐI ƯU HÓA TỐC ĐỘ CHAT ---
+@app.post("/api/chat")
+async def handle_chat(request: ChatInputSchema):
+    """Handle chat using a persistent ChatSession for speed."""
+    try:
+        chat, user_parts = await _prepare_chat(request)
 
         # 4) Gửi tin nhắn mới (async)
         #    Model sẽ tự động nối lịch sử đã có với tin nhắn mới này
-        response = await chat.send_message_async(user_parts)
+        response = await llm_gateway.run(lambda: chat.send_message_async(user_parts))
 
         # Lấy raw text từ model
         raw_text = response.text if hasattr(response, "text") else None
@@ -639,22 +653,11 @@ async def handle_chat(request: ChatInputSchema):
 
         # Mặc định: không mindmap, không vẽ geogebra
         mindmap_data = []
-        normalized_geogebra = {
-            "should_draw": False,
-            "reason": "",
-            "prompt": request.message,
-            "commands": [],
-        }
+        normalized_geogebra = _normalize_geogebra(None, request.message)
 
         # ===================== TRY PARSE JSON =====================
         try:
-            # SỬA LỖI: Sử dụng hàm dọn dẹp JSON
-            json_candidate = clean_json_response(raw_text)
-            
-            if not json_candidate:
-                raise ValueError("Không tìm thấy JSON hợp lệ trong phản hồi")
-
-            payload = json.loads(json_candidate)
+            payload = json_repair.parse_model_json(raw_text)
 
             # Nếu parse được JSON, ưu tiên lấy reply trong JSON
             reply_text = (
@@ -669,15 +672,7 @@ async def handle_chat(request: ChatInputSchema):
                 mindmap_data = md
 
             # geogebra nếu có cấu trúc đúng thì dùng cho luồng GeoGebra
-            geogebra_block = payload.get("geogebra") or {}
-            normalized_geogebra = {
-                "should_draw": bool(geogebra_block.get("should_draw")),
-                "reason": geogebra_block.get("reason") or "",
-                "prompt": geogebra_block.get("prompt") or request.message,
-                "commands": geogebra_block.get("commands")
-                if isinstance(geogebra_block.get("commands"), list)
-                else [],
-            }
+            normalized_geogebra = _normalize_geogebra(payload.get("geogebra"), request.message)
 
         except Exception as e:
             # JSON hỏng -> chỉ lấy phần reply, bỏ mindmap & geogebra
@@ -697,34 +692,114 @@ async def handle_chat(request: ChatInputSchema):
 # --- KẾT THÚC SỬA LỖI CHAT ---
 
 
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/chat/stream")
+async def handle_chat_stream(request: ChatInputSchema):
+    """
+    Chat dạng Server-Sent Events:
+    - event "reply": từng đoạn {"delta": "..."} ngay khi model sinh ra
+    - event "mindmap_insights" / "geogebra": gửi khi khối JSON tương ứng đã đóng
+    - event "done": payload đầy đủ giống /api/chat (hoặc "error" nếu lỗi)
+    """
+    try:
+        chat, user_parts = await _prepare_chat(request)
+    except Exception as e:
+        print(f"Chat stream error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        parser = ChatStreamParser(streamed_key="reply")
+        mindmap_data = []
+        normalized_geogebra = _normalize_geogebra(None, request.message)
+
+        def to_sse(events):
+            nonlocal mindmap_data, normalized_geogebra
+            for event, payload in events:
+                if event == "reply":
+                    yield _sse_event("reply", {"delta": payload})
+                elif event == "mindmap_insights":
+                    mindmap_data = payload if isinstance(payload, list) else []
+                    yield _sse_event("mindmap_insights", mindmap_data)
+                elif event == "geogebra":
+                    normalized_geogebra = _normalize_geogebra(payload, request.message)
+                    yield _sse_event("geogebra", normalized_geogebra)
+
+        try:
+            async for text in stream_chat_message(chat, user_parts):
+                for message in to_sse(parser.feed(text)):
+                    yield message
+            for message in to_sse(parser.close()):
+                yield message
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield _sse_event("error", {"detail": str(e)})
+            return
+
+        yield _sse_event(
+            "done",
+            {
+                "reply": parser.reply,
+                "mindmap_insights": mindmap_data,
+                "geogebra": normalized_geogebra,
+            },
+        )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 class UpdateNodeScorePayload(BaseModel):
     user_id: int
     node_id: int
     score: int
 
+
+class UpdateNodeScoresPayload(BaseModel):
+    updates: List[UpdateNodeScorePayload] = Field(..., min_length=1)
+
+
 @app.post("/node-progress/updateScore")
-def update_node_score(payload: UpdateNodeScorePayload):
-    # Giả sử bạn dùng Supabase client:
-    from supabase import create_client
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-    res = supabase.table("user_nodes") \
-        .update({"score": payload.score}) \
-        .eq("user_id", payload.user_id) \
-        .eq("node_id", payload.node_id) \
-        .execute()
+async def update_node_score(payload: UpdateNodeScorePayload):
+    res = await run_query(
+        "user_nodes.update",
+        lambda db: db.table("user_nodes")
+        .update({"score": payload.score})
+        .eq("user_id", payload.user_id)
+        .eq("node_id", payload.node_id),
+    )
     return res.data
 
+
+@app.post("/node-progress/updateScores")
+async def update_node_scores(payload: UpdateNodeScoresPayload):
+    """Ghi điểm nhiều node (vd. khi nộp bài test) trong một lần upsert"""
+    # Postgres không cho upsert cùng một (user_id, node_id) 2 lần trong 1 lệnh: giữ bản cuối
+    rows = {
+        (item.user_id, item.node_id): {"user_id": item.user_id, "node_id": item.node_id, "score": item.score}
+        for item in payload.updates
+    }
+    res = await run_query(
+        "user_nodes.upsert",
+        lambda db: db.table("user_nodes").upsert(list(rows.values()), on_conflict="user_id, node_id"),
+    )
+    return res.data
+
+
 @app.post("/node-progress/openNode")
-def open_node(user_id: int, node_id: int):
-    from supabase import create_client
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-    res = supabase.table("user_nodes") \
-        .update({"score": 0}) \
-        .eq("user_id", user_id) \
-        .eq("node_id", node_id) \
-        .execute()
+async def open_node(user_id: int, node_id: int):
+    res = await run_query(
+        "user_nodes.update",
+        lambda db: db.table("user_nodes")
+        .update({"score": 0})
+        .eq("user_id", user_id)
+        .eq("node_id", node_id),
+    )
     return res.data
 
 
@@ -744,18 +819,9 @@ async def handle_generate_exercises(request: GenerateExercisesInput):
                     context_text += f"- {d['content']}\n"
         
         # Fallback to local files if no RAG results (optional, or keep both)
-        reference_text = load_reference_materials(str(EXERCISES_FOLDER), max_files=3)
+        reference_text = exercise_corpus.get_text(max_files=3)
         
-        generation_config = {
-            "temperature": 0.7,
-        }
-        
-        # OPTIMIZATION: Re-use model if possible, but for now just keep it local as it's stateless
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            generation_config=generation_config,
-            system_instruction=EXERCISE_SYSTEM_INSTRUCTION
-        )
+        model = model_registry.get(MODEL_NAME, EXERCISE_SYSTEM_INSTRUCTION, EXERCISE_GENERATION_CONFIG)
         
         prompt = f"""Tạo {request.count} bài tập toán học về chủ đề: "{request.topic}"
 Độ khó: {request.difficulty}
@@ -787,7 +853,7 @@ YÊU CẦU:
 ## Bài 2
 [Tiếp tục...]"""
         
-        response = model.generate_content(prompt)
+        response = await llm_gateway.generate(model, prompt)
         
         if not response or not hasattr(response, 'text'):
             raise ValueError("Model không trả về phản hồi")
@@ -809,22 +875,37 @@ YÊU CẦU:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
 
-@app.post("/api/process-document")
+@app.post("/api/process-document", status_code=202)
 async def process_document(request: ProcessDocumentInput):
-    """Trigger document processing (RAG)"""
+    """Queue document processing (RAG); poll /api/process-document/{job_id} for the result"""
     try:
-        success = await rag_service.process_document(
+        job = await ingestion_queue.enqueue(
             user_id=request.userId,
             document_id=request.documentId,
             purpose=request.purpose
         )
-        if not success:
-            raise HTTPException(status_code=500, detail="Processing failed")
-        return {"status": "ok", "message": "Document processed successfully"}
+        return {"status": job["status"], "jobId": job["id"], "message": "Document queued for processing"}
     except Exception as e:
         print(f"Process document error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.get("/api/process-document/{job_id}")
+async def get_process_document_job(job_id: str):
+    """Status of a queued document processing job"""
+    job = await ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "jobId": job["id"],
+        "documentId": job["document_id"],
+        "purpose": job["purpose"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "maxAttempts": job["max_attempts"],
+        "error": job["last_error"],
+    }
+
 # ==============================
 #  API TẠO TEST DỰA TRÊN NODE
 # ==============================
@@ -854,18 +935,6 @@ async def generate_node_test(req: NodeTestRequest):
     try:
         topic = req.topic
 
-        model = genai.GenerativeModel(
-            "gemini-2.5-flash",
-            generation_config={
-                "temperature": 0.6,
-                "response_mime_type": "application/json",
-            },
-            system_instruction="Bạn là hệ thống sinh đề kiểm tra toán chuẩn THPT."
-        )
-
-        # ========================
-        #      PROMPT CHUẨN (SỬA LỖI 2A: BẮT BUỘC DÙNG LATEX)
-        # ========================
         # RAG Integration
         context_text = ""
         if req.userId:
@@ -875,7 +944,32 @@ async def generate_node_test(req: NodeTestRequest):
                 for d in docs:
                     context_text += f"- {d['content']}\n"
 
-        prompt = f"""
+        # Không có tài liệu riêng -> lấy đề dựng sẵn trong pool (học sinh chưa làm)
+        if not context_text:
+            pooled = await node_test_pool.take(topic, req.userId)
+            if pooled is not None:
+                return {"topic": topic, "test": pooled}
+
+        data = await _generate_node_test(topic, context_text)
+        if not context_text:
+            await node_test_pool.add(topic, data, served_to=req.userId)
+
+        return {
+            "topic": topic,
+            "test": data
+        }
+
+    except Exception as e:
+        print(f"❌ NODE TEST ERROR: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _generate_node_test(topic: str, context_text: str = "", coalesce: bool = True) -> dict:
+    """Gọi Gemini tạo đề cho 1 node và kiểm tra cấu trúc JSON trả về."""
+    # ========================
+    #      PROMPT CHUẨN (SỬA LỖI 2A: BẮT BUỘC DÙNG LATEX)
+    # ========================
+    prompt = f"""
 Tạo đề kiểm tra toán lớp 12 dựa 100% trên chủ đề: "{topic}"
 
 TÀI LIỆU THAM KHẢO:
@@ -916,7 +1010,7 @@ CẤU TRÚC JSON BẮT BUỘC (TUYỆT ĐỐI PHẢI ĐÚNG):
       "title": "PHẦN 1: TRẮC NGHIỆM",
       "questions": [
         {{
-          "id": 1,
+          "id": "mc1",
           "type": "multiple-choice",
           "prompt": "Câu hỏi...",
           "options": ["A", "B", "C", "D"],
@@ -957,83 +1051,42 @@ TẤT CẢ DẤU \\ TRONG LATEX PHẢI ĐƯỢC ESCAPE (ví dụ: \\\\frac, \\\\
 """
 
 
-        # ========================
-        #        GỌI AI
-        # ========================
-        response = model.generate_content(prompt)
-        raw = response.text
+    # ========================
+    #   GỌI AI + VALIDATE SCHEMA
+    # ========================
+    # Pool tạo nhiều biến thể cùng prompt nên phải tắt coalescing
+    try:
+        return await structured_test.generate_test(
+            prompt, topic, MODEL_NAME, NODE_TEST_SYSTEM_INSTRUCTION, TEST_GENERATION_CONFIG,
+            coalesce=coalesce,
+        )
+    except structured_test.TestGenerationError as e:
+        print(f"❌ NODE TEST SCHEMA ERROR: {e}")
+        raise HTTPException(status_code=500, detail="AI trả về JSON không hợp lệ.")
 
-        # ========================
-        # VALIDATE JSON (SỬA LỖI 2B: DÙNG HÀM CLEAN_JSON)
-        # ========================
-        try:
-            json_text = clean_json_response(raw)
-            if not json_text:
-                raise ValueError("Không tìm thấy JSON hợp lệ")
-            
-            data = json.loads(json_text)
-        except Exception as e:
-            print(f"❌ RAW JSON ERROR: {e}")
-            print(f"Raw response: {raw[:300]}...")
-            raise HTTPException(
-                status_code=500, 
-                detail="AI trả về JSON không hợp lệ."
-            )
-        
-        if "parts" not in data:
-            print(f"❌ Thiếu 'parts' trong JSON: {data}")
-            raise HTTPException(status_code=500, detail="Thiếu 'parts' trong JSON")
 
-        return {
-            "topic": topic,
-            "test": data
-        }
+@app.on_event("startup")
+async def start_node_test_pool():
+    if os.getenv("TEST_POOL_ENABLED", "1") == "0":
+        return
+    await node_test_pool.start(
+        lambda topic: _generate_node_test(topic, coalesce=False),
+        topics=list(KNOWN_NODE_LABELS.values()),
+    )
 
-    except Exception as e:
-        print(f"❌ NODE TEST ERROR: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
 
+@app.on_event("shutdown")
+async def stop_node_test_pool():
+    await node_test_pool.stop()
 
 
-# --- Chỉ function utility ---
-def escape_backslashes(obj):
-    if isinstance(obj, dict):
-        return {k: escape_backslashes(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [escape_backslashes(x) for x in obj]
-    elif isinstance(obj, str):
-        return obj.replace("\\", "\\\\")
-    else:
-        return obj
 
 @app.post("/api/generate-test")
 async def handle_generate_test(request: GenerateTestInput):
     """Generate a test based on PDF/Word reference materials"""
     try:
-        # 1️⃣ Kiểm tra cache trước: nếu đã có file thì trả luôn, không gọi Gemini nữa
-        cache_path = get_test_cache_path(request)
-        if cache_path.exists():
-            try:
-                with cache_path.open("r", encoding="utf-8") as f:
-                    cached_data = json.load(f)
-                print(f"✅ Trả đề thi từ cache: {cache_path.name}")
-                return cached_data
-            except Exception as e:
-                print(f"⚠️ Lỗi đọc cache {cache_path}: {e}. Sẽ tạo đề mới.")
-
         print(f"📝 Loading test reference materials for topic: {request.topic}")
-        reference_text = load_reference_materials(str(TESTS_FOLDER), max_files=3)
-
-        generation_config = {
-            "temperature": 0.6,
-            "response_mime_type": "application/json",
-        }
-
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            generation_config=generation_config,
-            system_instruction=TEST_SYSTEM_INSTRUCTION
-        )
+        reference_text = test_corpus.get_text(max_files=3)
 
         # RAG Integration
         context_text = ""
@@ -1044,60 +1097,19 @@ async def handle_generate_test(request: GenerateTestInput):
                 for d in docs:
                     context_text += f"- {d['content']}\n"
 
-        # ⚠️ Prompt dùng đúng y như bạn gửi
-        prompt = f"""Tạo đề kiểm tra TOÁN LỚP 12 về chủ đề: "{request.topic}" Độ khó: {request.difficulty} TÀI LIỆU THAM KHẢO: {context_text} {reference_text if reference_text else "Không có tài liệu. Tạo đề theo chuẩn THPT QG."} QUY TẮC QUAN TRỌNG (CHUẨN FORM THPT 2025): 1. Mỗi câu hỏi PHẢI có đầy đủ dữ liệu (phương trình, hàm số, đồ thị...) 2. Sử dụng LaTeX cho công thức: $x^2$ hoặc $x^2 + 2x + 1 = 0$ 3. Câu hỏi phải CỤ THỂ, KHÔNG mơ hồ 4. Đáp án phải CHÍNH XÁC 5. Cấu trúc đề: - Phần 1: Trắc nghiệm 4 lựa chọn (A,B,C,D) - Phần 2: Trắc nghiệm Đúng/Sai (4 ý a,b,c,d) - Phần 3: Trả lời ngắn (Điền số) VÍ DỤ MẪU: TRẮC NGHIỆM TỐT: "Câu 1: Phương trình $x^2 - 5x + 6 = 0$ có bao nhiêu nghiệm?" TRẮC NGHIỆM SAI (THIẾU DỮ LIỆU): "Câu 1: Phương trình có bao nhiêu nghiệm?" ❌ ĐÚNG/SAI TỐT: "Câu 5: Cho hàm số $y = x^3 - 3x + 1$. Xét tính đúng/sai của các mệnh đề sau: a) Hàm số đồng biến trên khoảng $(1; +\\infty)$ b) Đồ thị hàm số cắt trục hoành tại 3 điểm c) Hàm số có cực đại tại $x = -1$ d) $\\lim_{{x \\to +\\infty}} y = +\\infty$" QUAN TRỌNG - PHẦN ĐÚNG/SAI: Câu hỏi đúng/sai PHẢI có cấu trúc: - prompt: "Câu X: Cho [dữ liệu cụ thể]. Xét tính đúng/sai của các mệnh đề sau:" - statements: Mảng 4 mệnh đề CỤ THỂ, có thể đánh giá được VÍ DỤ MẪU ĐÚNG: {{ "id": "tf1", "type": "true-false", "prompt": "Câu 5: Cho hàm số $y = x^3 - 3x + 1$. Xét tính đúng/sai:", "statements": [ "Hàm số đồng biến trên khoảng $(1; +\\infty)$", "Đồ thị hàm số cắt trục hoành tại 3 điểm", "Hàm số có cực đại tại $x = -1$", "Giới hạn $\\lim_{{x \\to +\\infty}} y = +\\infty$" ], "answer": [true, true, true, true] }} VÍ DỤ SAI (KHÔNG LÀM THẾ NÀY): {{ "statements": ["a) Đúng", "b) Sai", "c) Đúng", "d) Sai"] ❌ }} ***QUAN TRỌNG VỀ JSON (BẮT BUỘC):*** Toàn bộ đầu ra là một chuỗi JSON. Do đó, tất cả các ký tự gạch chéo ngược (\\) BÊN TRONG chuỗi (ví dụ: trong LaTeX) PHẢI được thoát (escaped) bằng cách nhân đôi. VÍ DỤ: - SAI: "$\\frac{{1}}{{2}}$" - ĐÚNG: "$\\\\frac{{1}}{{2}}$" - SAI: "$\\lim_{{x \\to 0}}$" - ĐÚNG: "$\\\\lim_{{x \\\\to 0}}$" - SAI: "$(1; +\\infty)$" - ĐÚNG: "$(1; +\\\\infty)$" YÊU CẦU: Trả về JSON thuần túy, KHÔNG markdown code block: Trả về JSON: {{ "title": "KIỂM TRA {request.topic.upper()}", "parts": {{ "multipleChoice": {{ ... }}, "trueFalse": {{ "title": "PHẦN 2: ĐÚNG/SAI", "questions": [ {{ "id": "tf1", "type": "true-false", "prompt": "Câu 5: Cho hàm số $y = 2x^2 - 4x + 1$. Xét tính đúng/sai của các mệnh đề sau:", "statements": [ "Đồ thị hàm số có trục đối xứng $x = 1$", "Hàm số có giá trị nhỏ nhất bằng $-1$", "Đồ thị hàm số đi qua điểm $(0, 1)$", "Hàm số nghịch biến trên khoảng $(-\\\\infty; 1)$" ], "answer": [true, true, true, true] }} ] }}, "shortAnswer": {{ ... }} }} }} KHÔNG dùng a), b), c), d) trong statements! Mỗi statement là một mệnh đề hoàn chỉnh! LƯU Ý BẮT BUỘC: - KHÔNG dùng markdown
-json ...
-- Mỗi câu hỏi PHẢI có đầy đủ dữ liệu cụ thể - LaTeX dùng $ cho inline, $ cho display - TẤT CẢ DẤU \\ TRONG LATEX PHẢI ĐƯỢC ESCAPE (ví dụ: \\\\frac, \\\\lim, \\\\infty) - answer trong multipleChoice: 0=option[0], 1=option[1], 2=option[2], 3=option[3] - answer trong trueFalse: [true, false, true, false] - answer trong shortAnswer: string số (max 6 ký tự)"""
-
-        response = model.generate_content(prompt)
-
-        # --- Parse JSON an toàn (giữ logic cũ của bạn) ---
-        try:
-            json_text = clean_json_response(response.text)
-            if not json_text:
-                raise ValueError("Không tìm thấy JSON hợp lệ")
-
-            json_text = clean_json_response(response.text)
-            if not json_text:
-                raise ValueError("Không tìm thấy JSON hợp lệ")
-
-            # ✨ giữ hack cũ: escape \ trước khi json.loads
-            safe_json_text = json_text.replace("\\", "\\\\")  # tất cả \ → \\
-
-            result = json.loads(safe_json_text)
-
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON parse error: {e}")
-            print(f"Raw response: {response.text[:500]}")
-            raise HTTPException(
-                status_code=500,
-                detail="AI trả về dữ liệu không hợp lệ. Vui lòng thử lại."
-            )
-
-        # Validate structure
-        if "parts" not in result or "multipleChoice" not in result["parts"]:
-            raise HTTPException(
-                status_code=500,
-                detail="Dữ liệu đề thi thiếu cấu trúc 'parts' hoặc 'multipleChoice'"
-            )
-
-        # Đóng gói response chuẩn
-        response_data = {
+        # Đề thi được lưu theo đúng dữ liệu đưa vào prompt: học sinh không có tài liệu
+        # riêng sẽ dùng chung đề, request trùng nhau đang chạy chỉ gọi Gemini 1 lần
+        store_meta = {
             "topic": request.topic,
             "difficulty": request.difficulty,
-            "has_reference": bool(reference_text),
-            "test": result,
+            "testType": request.testType,
+            "numQuestions": request.numQuestions,
+            "context": hashlib.sha256(context_text.encode("utf-8")).hexdigest(),
+            "reference": hashlib.sha256(reference_text.encode("utf-8")).hexdigest(),
         }
-
-        # 2️⃣ Lưu cache để lần sau gọi lại không tốn quota
-        try:
-            with cache_path.open("w", encoding="utf-8") as f:
-                json.dump(response_data, f, ensure_ascii=False, indent=2)
-            print(f"💾 Đã lưu cache đề thi: {cache_path.name}")
-        except Exception as e:
-            print(f"⚠️ Không thể lưu cache đề thi: {e}")
-
-        return response_data
+        return await test_store.get_or_generate(
+            store_meta, lambda: _generate_test(request, reference_text, context_text)
+        )
 
     except HTTPException:
         raise
@@ -1116,22 +1128,47 @@ json ...
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _generate_test(request: GenerateTestInput, reference_text: str, context_text: str) -> dict:
+    # ⚠️ Prompt dùng đúng y như bạn gửi
+    prompt = f"""Tạo đề kiểm tra TOÁN LỚP 12 về chủ đề: "{request.topic}" Độ khó: {request.difficulty} TÀI LIỆU THAM KHẢO: {context_text} {reference_text if reference_text else "Không có tài liệu. Tạo đề theo chuẩn THPT QG."} QUY TẮC QUAN TRỌNG (CHUẨN FORM THPT 2025): 1. Mỗi câu hỏi PHẢI có đầy đủ dữ liệu (phương trình, hàm số, đồ thị...) 2. Sử dụng LaTeX cho công thức: $x^2$ hoặc $x^2 + 2x + 1 = 0$ 3. Câu hỏi phải CỤ THỂ, KHÔNG mơ hồ 4. Đáp án phải CHÍNH XÁC 5. Cấu trúc đề: - Phần 1: Trắc nghiệm 4 lựa chọn (A,B,C,D) - Phần 2: Trắc nghiệm Đúng/Sai (4 ý a,b,c,d) - Phần 3: Trả lời ngắn (Điền số) VÍ DỤ MẪU: TRẮC NGHIỆM TỐT: "Câu 1: Phương trình $x^2 - 5x + 6 = 0$ có bao nhiêu nghiệm?" TRẮC NGHIỆM SAI (THIẾU DỮ LIỆU): "Câu 1: Phương trình có bao nhiêu nghiệm?" ❌ ĐÚNG/SAI TỐT: "Câu 5: Cho hàm số $y = x^3 - 3x + 1$. Xét tính đúng/sai của các mệnh đề sau: a) Hàm số đồng biến trên khoảng $(1; +\\infty)$ b) Đồ thị hàm số cắt trục hoành tại 3 điểm c) Hàm số có cực đại tại $x = -1$ d) $\\lim_{{x \\to +\\infty}} y = +\\infty$" QUAN TRỌNG - PHẦN ĐÚNG/SAI: Câu hỏi đúng/sai PHẢI có cấu trúc: - prompt: "Câu X: Cho [dữ liệu cụ thể]. Xét tính đúng/sai của các mệnh đề sau:" - statements: Mảng 4 mệnh đề CỤ THỂ, có thể đánh giá được VÍ DỤ MẪU ĐÚNG: {{ "id": "tf1", "type": "true-false", "prompt": "Câu 5: Cho hàm số $y = x^3 - 3x + 1$. Xét tính đúng/sai:", "statements": [ "Hàm số đồng biến trên khoảng $(1; +\\infty)$", "Đồ thị hàm số cắt trục hoành tại 3 điểm", "Hàm số có cực đại tại $x = -1$", "Giới hạn $\\lim_{{x \\to +\\infty}} y = +\\infty$" ], "answer": [true, true, true, true] }} VÍ DỤ SAI (KHÔNG LÀM THẾ NÀY): {{ "statements": ["a) Đúng", "b) Sai", "c) Đúng", "d) Sai"] ❌ }} ***QUAN TRỌNG VỀ JSON (BẮT BUỘC):*** Toàn bộ đầu ra là một chuỗi JSON. Do đó, tất cả các ký tự gạch chéo ngược (\\) BÊN TRONG chuỗi (ví dụ: trong LaTeX) PHẢI được thoát (escaped) bằng cách nhân đôi. VÍ DỤ: - SAI: "$\\frac{{1}}{{2}}$" - ĐÚNG: "$\\\\frac{{1}}{{2}}$" - SAI: "$\\lim_{{x \\to 0}}$" - ĐÚNG: "$\\\\lim_{{x \\\\to 0}}$" - SAI: "$(1; +\\infty)$" - ĐÚNG: "$(1; +\\\\infty)$" YÊU CẦU: Trả về JSON thuần túy, KHÔNG markdown code block: Trả về JSON: {{ "title": "KIỂM TRA {request.topic.upper()}", "parts": {{ "multipleChoice": {{ ... }}, "trueFalse": {{ "title": "PHẦN 2: ĐÚNG/SAI", "questions": [ {{ "id": "tf1", "type": "true-false", "prompt": "Câu 5: Cho hàm số $y = 2x^2 - 4x + 1$. Xét tính đúng/sai của các mệnh đề sau:", "statements": [ "Đồ thị hàm số có trục đối xứng $x = 1$", "Hàm số có giá trị nhỏ nhất bằng $-1$", "Đồ thị hàm số đi qua điểm $(0, 1)$", "Hàm số nghịch biến trên khoảng $(-\\\\infty; 1)$" ], "answer": [true, true, true, true] }} ] }}, "shortAnswer": {{ ... }} }} }} KHÔNG dùng a), b), c), d) trong statements! Mỗi statement là một mệnh đề hoàn chỉnh! LƯU Ý BẮT BUỘC: - KHÔNG dùng markdown
+json ...
+- Mỗi câu hỏi PHẢI có đầy đủ dữ liệu cụ thể - LaTeX dùng $ cho inline, $ cho display - TẤT CẢ DẤU \\ TRONG LATEX PHẢI ĐƯỢC ESCAPE (ví dụ: \\\\frac, \\\\lim, \\\\infty) - answer trong multipleChoice: 0=option[0], 1=option[1], 2=option[2], 3=option[3] - answer trong trueFalse: [true, false, true, false] - answer trong shortAnswer: string số (max 6 ký tự)"""
+
+    # --- Sinh theo schema, chỉ sửa lại phần bị lỗi ---
+    try:
+        result = await structured_test.generate_test(
+            prompt, request.topic, MODEL_NAME, TEST_SYSTEM_INSTRUCTION, TEST_GENERATION_CONFIG
+        )
+    except structured_test.TestGenerationError as e:
+        print(f"❌ Test schema error: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="AI trả về dữ liệu không hợp lệ. Vui lòng thử lại."
+        )
+
+    # Đóng gói response chuẩn
+    response_data = {
+        "topic": request.topic,
+        "difficulty": request.difficulty,
+        "has_reference": bool(reference_text),
+        "test": result,
+    }
+    return response_data
+
+
 
 @app.post("/api/summarize-topic")
 async def handle_summarize_topic(request: SummarizeTopicInput):
     """Summarize a math topic"""
     try:
         print(f"📖 Summarizing topic: {request.topic}")
+
+        cache_payload = request.model_dump()
+        cached = await response_cache.get("summarize_topic", cache_payload)
+        if cached is not None:
+            return cached
         
-        generation_config = {
-            "temperature": 0.5,
-        }
-        
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            generation_config=generation_config,
-            system_instruction=SUMMARIZE_SYSTEM_INSTRUCTION
-        )
+        model = model_registry.get(MODEL_NAME, SUMMARIZE_SYSTEM_INSTRUCTION, SUMMARIZE_GENERATION_CONFIG)
         
         prompt = f"""Tóm tắt chủ đề sau một cách ngắn gọn, súc tích và dễ hiểu. 
 Sử dụng:
@@ -1142,7 +1179,7 @@ Sử dụng:
 Chủ đề: {request.topic}
 Độ chi tiết: {request.detail_level}"""
         
-        response = model.generate_content(prompt)
+        response = await llm_gateway.generate(model, prompt)
         
         if not response or not hasattr(response, 'text'):
             raise ValueError("Model không trả về phản hồi")
@@ -1154,10 +1191,12 @@ Chủ đề: {request.topic}
         
         print(f"✅ Generated summary: {len(summary_text)} characters")
         
-        return {
+        result = {
             "topic": request.topic,
             "summary": summary_text
         }
+        await response_cache.set("summarize_topic", cache_payload, result)
+        return result
         
     except Exception as e:
         print(f"❌ Summarize topic error: {e}")
@@ -1170,16 +1209,12 @@ Chủ đề: {request.topic}
 async def handle_geogebra(request: GeogebraInputSchema):
     """Generate GeoGebra commands"""
     try:
-        generation_config = {
-            "temperature": 0.3,
-            "response_mime_type": "application/json",
-        }
-        
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            generation_config=generation_config,
-            system_instruction=GEOGEBRA_SYSTEM_INSTRUCTION
-        )
+        cache_payload = request.model_dump()
+        cached = await response_cache.get("geogebra", cache_payload)
+        if cached is not None:
+            return cached
+
+        model = model_registry.get(MODEL_NAME, GEOGEBRA_SYSTEM_INSTRUCTION, GEOGEBRA_GENERATION_CONFIG)
         
         prompt = f"""Tạo lệnh GeoGebra cho: {request.request}
 
@@ -1188,17 +1223,13 @@ Trả về JSON:
   "commands": ["command1", "command2"]
 }}"""
         
-        response = model.generate_content(prompt)
-        # SỬA LỖI: Dùng hàm clean_json
-        json_text = clean_json_response(response.text)
-        if not json_text:
-            raise ValueError("Không tìm thấy JSON hợp lệ")
-            
-        result = json.loads(json_text)
+        response = await llm_gateway.generate(model, prompt)
+        result = json_repair.parse_model_json(response.text)
         
         if "commands" not in result or not isinstance(result["commands"], list):
             raise ValueError("Invalid response format")
         
+        await response_cache.set("geogebra", cache_payload, result)
         return result
         
     except Exception as e:
@@ -1212,14 +1243,7 @@ async def handle_analyze_test_result(request: AnalyzeTestResultInput):
     Phân tích kết quả bài kiểm tra và đưa ra đánh giá, lời khuyên chi tiết
     """
     try:
-        generation_config = {
-            "temperature": 0.6,
-        }
-        
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            generation_config=generation_config,
-        )
+        model = model_registry.get(MODEL_NAME, None, ANALYZE_GENERATION_CONFIG)
         
         attempt = request.testAttempt
         weak_topics = request.weakTopics
@@ -1297,20 +1321,13 @@ LƯU Ý:
 - Dùng giọng điệu thân thiện, khích lệ, như một gia sư
 - Tập trung vào việc giúp học sinh TỰ TIN hơn"""
         
-        response = model.generate_content(prompt)
+        response = await llm_gateway.generate(model, prompt)
         
-        # SỬA LỖI: Dùng hàm clean_json
-        json_text = clean_json_response(response.text)
-        if not json_text:
-            print("❌ Không tìm thấy JSON trong output AI")
-            print("Raw response:", response.text[:400])
-            raise HTTPException(status_code=500, detail="AI trả về dữ liệu không hợp lệ")
-
         try:
-            result = json.loads(json_text)
+            result = json_repair.parse_model_json(response.text)
         except json.JSONDecodeError as e:
             print("❌ JSON decode error:", e)
-            print("JSON extracted:", json_text[:400])
+            print("Raw response near error:", repr(response.text[max(e.pos - 200, 0):e.pos + 200]))
             raise HTTPException(status_code=500, detail="AI trả về JSON lỗi")
 
         return result
@@ -1331,17 +1348,6 @@ async def handle_generate_adaptive_test(request: GenerateAdaptiveTestInput):
         print(f"📝 Generating adaptive test for user: {request.userId}")
         print(f"Weak topics: {request.weakTopics}")
         
-        generation_config = {
-            "temperature": 0.6,
-            "response_mime_type": "application/json",
-        }
-        
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            generation_config=generation_config,
-            system_instruction=TEST_SYSTEM_INSTRUCTION
-        )
-        
         topics_str = ", ".join(request.weakTopics)
         
         # --- PROMPT NÀY ĐÃ TỐT (GIỮ NGUYÊN) ---
@@ -1376,16 +1382,12 @@ LƯU Ý BẮT BUỘC:
 
 Trả về JSON thuần túy (KHÔNG dùng markdown code block)."""
         
-        response = model.generate_content(prompt)
-        
-        # --- SỬA LỖI 2C: BỔ SUNG PARSING JSON AN TOÀN ---
         try:
-            json_text = clean_json_response(response.text)
-            if not json_text:
-                raise ValueError("Không tìm thấy JSON hợp lệ")
-            result = json.loads(json_text)
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON parse error: {e}")
+            result = await structured_test.generate_test(
+                prompt, topics_str, MODEL_NAME, TEST_SYSTEM_INSTRUCTION, TEST_GENERATION_CONFIG
+            )
+        except structured_test.TestGenerationError as e:
+            print(f"❌ Adaptive test schema error: {e}")
             raise HTTPException(status_code=500, detail="AI trả về dữ liệu không hợp lệ")
         
         return {
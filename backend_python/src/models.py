@@ -5,6 +5,8 @@ from typing import List, Optional, Literal
 class NodeProgress(BaseModel):
     user_id: str
     node_id: str
+    # node_progress.mindmap_id là NOT NULL
+    mindmap_id: Optional[str] = None
     opened: bool
     score: float | None = None
 class StudyStatus(BaseModel):
@@ -1,9 +1,10 @@
+import asyncio
 from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 
-from src.supabase_client import supabase
+from src.supabase_client import run_query
 from src.ai_flows.generate_test_flow import generate_test, GenerateTestInput
 
 router = APIRouter(tags=["adaptive-test"])
@@ -45,22 +46,24 @@ def _pick_effective_difficulty(
 @router.post("/api/generate-adaptive-test")
 async def generate_adaptive_test(request: GenerateAdaptiveTestRequest):
     try:
-        # lấy profile
-        prof_res = (
-            supabase.from_("student_profiles")
-            .select("target_score")
-            .eq("user_id", request.userId)
-            .execute()
+        # lấy profile và hiệu suất song song
+        prof_res, perf_res = await asyncio.gather(
+            run_query(
+                "student_profiles.select",
+                lambda db: db.from_("student_profiles")
+                .select("target_score")
+                .eq("user_id", request.userId),
+            ),
+            run_query(
+                "user_performance_summary.select",
+                lambda db: db.from_("user_performance_summary")
+                .select("average_score")
+                .eq("user_id", request.userId),
+            ),
         )
         profile = prof_res.data[0] if prof_res.data else {}
         target_score = profile.get("target_score")
 
-        perf_res = (
-            supabase.from_("user_performance_summary")
-            .select("average_score")
-            .eq("user_id", request.userId)
-            .execute()
-        )
         perf = perf_res.data[0] if perf_res.data else {}
         average_score = perf.get("average_score")
 
@@ -4,31 +4,22 @@ from __future__ import annotations
 import hashlib
 import time
 from collections import defaultdict
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 
-from src.ai_config import genai
 from src.services import rag_service
-from src.supabase_client import supabase
+from src.services.llm_gateway import llm_gateway
+from src.services.model_registry import model_registry
+from src.services.response_cache import response_cache
+from src.supabase_client import run_query
 
 router = APIRouter(prefix="/api/learning", tags=["learning"])
 
 
-# --- Simple caches to keep responses stable between requests ---
-_CONTENT_CACHE: Dict[str, Dict[str, Any]] = {}
+# --- Per-user exercise history to avoid repeating questions ---
 _EXERCISE_HISTORY: Dict[str, Set[str]] = defaultdict(set)
-_CACHE_TTL_SECONDS = 600
-
-
-def _cache_key(prefix: str, payload: Dict[str, Any]) -> str:
-    raw = prefix + str(sorted(payload.items()))
-    return hashlib.sha256(raw.encode()).hexdigest()
-
-
-def _now() -> float:
-    return time.time()
 
 
 class NodeContentRequest(BaseModel):
@@ -124,23 +115,28 @@ class UploadArtifactRequest(BaseModel):
     purpose: str = "chat"
 
 
-async def _call_model(prompt: str, fallback: str) -> str:
-    """Call Gemini with strong guardrails; fall back to deterministic text."""
+async def _call_model(prompt: str, fallback: str) -> Tuple[str, bool]:
+    """Call Gemini with strong guardrails; fall back to deterministic text.
+
+    Returns ``(text, used_fallback)``.
+    """
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        result = model.generate_content(prompt)
-        return result.text or fallback
+        model = model_registry.get("gemini-1.5-flash")
+        result = await llm_gateway.generate(model, prompt)
+        if result.text:
+            return result.text, False
+        return fallback, True
     except Exception as exc:  # pragma: no cover - network issues
         print(f"Gemini call failed, fallback used: {exc}")
-        return fallback
+        return fallback, True
 
 
 @router.post("/node-content", response_model=NodeContentResponse)
 async def generate_node_content(body: NodeContentRequest) -> NodeContentResponse:
-    payload_key = _cache_key("content", body.dict())
-    cached = _CONTENT_CACHE.get(payload_key)
-    if cached and _now() - cached["ts"] < _CACHE_TTL_SECONDS:
-        return cached["value"]  # type: ignore[return-value]
+    cache_payload = body.dict()
+    cached = await response_cache.get("node_content", cache_payload)
+    if cached is not None:
+        return NodeContentResponse(**cached)
 
     references: List[str] = []
     try:
@@ -157,7 +153,7 @@ async def generate_node_content(body: NodeContentRequest) -> NodeContentResponse
         "Thêm mục 'Sai lầm phổ biến' và 'Liên hệ thực tế' để học sinh tự phản biện. "
         f"Chủ đề: {body.topic}.\nNguồn gợi ý: {ref_text}"
     )
-    overview = await _call_model(
+    overview, used_fallback = await _call_model(
         prompt,
         fallback=(
             f"Tổng quan nhanh về {body.topic}.\n\n"
@@ -179,7 +175,9 @@ async def generate_node_content(body: NodeContentRequest) -> NodeContentResponse
           {"id": body.nodeId or body.topic, "parent": "root", "label": body.topic},
         ],
     )
-    _CONTENT_CACHE[payload_key] = {"ts": _now(), "value": response.dict()}
+    if not used_fallback:
+        # Nội dung dự phòng (Gemini lỗi tạm thời) không được cache cho các học sinh khác
+        await response_cache.set("node_content", cache_payload, response.dict())
     return response
 
 
@@ -345,7 +343,7 @@ async def upload_artifact(body: UploadArtifactRequest) -> Dict[str, Any]:
         "purpose": body.purpose,
         "created_at": created_at,
     }
-    document_response = supabase.table("documents").insert(doc_payload).execute()
+    document_response = await run_query("documents.insert", lambda db: db.table("documents").insert(doc_payload))
     document_id = document_response.data[0]["id"]
 
     chunk_rows = []
@@ -362,6 +360,6 @@ async def upload_artifact(body: UploadArtifactRequest) -> Dict[str, Any]:
             }
         )
     if chunk_rows:
-        supabase.table("document_chunks").insert(chunk_rows).execute()
+        await run_query("document_chunks.insert", lambda db: db.table("document_chunks").insert(chunk_rows))
 
     return {"documentId": document_id, "chunks": len(chunk_rows)}
@@ -1,59 +1,81 @@
 # src/routes/node_progress.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from src.models import NodeProgress
-from src.supabase_client import supabase
+from src.services.progress_buffer import InvalidProgressRow, progress_buffer
+from src.services.read_cache import ReadThroughCache, etag_matches, node_progress_cache
+from src.supabase_client import run_query
 from datetime import datetime
 
 router = APIRouter(prefix="/node-progress", tags=["node-progress"])
 
 # ---------------------------------
 # POST /node-progress/update
-# Tối ưu: Sử dụng UPSERT để xử lý 1 lần gọi DB
+# Write-behind: gom các update theo (user_id, node_id) rồi UPSERT nhiều dòng một lần
 # ---------------------------------
 @router.post("/update")
-def update_node_progress(data: NodeProgress):
+async def update_node_progress(data: NodeProgress):
     try:
-        # Calculate status
-        status = "learning"
-        if data.score is not None and data.score >= 80:
-            status = "mastered"
-
-        # Chuẩn bị dữ liệu
+        # Chuẩn bị dữ liệu (đúng các cột của bảng node_progress; score là integer 0..100)
         payload = {
             "user_id": data.user_id,
             "node_id": data.node_id,
+            "mindmap_id": data.mindmap_id,
             "opened": data.opened,
-            "score": data.score,
-            "status": status,
-            "updated_at": datetime.utcnow().isoformat()
+            "score": round(data.score) if data.score is not None else None,
+            "last_updated": datetime.utcnow().isoformat()
         }
 
-        # Sử dụng upsert: Nếu trùng (user_id, node_id) thì update, chưa có thì insert
+        # progress_buffer ghi bằng upsert(on_conflict="user_id, node_id")
         # Yêu cầu: Bảng database phải có constraint unique(user_id, node_id) như code SQL bên trên
-        response = supabase.table("node_progress").upsert(
-            payload, 
-            on_conflict="user_id, node_id"
-        ).execute()
+        # PROGRESS_WRITE_BEHIND=0 -> ghi ngay, lỗi DB trả về 500 như trước
+        await progress_buffer.write(payload)
+        await node_progress_cache.invalidate(data.user_id)
 
-        return {"status": "ok", "data": response.data}
+        # Update trước đó bị bỏ sau nhiều lần ghi lỗi -> báo cho client thay vì im lặng
+        return {"status": "ok", "data": [payload], "failed_writes": progress_buffer.failed_for(data.user_id)}
 
+    except InvalidProgressRow as e:
+        # Dòng không hợp lệ bị từ chối ngay, không vào buffer
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"❌ Error updating node progress: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _load_progress(user_id: str):
+    res = await run_query(
+        "node_progress.select",
+        lambda db: db.table("node_progress")
+        .select("*")
+        .eq("user_id", user_id),
+    )
+
+    # Chỉ cache dữ liệu DB; update còn trong buffer (của worker này) được cộng lúc đọc
+    return res.data or []
+
+
 # ---------------------------------
 # GET /node-progress/{user_id}
+# Đọc qua cache; FE gửi If-None-Match thì trả 304 nếu không đổi
 # ---------------------------------
 @router.get("/{user_id}")
-def get_all_progress(user_id: str):
+async def get_all_progress(user_id: str, request: Request, response: Response):
     try:
-        res = supabase.table("node_progress") \
-            .select("*") \
-            .eq("user_id", user_id) \
-            .execute()
-
-        return res.data or []
+        cached = await node_progress_cache.get_or_load(user_id, lambda: _load_progress(user_id))
     except Exception as e:
         print(f"❌ Error fetching progress: {e}")
-        return [] # Trả về mảng rỗng thay vì lỗi để FE không bị crash
\ No newline at end of file
+        return [] # Trả về mảng rỗng thay vì lỗi để FE không bị crash
+
+    if progress_buffer.pending_for(user_id):
+        # Cộng thêm các update còn nằm trong buffer chưa ghi xuống DB
+        cached = ReadThroughCache.encode(progress_buffer.merge_into(user_id, cached.value))
+
+    headers = {"ETag": cached.etag, "Cache-Control": "private, no-cache"}
+    failed = progress_buffer.failed_for(user_id)
+    if failed:
+        # Số update không ghi được xuống DB (chi tiết trong failed_writes của POST /update)
+        headers["X-Progress-Write-Errors"] = str(len(failed))
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return cached.value
\ No newline at end of file
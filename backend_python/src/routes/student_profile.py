@@ -2,7 +2,8 @@ from fastapi import APIRouter, HTTPException
 from datetime import datetime
 
 from src.models import StudentProfileUpdate, StudentProfileResponse, StudyStatus
-from src.supabase_client import supabase
+from src.services.read_cache import performance_summary_cache, student_profile_cache
+from src.supabase_client import run_query
 
 router = APIRouter(prefix="/student-profile", tags=["student-profile"])
 
@@ -55,34 +56,52 @@ def generate_study_status(current_avg: float, target: int | None, goal_text: str
         )
 
 
+async def _load_profile(user_id: str) -> dict:
+    # maybe_single(): trả về 0 hoặc 1 record, tránh lỗi khi user chưa có profile
+    res = await run_query(
+        "student_profiles.select",
+        lambda db: db.table("student_profiles")
+        .select("*")
+        .eq("id", user_id)
+        .maybe_single(),
+    )
+
+    if not res or not res.data:
+        return StudentProfileResponse(
+            user_id=user_id,
+            target_score=None,
+            goal_text=None,
+            study_status=None,
+        ).model_dump()
+
+    data = res.data
+    return StudentProfileResponse(
+        user_id=data.get("id", user_id),
+        target_score=data.get("target_score"),
+        goal_text=data.get("goal_text"),
+        study_status=data.get("study_status"),
+    ).model_dump()
+
+
+async def _load_current_avg(user_id: str) -> float:
+    perf_res = await run_query(
+        "user_performance_summary.select",
+        lambda db: db.table("user_performance_summary")
+        .select("avg_score")
+        .eq("user_id", user_id),
+    )
+
+    if perf_res.data and isinstance(perf_res.data, list) and len(perf_res.data) > 0:
+        return perf_res.data[0].get("avg_score") or 0.0
+    return 0.0
+
+
 @router.get("/{user_id}", response_model=StudentProfileResponse)
-def get_student_profile(user_id: str):
+async def get_student_profile(user_id: str):
     """Trả về profile nếu có, nếu chưa có thì trả về mặc định (không 500)."""
     try:
-        # maybe_single(): trả về 0 hoặc 1 record, tránh lỗi khi user chưa có profile
-        res = (
-            supabase.table("student_profiles")
-            .select("*")
-            .eq("id", user_id)
-            .maybe_single()
-            .execute()
-        )
-
-        if not res.data:
-            return StudentProfileResponse(
-                user_id=user_id,
-                target_score=None,
-                goal_text=None,
-                study_status=None,
-            )
-
-        data = res.data
-        return StudentProfileResponse(
-            user_id=data.get("id", user_id),
-            target_score=data.get("target_score"),
-            goal_text=data.get("goal_text"),
-            study_status=data.get("study_status"),
-        )
+        cached = await student_profile_cache.get_or_load(user_id, lambda: _load_profile(user_id))
+        return StudentProfileResponse.model_validate(cached.value)
 
     except Exception as e:
         # Giữ nguyên HTTP 500 nhưng include lỗi gốc để debug nhanh
@@ -90,20 +109,13 @@ def get_student_profile(user_id: str):
 
 
 @router.put("/{user_id}", response_model=StudentProfileResponse)
-def update_student_profile(user_id: str, payload: StudentProfileUpdate):
+async def update_student_profile(user_id: str, payload: StudentProfileUpdate):
     """Upsert profile + sinh study_status. Tuyệt đối không gọi .select() sau update/insert (postgrest-py)."""
     try:
-        # 1) Lấy dữ liệu hiệu suất hiện tại để phân tích
-        perf_res = (
-            supabase.table("user_performance_summary")
-            .select("avg_score")
-            .eq("user_id", user_id)
-            .execute()
-        )
-
-        current_avg = 0.0
-        if perf_res.data and isinstance(perf_res.data, list) and len(perf_res.data) > 0:
-            current_avg = perf_res.data[0].get("avg_score") or 0.0
+        # 1) Lấy dữ liệu hiệu suất hiện tại để phân tích (cache theo TTL)
+        current_avg = (
+            await performance_summary_cache.get_or_load(user_id, lambda: _load_current_avg(user_id))
+        ).value
 
         # 2) Sinh đánh giá
         new_status = generate_study_status(
@@ -121,11 +133,11 @@ def update_student_profile(user_id: str, payload: StudentProfileUpdate):
         }
 
         # 4) Update (KHÔNG .select() ở write builder)
-        data_res = (
-            supabase.table("student_profiles")
+        data_res = await run_query(
+            "student_profiles.update",
+            lambda db: db.table("student_profiles")
             .update(update_data)
-            .eq("id", user_id)
-            .execute()
+            .eq("id", user_id),
         )
 
         # Nếu chưa có record (hoặc update không ảnh hưởng row nào), fallback insert
@@ -134,7 +146,9 @@ def update_student_profile(user_id: str, payload: StudentProfileUpdate):
             record = data_res.data[0] if isinstance(data_res.data, list) else data_res.data
         else:
             insert_data = {"id": user_id, **update_data, "full_name": "Student"}
-            ins_res = supabase.table("student_profiles").insert(insert_data).execute()
+            ins_res = await run_query(
+                "student_profiles.insert", lambda db: db.table("student_profiles").insert(insert_data)
+            )
             if ins_res.data:
                 record = ins_res.data[0] if isinstance(ins_res.data, list) else ins_res.data
 
@@ -144,12 +158,15 @@ def update_student_profile(user_id: str, payload: StudentProfileUpdate):
                 detail="Update/Insert succeeded but no data returned. Check PostgREST return preference / RLS.",
             )
 
-        return StudentProfileResponse(
+        profile = StudentProfileResponse(
             user_id=record.get("id", user_id),
             target_score=record.get("target_score"),
             goal_text=record.get("goal_text"),
             study_status=record.get("study_status"),
         )
+        # Ghi đè cache bằng bản mới thay vì chờ TTL
+        await student_profile_cache.set(user_id, profile.model_dump())
+        return profile
 
     except HTTPException:
         raise
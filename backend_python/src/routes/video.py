@@ -1,60 +1,89 @@
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
-from sqlmodel import Session
+import hmac
+import os
+from typing import Optional
 
-from src.db import get_session
-from src.schemas.video import CreateVideoRequest, NodeVideoRead, ProgressEvent, VideoSegmentRead
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+
+from src.schemas.video import (
+    CreateVideoRequest,
+    NodeVideoRead,
+    ProgressEvent,
+    ProviderCallback,
+    VideoSegmentRead,
+)
+from src.services.read_cache import CachedValue, etag_matches
 from src.services.video_service import (
-    create_video,
-    get_video,
-    get_video_by_node_id,  # <-- Cần import hàm này
-    list_segments,
-    trigger_next_segment,
+    read_video,
+    read_video_by_node,
+    report_progress as handle_progress,
+    request_video,
+    video_poller,
+    video_stats,
 )
 
 router = APIRouter(prefix="/videos", tags=["videos"])
 
+WEBHOOK_SECRET = os.getenv("VIDEO_WEBHOOK_SECRET")
+
+
+def _cached_response(cached: CachedValue, request: Request, response: Response):
+    # FE poll 2s/lần: gửi If-None-Match thì trả 304 nếu video không đổi
+    headers = {"ETag": cached.etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return cached.value
+
 
 @router.post("/", response_model=NodeVideoRead)
-def create_node_video(
-    payload: CreateVideoRequest,
-    background_tasks: BackgroundTasks,
-    session: Session = Depends(get_session),
+async def create_node_video(payload: CreateVideoRequest):
+    return (await request_video(payload)).value
+
+
+@router.post("/provider-callback")
+async def provider_callback(
+    payload: ProviderCallback,
+    x_webhook_secret: Optional[str] = Header(default=None),
 ):
-    video = create_video(session, payload, background_tasks)
-    segments = list_segments(session, video.id)
-    return NodeVideoRead.from_orm(video).copy(update={"segments": segments})
+    """Webhook cho provider báo job xong, thay vì chờ poller hỏi."""
+    if not WEBHOOK_SECRET:
+        # Không có secret thì ai cũng ghi được video_url -> tắt webhook
+        raise HTTPException(status_code=404, detail="Webhook is not configured")
+    if not x_webhook_secret or not hmac.compare_digest(x_webhook_secret.encode(), WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    tracked = await video_poller.complete(payload.provider_job_id, payload.model_dump())
+    return {"tracked": tracked}
+
+
+@router.get("/metrics")
+async def get_video_metrics():
+    """Số liệu của read cache, poller, scheduler và prefetch planner."""
+    return video_stats()
 
 
 # --- BỔ SUNG ENDPOINT NÀY ---
 @router.get("/node/{node_id}", response_model=NodeVideoRead)
-def get_video_by_node(node_id: str, session: Session = Depends(get_session)):
+async def get_video_by_node(node_id: str, request: Request, response: Response):
     """Lấy video theo node_id thay vì video_id"""
-    video = get_video_by_node_id(session, node_id)
-    if not video:
+    cached = await read_video_by_node(node_id)
+    if cached is None:
         raise HTTPException(status_code=404, detail=f"Video for node '{node_id}' not found")
-    segments = list_segments(session, video.id)
-    return NodeVideoRead.from_orm(video).copy(update={"segments": segments})
+    return _cached_response(cached, request, response)
 # ----------------------------
 
 
 @router.get("/{video_id}", response_model=NodeVideoRead)
-def get_node_video(video_id: str, session: Session = Depends(get_session)):
-    video = get_video(session, video_id)
-    segments = list_segments(session, video_id)
-    return NodeVideoRead.from_orm(video).copy(update={"segments": segments})
+async def get_node_video(video_id: str, request: Request, response: Response):
+    return _cached_response(await read_video(video_id), request, response)
 
 
 @router.get("/{video_id}/segments", response_model=list[VideoSegmentRead])
-def get_video_segments(video_id: str, session: Session = Depends(get_session)):
-    return list_segments(session, video_id)
+async def get_video_segments(video_id: str):
+    return (await read_video(video_id)).value["segments"]
 
 
 @router.post("/{video_id}/progress", response_model=list[VideoSegmentRead])
-def report_progress(
-    video_id: str,
-    event: ProgressEvent,
-    background_tasks: BackgroundTasks,
-    session: Session = Depends(get_session),
-):
-    trigger_next_segment(session, video_id, event.current_second, background_tasks)
-    return list_segments(session, video_id)
\ No newline at end of file
+async def report_progress(video_id: str, event: ProgressEvent):
+    return await handle_progress(
+        video_id, event.current_second, stopped=event.stopped, viewer_id=event.viewer_id
+    )
\ No newline at end of file
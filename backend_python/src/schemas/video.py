@@ -2,7 +2,7 @@ import uuid
 from datetime import datetime
 from typing import List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class CreateVideoRequest(BaseModel):
@@ -20,11 +20,12 @@ class VideoSegmentRead(BaseModel):
     provider_job_id: Optional[str] = None
     video_url: Optional[str] = None
     error_message: Optional[str] = None
+    # Lúc người xem cần tới segment (ưu tiên trong hàng đợi)
+    needed_at: Optional[datetime] = None
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class NodeVideoRead(BaseModel):
@@ -37,9 +38,19 @@ class NodeVideoRead(BaseModel):
     updated_at: datetime
     segments: List[VideoSegmentRead] = Field(default_factory=list)
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ProgressEvent(BaseModel):
     current_second: int
+    # True khi người xem tạm dừng / rời trang: huỷ các segment prefetch chưa bắt đầu
+    stopped: bool = False
+    # Id phiên xem do FE sinh; video dùng chung nên chỉ huỷ khi không còn ai xem
+    viewer_id: str = Field(default="", max_length=64)
+
+
+class ProviderCallback(BaseModel):
+    provider_job_id: str
+    status: str
+    video_url: Optional[str] = None
+    error_message: Optional[str] = None
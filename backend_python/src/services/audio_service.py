@@ -1,8 +1,11 @@
 # src/services/audio_service.py
+import asyncio
 import os
 import edge_tts
 import google.generativeai as genai
 from src.ai_config import genai
+from src.services.llm_gateway import llm_gateway
+from src.services.model_registry import model_registry
 
 async def transcribe_audio(file_path: str, mime_type: str = "audio/mp3") -> str:
     """
@@ -11,14 +14,15 @@ async def transcribe_audio(file_path: str, mime_type: str = "audio/mp3") -> str:
     uploaded_file = None
     try:
         print(f"Uploading file {file_path} to Gemini...")
-        uploaded_file = genai.upload_file(file_path, mime_type=mime_type)
+        uploaded_file = await asyncio.to_thread(genai.upload_file, file_path, mime_type=mime_type)
         
         # Dùng model 1.5-flash cho nhanh và rẻ
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        model = model_registry.get("gemini-1.5-flash")
         
         print("Generating transcription...")
         # Prompt tiếng Việt để nhận diện tốt hơn
-        result = model.generate_content(
+        result = await llm_gateway.generate(
+            model,
             [uploaded_file, "Hãy nghe file âm thanh này và chép lại chính xác nội dung thành văn bản. Chỉ trả về nội dung văn bản, không thêm lời dẫn."],
         )
         return result.text.strip()
@@ -30,7 +34,7 @@ async def transcribe_audio(file_path: str, mime_type: str = "audio/mp3") -> str:
         # Quan trọng: Xóa file trên Google Server sau khi dùng xong
         if uploaded_file:
             try:
-                uploaded_file.delete()
+                await asyncio.to_thread(uploaded_file.delete)
                 print("Deleted remote file on Gemini.")
             except:
                 pass
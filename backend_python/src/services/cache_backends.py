@@ -0,0 +1,180 @@
+"""Key/value backends shared by the caches in ``src.services``.
+
+Every backend stores ``str`` values with a TTL behind the same async
+``get`` / ``set`` / ``delete`` interface:
+- ``MemoryBackend``: in-process LRU, optionally capped by total bytes,
+- ``SQLiteBackend``: a local file shared by every uvicorn worker on the host,
+- ``RedisBackend``: any Redis-compatible server (needs the ``redis`` package).
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # pragma: no cover - optional dependency
+    redis_asyncio = None
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry and optional byte budget."""
+
+    name = "memory"
+    SWEEP_EVERY = 256
+
+    def __init__(self, max_entries: int = 10000, max_bytes: Optional[int] = None) -> None:
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._sets = 0
+        self.evictions = 0
+
+    def _drop(self, key: str) -> None:
+        self._bytes -= self._data.pop(key)[2]
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value, _ = item
+            if expires_at < time.monotonic():
+                self._drop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            size = len(value.encode("utf-8"))
+            self._data[key] = (time.monotonic() + ttl_seconds, value, size)
+            self._bytes += size
+            self._sets += 1
+            if self._sets % self.SWEEP_EVERY == 0:
+                self._sweep()
+            while len(self._data) > 1 and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _, _) in self._data.items() if expires_at < now]:
+            self._drop(key)
+
+    async def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def size(self) -> int:
+        return len(self._data)
+
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
+class SQLiteBackend:
+    """SQLite file tier; expired rows are purged every ``purge_every`` writes."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, table: str = "cache", purge_every: int = 500) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.table = table
+        self.purge_every = max(1, purge_every)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def _set(self, key: str, value: str, ttl_seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl_seconds),
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._db.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            self._db.commit()
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._db.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl_seconds)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class RedisBackend:
+    """Redis (or any RESP-compatible server such as KeyDB / Valkey)."""
+
+    name = "redis"
+
+    def __init__(self, url: str) -> None:
+        self._client = redis_asyncio.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        await self._client.set(key, value, px=int(ttl_seconds * 1000))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(key)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+def is_redis_url(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith(("redis://", "rediss://", "unix://"))
+
+
+def build_redis_backend(url: Optional[str], env_name: str) -> Optional[RedisBackend]:
+    """``RedisBackend`` for ``url``, or None (with a warning if redis is missing)."""
+    if not is_redis_url(url):
+        return None
+    if redis_asyncio is None:
+        print(f"⚠️ {env_name} is set but the redis package is not installed; ignoring it")
+        return None
+    return RedisBackend(url)
@@ -0,0 +1,136 @@
+"""Two-tier cache for query embeddings.
+
+Keys are (model, task_type, normalized text). The first tier is an in-process
+LRU; the optional second tier is a SQLite file (``EMBEDDING_CACHE_DB``) so the
+cache survives restarts and is shared by every worker on the host.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def normalize_text(text: str) -> str:
+    """NFC + collapsed whitespace, so trivially different spellings share a key."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    raw = f"{model}\x1f{task_type}\x1f{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = 4096, db_path: Optional[str] = None) -> None:
+        self.max_entries = max(1, max_entries)
+        self.db_path = db_path
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+        if db_path:
+            self._open_db(db_path)
+
+    # ----- SQLite tier -----
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._db = conn
+        except Exception as e:
+            print(f"⚠️ Embedding cache DB disabled ({db_path}): {e}")
+            self._db = None
+
+    def _db_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        return array("f", row[0]).tolist()
+
+    def _db_put(self, key: str, vector: List[float]) -> None:
+        blob = array("f", vector).tobytes()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                (key, blob, time.time()),
+            )
+            self._db.commit()
+
+    # ----- memory tier -----
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    # ----- public API -----
+
+    async def get(self, model: str, task_type: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, task_type, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return vector
+
+        if self._db is not None:
+            try:
+                vector = await asyncio.to_thread(self._db_get, key)
+            except Exception as e:
+                print(f"⚠️ Embedding cache read failed: {e}")
+                vector = None
+            if vector is not None:
+                self._stats["disk_hits"] += 1
+                self._remember(key, vector)
+                return vector
+
+        self._stats["misses"] += 1
+        return None
+
+    async def put(self, model: str, task_type: str, text: str, vector: List[float]) -> None:
+        if not vector:
+            return
+        key = cache_key(model, task_type, text)
+        self._remember(key, vector)
+        self._stats["writes"] += 1
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._db_put, key, vector)
+            except Exception as e:
+                print(f"⚠️ Embedding cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        return {
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "persistent": self._db is not None,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            **self._stats,
+        }
+
+
+query_embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")),
+    db_path=os.getenv("EMBEDDING_CACHE_DB") or None,
+)
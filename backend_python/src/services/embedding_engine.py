@@ -0,0 +1,131 @@
+"""Batched, concurrent embedding calls for RAG.
+
+Texts are sent to the embedding API as list-of-content batches, batches run
+concurrently under a semaphore, and a shared cooldown kicks in when the API
+reports rate limiting. A batch that keeps failing is retried text by text so
+one bad chunk does not drop its neighbours.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from src.ai_config import genai
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    message = str(exc)
+    return "429" in message or "Resource exhausted" in message or "quota" in message.lower()
+
+
+class EmbeddingEngine:
+    def __init__(
+        self,
+        model: str = EMBEDDING_MODEL,
+        batch_size: int = 100,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        base_backoff_seconds: float = 1.0,
+    ) -> None:
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.base_backoff_seconds = base_backoff_seconds
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._cooldown_until = 0.0
+        self._stats = {
+            "requests": 0,
+            "texts": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failed_texts": 0,
+        }
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _request(self, contents: List[str], task_type: str) -> List[List[float]]:
+        """One API call for ``contents``; retries with backoff on failure."""
+        attempt = 0
+        while True:
+            delay = self._cooldown_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                async with self._get_semaphore():
+                    self._stats["requests"] += 1
+                    result = await genai.embed_content_async(
+                        model=self.model,
+                        content=contents,
+                        task_type=task_type,
+                    )
+                embeddings = result["embedding"]
+                if len(contents) == 1 and embeddings and not isinstance(embeddings[0], list):
+                    embeddings = [embeddings]
+                if len(embeddings) != len(contents):
+                    raise ValueError(
+                        f"Embedding API returned {len(embeddings)} vectors for {len(contents)} texts"
+                    )
+                self._stats["texts"] += len(contents)
+                return embeddings
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self._stats["retries"] += 1
+                backoff = self.base_backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random())
+                if _is_rate_limited(e):
+                    # Toàn bộ worker cùng chờ để không dồn thêm request vào quota đang cạn
+                    self._stats["rate_limited"] += 1
+                    self._cooldown_until = max(self._cooldown_until, time.monotonic() + backoff)
+                print(f"⚠️ Embedding request failed (attempt {attempt}/{self.max_retries}): {e}")
+                await asyncio.sleep(backoff)
+
+    async def _embed_batch(self, batch: List[str], task_type: str) -> List[List[float]]:
+        try:
+            return await self._request(batch, task_type)
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Error generating embedding: {e}")
+                self._stats["failed_texts"] += 1
+                return [[]]
+        # Cả batch lỗi: thử lại từng text để cô lập chunk hỏng
+        results = await asyncio.gather(*(self._embed_batch([text], task_type) for text in batch))
+        return [vectors[0] for vectors in results]
+
+    async def embed_many(
+        self, texts: Sequence[str], task_type: str = "retrieval_document"
+    ) -> List[List[float]]:
+        """Embeddings in input order; ``[]`` marks a text that could not be embedded."""
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(batch, task_type) for batch in batches))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    async def embed_one(self, text: str, task_type: str = "retrieval_document") -> List[float]:
+        return (await self.embed_many([text], task_type))[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "batch_size": self.batch_size,
+            "max_concurrency": self.max_concurrency,
+            **self._stats,
+        }
+
+
+embedding_engine = EmbeddingEngine(
+    batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
+    max_concurrency=int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4")),
+    max_retries=int(os.getenv("EMBEDDING_MAX_RETRIES", "3")),
+)
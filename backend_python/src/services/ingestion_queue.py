@@ -0,0 +1,339 @@
+"""Durable background queue for RAG document ingestion.
+
+``/api/process-document`` only enqueues a job; worker tasks started with the
+app pick jobs up, run ``rag_service.process_document`` and retry failures with
+exponential backoff (a document without extractable text fails at once). Jobs
+live in a SQLite file (``INGESTION_QUEUE_DB``), so work queued or interrupted
+by a restart is picked up again on the next start.
+
+Several processes (uvicorn workers) may share the file: a job is claimed with
+a conditional ``UPDATE`` and held under a lease (``lease_owner`` /
+``lease_until``) that the owning process renews while it runs. Only jobs whose
+lease expired — their worker died — are put back in the queue.
+
+CPU-heavy PDF parsing already runs in the extraction process pool
+(``src.utils.file_utils``); the workers here only bound how many documents are
+ingested concurrently.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.services import rag_service
+
+_DEFAULT_DB_PATH = Path(__file__).resolve().parents[2] / ".cache" / "ingestion_queue.db"
+
+JobHandler = Callable[[str, str, str], Awaitable[Any]]
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+_COLUMNS = (
+    "id", "user_id", "document_id", "purpose", "status", "attempts",
+    "max_attempts", "last_error", "created_at", "updated_at", "next_run_at",
+    "lease_owner", "lease_until",
+)
+
+
+class IngestionQueue:
+    def __init__(
+        self,
+        db_path: str,
+        handler: JobHandler,
+        max_concurrency: int = 2,
+        max_attempts: int = 3,
+        retry_backoff_seconds: float = 30.0,
+        poll_interval_seconds: float = 5.0,
+        lease_seconds: float = 120.0,
+    ) -> None:
+        self.db_path = db_path
+        self.handler = handler
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.lease_seconds = max(10.0, lease_seconds)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = self._open_db(db_path)
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = 0
+        self._stats = {"enqueued": 0, "completed": 0, "failed": 0, "retries": 0, "claim_conflicts": 0}
+
+    # ----- SQLite -----
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingestion_jobs ("
+            " id TEXT PRIMARY KEY, user_id TEXT NOT NULL, document_id TEXT NOT NULL,"
+            " purpose TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " max_attempts INTEGER NOT NULL, last_error TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, next_run_at REAL NOT NULL,"
+            " lease_owner TEXT, lease_until REAL)"
+        )
+        # File tạo trước khi có lease -> thêm cột (process khác có thể vừa thêm xong)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(ingestion_jobs)")}
+        for column, column_type in (("lease_owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in existing:
+                try:
+                    conn.execute(f'ALTER TABLE ingestion_jobs ADD COLUMN "{column}" {column_type}')
+                except sqlite3.OperationalError as e:
+                    if "duplicate column" not in str(e):
+                        raise
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ingestion_jobs_pending ON ingestion_jobs (status, next_run_at)"
+        )
+        conn.commit()
+        return conn
+
+    def _row(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        return {key: row[key] for key in _COLUMNS} if row is not None else None
+
+    def _insert(self, user_id: str, document_id: str, purpose: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            # Tài liệu đang chờ/đang xử lý thì trả lại job cũ thay vì xử lý 2 lần
+            existing = self._db.execute(
+                "SELECT * FROM ingestion_jobs WHERE document_id = ? AND purpose = ?"
+                " AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1",
+                (document_id, purpose, QUEUED, RUNNING),
+            ).fetchone()
+            if existing is not None:
+                return self._row(existing)
+            job_id = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO ingestion_jobs (id, user_id, document_id, purpose, status, attempts,"
+                " max_attempts, created_at, updated_at, next_run_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
+                (job_id, user_id, document_id, purpose, QUEUED, self.max_attempts, now, now, now),
+            )
+            self._db.commit()
+            row = self._db.execute("SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()
+        self._stats["enqueued"] += 1
+        return self._row(row)
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            for _ in range(3):
+                row = self._db.execute(
+                    "SELECT id FROM ingestion_jobs WHERE status = ? AND next_run_at <= ?"
+                    " ORDER BY next_run_at, created_at LIMIT 1",
+                    (QUEUED, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                # Chỉ một process thắng: UPDATE có điều kiện status, kiểm tra rowcount
+                cursor = self._db.execute(
+                    "UPDATE ingestion_jobs SET status = ?, attempts = attempts + 1, updated_at = ?,"
+                    " lease_owner = ?, lease_until = ? WHERE id = ? AND status = ?",
+                    (RUNNING, now, self.worker_id, now + self.lease_seconds, row["id"], QUEUED),
+                )
+                self._db.commit()
+                if cursor.rowcount == 1:
+                    row = self._db.execute("SELECT * FROM ingestion_jobs WHERE id = ?", (row["id"],)).fetchone()
+                    return self._row(row)
+                self._stats["claim_conflicts"] += 1
+        return None
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None, delay: float = 0.0) -> bool:
+        now = time.time()
+        with self._lock:
+            # Mất lease (job đã bị process khác nhận lại) thì không ghi đè kết quả của nó
+            cursor = self._db.execute(
+                "UPDATE ingestion_jobs SET status = ?, last_error = ?, updated_at = ?, next_run_at = ?,"
+                " lease_owner = NULL, lease_until = NULL WHERE id = ? AND lease_owner = ?",
+                (status, error, now, now + delay, job_id, self.worker_id),
+            )
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def _renew_leases(self) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE ingestion_jobs SET lease_until = ? WHERE status = ? AND lease_owner = ?",
+                (time.time() + self.lease_seconds, RUNNING, self.worker_id),
+            )
+            self._db.commit()
+
+    def _requeue_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            # Chỉ job mà worker giữ lease đã chết (lease hết hạn); job của worker còn sống không bị đụng tới
+            cursor = self._db.execute(
+                "UPDATE ingestion_jobs SET status = ?, updated_at = ?, lease_owner = NULL, lease_until = NULL"
+                " WHERE status = ? AND (lease_until IS NULL OR lease_until <= ?)",
+                (QUEUED, now, RUNNING, now),
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def _release_leases(self) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE ingestion_jobs SET status = ?, updated_at = ?, lease_owner = NULL, lease_until = NULL"
+                " WHERE status = ? AND lease_owner = ?",
+                (QUEUED, time.time(), RUNNING, self.worker_id),
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def _count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) AS n FROM ingestion_jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    # ----- public API -----
+
+    async def enqueue(self, user_id: str, document_id: str, purpose: str = "chat") -> Dict[str, Any]:
+        job = await asyncio.to_thread(self._insert, user_id, document_id, purpose)
+        await self._set_rag_status(purpose, document_id, "processing")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop(), name="ingestion-lease-heartbeat")
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"ingestion-worker-{i}")
+            for i in range(self.max_concurrency)
+        ]
+
+    async def stop(self) -> None:
+        workers, self._workers = self._workers, []
+        heartbeat, self._heartbeat = self._heartbeat, None
+        for task in workers + ([heartbeat] if heartbeat else []):
+            task.cancel()
+        await asyncio.gather(*workers, *([heartbeat] if heartbeat else []), return_exceptions=True)
+        # Trả lease để job đang chạy dở được nhận lại ngay (ở lần start sau hoặc process khác)
+        released = await asyncio.to_thread(self._release_leases)
+        if released:
+            print(f"🔁 Released {released} interrupted ingestion job(s)")
+
+    # ----- worker -----
+
+    @staticmethod
+    async def _set_rag_status(purpose: str, document_id: str, status: str) -> None:
+        try:
+            await rag_service.update_document(rag_service._tables_for(purpose)[0], document_id, {"rag_status": status})
+        except Exception as e:
+            print(f"⚠️ Could not set rag_status={status} for {document_id}: {e}")
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self._renew_leases)
+                requeued = await asyncio.to_thread(self._requeue_expired)
+                if requeued:
+                    print(f"🔁 Requeued {requeued} ingestion job(s) with an expired lease")
+                    self._wakeup.set()
+            except Exception as e:
+                print(f"⚠️ Ingestion lease heartbeat failed: {e}")
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        self._running += 1
+        error: Optional[str] = None
+        retryable = True
+        try:
+            result = await self.handler(job["user_id"], job["document_id"], job["purpose"])
+            if not result:
+                error = "process_document returned no result"
+        except asyncio.CancelledError:
+            raise
+        except rag_service.NoExtractableText as e:
+            # Thử lại cũng không có text -> dừng luôn
+            error = str(e)
+            retryable = False
+        except Exception as e:
+            error = str(e)
+        finally:
+            self._running -= 1
+
+        if error is None:
+            if await self._finish_owned(job, COMPLETED):
+                self._stats["completed"] += 1
+            return
+
+        if retryable and job["attempts"] < job["max_attempts"]:
+            delay = self.retry_backoff_seconds * (2 ** (job["attempts"] - 1))
+            print(f"⚠️ Ingestion job {job['id']} failed (attempt {job['attempts']}), retrying in {delay:.0f}s: {error}")
+            if not await self._finish_owned(job, QUEUED, error, delay):
+                return
+            asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+            await self._set_rag_status(job["purpose"], job["document_id"], "processing")
+            self._stats["retries"] += 1
+            return
+
+        print(f"❌ Ingestion job {job['id']} failed after {job['attempts']} attempts: {error}")
+        if not await self._finish_owned(job, FAILED, error):
+            return
+        await self._set_rag_status(job["purpose"], job["document_id"], FAILED)
+        self._stats["failed"] += 1
+
+    async def _finish_owned(self, job: Dict[str, Any], status: str, error: Optional[str] = None, delay: float = 0.0) -> bool:
+        if await asyncio.to_thread(self._finish, job["id"], status, error, delay):
+            return True
+        print(f"⚠️ Ingestion job {job['id']} lost its lease; result not recorded")
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "workers": len(self._workers),
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "jobs_by_status": self._count_by_status(),
+            **self._stats,
+        }
+
+
+ingestion_queue = IngestionQueue(
+    db_path=os.getenv("INGESTION_QUEUE_DB") or str(_DEFAULT_DB_PATH),
+    handler=rag_service.process_document,
+    max_concurrency=int(os.getenv("INGESTION_MAX_CONCURRENCY", "2")),
+    max_attempts=int(os.getenv("INGESTION_MAX_ATTEMPTS", "3")),
+    retry_backoff_seconds=float(os.getenv("INGESTION_RETRY_BACKOFF_SECONDS", "30")),
+    lease_seconds=float(os.getenv("INGESTION_LEASE_SECONDS", "120")),
+)
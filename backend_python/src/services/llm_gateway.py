@@ -0,0 +1,169 @@
+"""Shared gateway for Gemini calls.
+
+Every model round trip goes through ``llm_gateway`` so that:
+- calls use the SDK's native async API and never block the event loop,
+- the number of concurrent calls is bounded (``LLM_MAX_CONCURRENCY``),
+- queue depth and latency are observable via ``stats()``,
+- concurrent ``generate`` calls with the same model and identical prompt share
+  one in-flight request (``LLM_COALESCE``); ``stats()["coalesced"]`` counts
+  the Gemini calls saved that way.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+from src.utils.singleflight import SingleFlight
+
+T = TypeVar("T")
+
+
+class _Uncoalescable(TypeError):
+    pass
+
+
+def _canonical_part(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": hashlib.sha256(value).hexdigest()}
+    # File upload, Part proto... không so sánh được nội dung -> không gộp
+    raise _Uncoalescable(type(value).__name__)
+
+
+def prompt_key(model: Any, contents: Any, kwargs: Dict[str, Any]) -> Optional[str]:
+    """Coalescing key for a ``generate`` call, or None if it cannot be compared.
+
+    Models come from ``model_registry`` (one shared instance per configuration),
+    so the model's identity stands for its name, system instruction and
+    generation config.
+    """
+    try:
+        payload = json.dumps(
+            [contents, kwargs], sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+            default=_canonical_part,
+        )
+    except (_Uncoalescable, ValueError):
+        return None
+    return f"{id(model)}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class LLMGateway:
+    """Bounded executor for async LLM calls."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        timeout_seconds: Optional[float] = None,
+        coalesce: bool = True,
+    ) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout_seconds = timeout_seconds
+        self.coalesce = coalesce
+        self._flight = SingleFlight()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._queued = 0
+        self._in_flight = 0
+        self._stats = {
+            "calls": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "peak_queue_depth": 0,
+            "peak_in_flight": 0,
+            "total_wait_ms": 0.0,
+            "total_call_ms": 0.0,
+        }
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Tạo lazily để gắn với event loop của uvicorn, không phải lúc import
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        semaphore = self._get_semaphore()
+        queued_at = time.perf_counter()
+        self._queued += 1
+        self._stats["peak_queue_depth"] = max(self._stats["peak_queue_depth"], self._queued)
+        try:
+            await semaphore.acquire()
+        finally:
+            self._queued -= 1
+
+        started = time.perf_counter()
+        self._stats["total_wait_ms"] += (started - queued_at) * 1000
+        self._in_flight += 1
+        self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+        try:
+            yield
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            self._stats["failures"] += 1
+            raise
+        except Exception:
+            self._stats["failures"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._stats["calls"] += 1
+            self._stats["total_call_ms"] += (time.perf_counter() - started) * 1000
+            semaphore.release()
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        """Run ``call()`` once a concurrency slot is free."""
+        async with self._slot():
+            if self.timeout_seconds:
+                return await asyncio.wait_for(call(), timeout=self.timeout_seconds)
+            return await call()
+
+    async def stream(self, call: Callable[[], Awaitable[Any]]) -> AsyncIterator[Any]:
+        """Yield chunks of a streaming response, holding one slot until it ends."""
+        async with self._slot():
+            response = await call()
+            async for chunk in response:
+                yield chunk
+
+    async def generate(self, model: Any, contents: Any, coalesce: bool = True, **kwargs: Any) -> Any:
+        """Async equivalent of ``model.generate_content(contents)``.
+
+        Identical concurrent calls share one response unless ``coalesce=False``
+        (use that when each caller needs an independent sample).
+        """
+        async def call() -> Any:
+            return await self.run(lambda: model.generate_content_async(contents, **kwargs))
+
+        key = prompt_key(model, contents, kwargs) if coalesce and self.coalesce else None
+        if key is None:
+            return await call()
+        return await self._flight.do(key, call)
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self._stats["calls"] or 1
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self._queued,
+            "in_flight": self._in_flight,
+            "calls": self._stats["calls"],
+            "failures": self._stats["failures"],
+            "timeouts": self._stats["timeouts"],
+            "peak_queue_depth": self._stats["peak_queue_depth"],
+            "peak_in_flight": self._stats["peak_in_flight"],
+            "avg_wait_ms": round(self._stats["total_wait_ms"] / calls, 2),
+            "avg_call_ms": round(self._stats["total_call_ms"] / calls, 2),
+            "coalesce": self.coalesce,
+            # Số lần gọi Gemini tiết kiệm được nhờ dùng chung request đang chạy
+            "coalesced": self._flight.stats()["shared"],
+            "coalescing_in_flight": self._flight.in_flight(),
+        }
+
+
+_timeout = os.getenv("LLM_TIMEOUT_SECONDS")
+llm_gateway = LLMGateway(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    timeout_seconds=float(_timeout) if _timeout else None,
+    coalesce=os.getenv("LLM_COALESCE", "1") != "0",
+)
@@ -0,0 +1,69 @@
+"""Process-wide registry of configured ``GenerativeModel`` instances.
+
+A model is built once per distinct (model name, system instruction,
+generation config) and reused by every request afterwards.
+"""
+from __future__ import annotations
+
+import json
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from src.ai_config import genai
+
+ModelSpec = Tuple[str, Optional[str], Optional[Dict[str, Any]]]
+
+
+def _config_key(generation_config: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(generation_config or {}, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class ModelRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._models: Dict[Tuple[str, str, str], Any] = {}
+        self._constructions: Dict[str, int] = {}
+        self._hits = 0
+
+    def get(
+        self,
+        model_name: str,
+        system_instruction: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """Return the shared model for this configuration, building it on first use."""
+        key = (model_name, system_instruction or "", _config_key(generation_config))
+        model = self._models.get(key)
+        if model is not None:
+            self._hits += 1
+            return model
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                kwargs: Dict[str, Any] = {}
+                if generation_config:
+                    kwargs["generation_config"] = generation_config
+                if system_instruction:
+                    kwargs["system_instruction"] = system_instruction
+                model = genai.GenerativeModel(model_name, **kwargs)
+                self._models[key] = model
+                self._constructions[model_name] = self._constructions.get(model_name, 0) + 1
+            else:
+                self._hits += 1
+        return model
+
+    def warm(self, specs: Iterable[ModelSpec]) -> None:
+        """Build the given configurations ahead of the first request."""
+        for model_name, system_instruction, generation_config in specs:
+            self.get(model_name, system_instruction, generation_config)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": len(self._models),
+            "constructions": dict(self._constructions),
+            "hits": self._hits,
+        }
+
+
+model_registry = ModelRegistry()
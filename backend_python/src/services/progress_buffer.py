@@ -0,0 +1,309 @@
+"""Write-behind buffer for ``node_progress`` upserts.
+
+Node events arrive in bursts (a student opening and scoring nodes), so instead
+of one PostgREST round trip per event, updates are coalesced per
+``(user_id, node_id)`` and written as one multi-row upsert when the buffer
+reaches ``flush_size`` rows or every ``flush_interval_seconds``. Pending rows
+are visible to readers through ``pending_for`` and are flushed on shutdown.
+
+Rows are validated in ``put`` so a malformed update is rejected to its caller
+instead of being buffered. If the database still rejects a batch because of
+its data (constraint / type / column errors), the batch is bisected to isolate
+the offending rows; the rest is written, and a row that keeps failing is moved
+to a dead-letter list after ``max_attempts`` flushes. Connection-level errors
+re-queue the whole batch without counting an attempt. Dead-lettered rows are
+kept per ``(user_id, node_id)`` (``failed_for``) until a later update for the
+node is written, so the API can tell the student the write was lost.
+
+``on_written`` receives the user ids whose rows reached the database after
+each flush (read-cache invalidation).
+
+With ``write_behind=False`` (``PROGRESS_WRITE_BEHIND=0``) ``write`` upserts
+synchronously and database errors reach the caller.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.services.read_cache import node_progress_cache
+from src.supabase_client import run_query
+
+Key = Tuple[str, str]
+OnWritten = Callable[[List[str]], Awaitable[None]]
+
+# SQLSTATE 22xxx (dữ liệu), 23xxx (constraint), 42xxx (cột / kiểu) và lỗi PostgREST: lỗi do dòng, không phải mạng
+_ROW_ERROR_PREFIXES = ("22", "23", "42", "PGRST")
+
+
+# Cột của bảng node_progress (supabase_functions.sql)
+COLUMNS = frozenset({
+    "user_id", "node_id", "mindmap_id", "opened", "score", "attempts",
+    "time_spent_seconds", "last_updated", "completed_at",
+})
+
+
+class InvalidProgressRow(ValueError):
+    """The update cannot be written to ``node_progress``."""
+
+
+def validate_row(row: Dict[str, Any]) -> None:
+    unknown = set(row) - COLUMNS
+    if unknown:
+        raise InvalidProgressRow(f"unknown node_progress column(s): {', '.join(sorted(unknown))}")
+    for field in ("user_id", "node_id", "mindmap_id"):
+        if not isinstance(row.get(field), str) or not row[field].strip():
+            raise InvalidProgressRow(f"{field} is required")
+    for field in ("user_id", "mindmap_id"):
+        try:
+            uuid.UUID(row[field])
+        except ValueError:
+            raise InvalidProgressRow(f"{field} must be a UUID") from None
+    score = row.get("score")
+    if score is not None and (isinstance(score, bool) or not isinstance(score, int) or not 0 <= score <= 100):
+        raise InvalidProgressRow("score must be an integer between 0 and 100")
+    if "opened" in row and not isinstance(row["opened"], bool):
+        raise InvalidProgressRow("opened must be a boolean")
+
+
+def _is_row_error(error: Exception) -> bool:
+    code = str(getattr(error, "code", "") or "")
+    return code.startswith(_ROW_ERROR_PREFIXES)
+
+
+class ProgressWriteBuffer:
+    def __init__(
+        self,
+        table: str = "node_progress",
+        flush_size: int = 200,
+        flush_interval_seconds: float = 1.0,
+        max_attempts: int = 3,
+        dead_letter_size: int = 1000,
+        write_behind: bool = True,
+        on_written: Optional[OnWritten] = None,
+    ) -> None:
+        self.table = table
+        self.on_written = on_written
+        self.write_behind = write_behind
+        self.flush_size = max(1, flush_size)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_attempts = max(1, max_attempts)
+        self._pending: Dict[Key, Dict[str, Any]] = {}
+        self._attempts: Dict[Key, int] = {}
+        self.dead_letters: "deque[Dict[str, Any]]" = deque(maxlen=dead_letter_size)
+        self._dead_letter_size = dead_letter_size
+        # Dòng bị bỏ (dead-letter) theo node, xoá khi update sau của node đó được ghi
+        self._failed: "OrderedDict[Key, Dict[str, Any]]" = OrderedDict()
+        self._flushing: Dict[Key, Dict[str, Any]] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "updates": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "rows_written": 0,
+            "flush_failures": 0,
+            "rejected": 0,
+            "dead_lettered": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def _get_flush_lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+
+    # ----- public API -----
+
+    def put(self, row: Dict[str, Any]) -> None:
+        """Queue an upsert; a newer update for the same node replaces the older one.
+
+        Raises ``InvalidProgressRow`` for rows the table would reject.
+        """
+        try:
+            validate_row(row)
+        except InvalidProgressRow:
+            self._stats["rejected"] += 1
+            raise
+        key = (row["user_id"], row["node_id"])
+        # Update mới thay thế dòng cũ -> đếm lại số lần thử từ đầu
+        self._attempts.pop(key, None)
+        if key in self._pending:
+            self._stats["coalesced"] += 1
+        self._pending[key] = row
+        self._stats["updates"] += 1
+        if len(self._pending) >= self.flush_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def write(self, row: Dict[str, Any]) -> None:
+        """Buffer ``row`` (write-behind) or upsert it now; errors of a direct write propagate."""
+        if self.write_behind:
+            self.put(row)
+            return
+        try:
+            validate_row(row)
+        except InvalidProgressRow:
+            self._stats["rejected"] += 1
+            raise
+        await self._upsert([row])
+        self._stats["updates"] += 1
+        self._stats["rows_written"] += 1
+        self._failed.pop((row["user_id"], row["node_id"]), None)
+        await self._written([row["user_id"]])
+
+    async def _written(self, user_ids: List[str]) -> None:
+        if not user_ids or self.on_written is None:
+            return
+        try:
+            await self.on_written(user_ids)
+        except Exception as e:
+            print(f"⚠️ node_progress on_written callback failed: {e}")
+
+    def failed_for(self, user_id: str) -> List[Dict[str, Any]]:
+        """Updates of ``user_id`` that were dropped after ``max_attempts`` failed flushes."""
+        return [failure for key, failure in self._failed.items() if key[0] == user_id]
+
+    def pending_for(self, user_id: str) -> List[Dict[str, Any]]:
+        """Rows of ``user_id`` not yet confirmed by the database (newest wins)."""
+        merged = {k: v for k, v in self._flushing.items() if k[0] == user_id}
+        merged.update({k: v for k, v in self._pending.items() if k[0] == user_id})
+        return list(merged.values())
+
+    def merge_into(self, user_id: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Overlay pending updates on rows read from the database."""
+        pending = self.pending_for(user_id)
+        if not pending:
+            return rows
+        overrides = {row["node_id"]: row for row in pending}
+        merged = []
+        for row in rows:
+            override = overrides.pop(row.get("node_id"), None)
+            merged.append({**row, **override} if override else row)
+        merged.extend(overrides.values())
+        return merged
+
+    async def _upsert(self, rows: List[Dict[str, Any]]) -> None:
+        await run_query(
+            f"{self.table}.upsert_batch",
+            lambda db: db.table(self.table).upsert(rows, on_conflict="user_id, node_id"),
+        )
+
+    async def _write(self, batch: Dict[Key, Dict[str, Any]]) -> Tuple[int, Dict[Key, Exception]]:
+        """Write ``batch``; returns (rows written, rows rejected by the database with their error).
+
+        Connection-level errors propagate; row errors are isolated by bisection.
+        """
+        try:
+            await self._upsert(list(batch.values()))
+            return len(batch), {}
+        except Exception as e:
+            if not _is_row_error(e):
+                raise
+            if len(batch) == 1:
+                return 0, {key: e for key in batch}
+        items = list(batch.items())
+        middle = len(items) // 2
+        written, failed = 0, {}
+        for half in (dict(items[:middle]), dict(items[middle:])):
+            n, errors = await self._write(half)
+            written += n
+            failed.update(errors)
+        return written, failed
+
+    async def flush(self) -> int:
+        async with self._get_flush_lock():
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            started = time.perf_counter()
+            try:
+                written, failed = await self._write(batch)
+            except Exception as e:
+                # Lỗi kết nối: trả lại cả batch, không đè lên update mới hơn đến trong lúc flush
+                self._stats["flush_failures"] += 1
+                for key, row in batch.items():
+                    self._pending.setdefault(key, row)
+                print(f"⚠️ node_progress flush failed ({len(batch)} rows), will retry: {e}")
+                return 0
+            finally:
+                self._flushing = {}
+                self._stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+            self._stats["flushes"] += 1
+            self._stats["rows_written"] += written
+            for key in batch:
+                if key not in failed:
+                    self._attempts.pop(key, None)
+                    self._failed.pop(key, None)
+            for key, error in failed.items():
+                self._stats["flush_failures"] += 1
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= self.max_attempts:
+                    # Dòng hỏng: bỏ khỏi buffer để không chặn các dòng khác
+                    self._attempts.pop(key, None)
+                    self._stats["dead_lettered"] += 1
+                    failure = {"row": batch[key], "error": str(error), "failed_at": time.time()}
+                    self.dead_letters.append(failure)
+                    self._failed.pop(key, None)
+                    self._failed[key] = {"node_id": key[1], "error": failure["error"], "failed_at": failure["failed_at"]}
+                    while len(self._failed) > self._dead_letter_size:
+                        self._failed.popitem(last=False)
+                    print(f"❌ node_progress row dead-lettered after {attempts} attempts {key}: {error}")
+                elif key not in self._pending:
+                    self._attempts[key] = attempts
+                    self._pending[key] = batch[key]
+            await self._written(sorted({key[0] for key in batch}))
+            return written
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="node-progress-flusher")
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # shield: stop() huỷ task này nhưng không được huỷ giữa chừng một lần ghi
+            await asyncio.shield(self.flush())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "write_behind": self.write_behind,
+            "pending": len(self._pending),
+            "dead_letters": len(self.dead_letters),
+            "flush_size": self.flush_size,
+            "flush_interval_seconds": self.flush_interval_seconds,
+            **self._stats,
+        }
+
+
+async def _invalidate_progress_cache(user_ids: List[str]) -> None:
+    # Dòng đã xuống DB (hoặc bị bỏ) -> đọc lại thay vì dùng bản cache từ trước khi flush
+    for user_id in user_ids:
+        await node_progress_cache.invalidate(user_id)
+
+
+progress_buffer = ProgressWriteBuffer(
+    flush_size=int(os.getenv("PROGRESS_FLUSH_SIZE", "200")),
+    flush_interval_seconds=float(os.getenv("PROGRESS_FLUSH_INTERVAL_SECONDS", "1.0")),
+    max_attempts=int(os.getenv("PROGRESS_FLUSH_MAX_ATTEMPTS", "3")),
+    write_behind=os.getenv("PROGRESS_WRITE_BEHIND", "1") == "1",
+    on_written=_invalidate_progress_cache,
+)
@@ -1,89 +1,115 @@
 import os
-import io
+import json
 import asyncio
 import google.generativeai as genai
-from pathlib import Path
-from typing import List, Dict, Any, Optional
-import PyPDF2
-from docx import Document
-from src.supabase_client import supabase
+from itertools import islice
+from typing import List, Dict, Any, Optional, Tuple
+from src.supabase_client import run_query, timed
 from src.ai_config import genai
+from src.services.embedding_cache import query_embedding_cache
+from src.services.embedding_engine import EMBEDDING_MODEL, embedding_engine
+from src.services.vector_index import LocalVectorIndex
+from src.utils.chunker import CHARS_PER_TOKEN, DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, iter_chunks
+from src.utils.file_utils import iter_document_blocks
 
-# Configure embedding model
-EMBEDDING_MODEL = "models/text-embedding-004"
+# Task type dùng khi embed câu truy vấn (giữ giống lúc embed tài liệu)
+QUERY_TASK_TYPE = "retrieval_document"
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from a PDF file content (bytes)"""
-    try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        print(f"Error reading PDF: {e}")
-        return ""
+# Số chunk được insert trong một request
+INSERT_BATCH_SIZE = 100
 
-def extract_text_from_word(file_content: bytes) -> str:
-    """Extract text from a Word (.docx) file content (bytes)"""
-    try:
-        doc = Document(io.BytesIO(file_content))
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    except Exception as e:
-        print(f"Error reading Word file: {e}")
-        return ""
+MATCH_THRESHOLD = 0.5
+
+# Vector index trong process (tuỳ chọn, bật bằng RAG_LOCAL_INDEX=1):
+# nạp chunk của từng user từ Supabase 1 lần rồi tìm top-k ngay trong bộ nhớ
+LOCAL_INDEX_ENABLED = os.getenv("RAG_LOCAL_INDEX", "0") == "1"
+HYDRATE_PAGE_SIZE = 1000
+local_index = LocalVectorIndex(
+    hnsw_threshold=int(os.getenv("RAG_LOCAL_INDEX_HNSW_THRESHOLD", "20000")),
+    ttl_seconds=float(os.getenv("RAG_LOCAL_INDEX_TTL_SECONDS", "300")),
+    max_partitions=int(os.getenv("RAG_LOCAL_INDEX_MAX_PARTITIONS", "256")),
+    max_rows=int(os.getenv("RAG_LOCAL_INDEX_MAX_ROWS", "500000")),
+)
+# Chỉ giữ lock của các lần nạp đang chạy (bỏ đi khi nạp xong)
+_hydration_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+
+class NoExtractableText(Exception):
+    """The document has no text to index; retrying will not change that."""
 
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-    """Split text into chunks with overlap"""
+
+def _tables_for(purpose: str) -> Tuple[str, str, str]:
+    """(meta_table, chunk_table, fk_col) for a RAG purpose."""
+    if purpose == "chat":
+        return "user_documents", "document_chunks", "document_id"
+    return "test_materials", "test_material_chunks", "material_id"
+
+def chunk_text(
+    text: str, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS
+) -> List[str]:
+    """Split text into sentence-aligned chunks with overlap (see ``iter_chunks``)"""
     if not text:
         return []
-    
-    chunks = []
-    start = 0
-    text_len = len(text)
-    
-    while start < text_len:
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start += chunk_size - overlap
-        
-    return chunks
+    return list(iter_chunks([text], max_tokens=max_tokens, overlap_tokens=overlap_tokens))
+
+
+def split_text(content: str, max_chars: int = 800) -> List[str]:
+    """``chunk_text`` with the budget given in characters."""
+    return chunk_text(content, max_tokens=max(1, max_chars // CHARS_PER_TOKEN))
 
 async def generate_embedding(text: str) -> List[float]:
     """Generate embedding for a text string using Google GenAI"""
-    try:
-        result = genai.embed_content(
-            model=EMBEDDING_MODEL,
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        return []
+    return await embedding_engine.embed_one(text, task_type="retrieval_document")
+
+
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Batch-embed many texts; failed items come back as empty lists."""
+    return await embedding_engine.embed_many(texts, task_type="retrieval_document")
+
+
+async def generate_query_embedding(query: str) -> List[float]:
+    """Embedding for a search query, served from the query cache when possible."""
+    cached = await query_embedding_cache.get(EMBEDDING_MODEL, QUERY_TASK_TYPE, query)
+    if cached is not None:
+        return cached
+    embedding = await embedding_engine.embed_one(query, task_type=QUERY_TASK_TYPE)
+    if embedding:
+        await query_embedding_cache.put(EMBEDDING_MODEL, QUERY_TASK_TYPE, query, embedding)
+    return embedding
+
+async def update_document(meta_table: str, document_id: str, values: Dict[str, Any]) -> None:
+    await run_query(f"{meta_table}.update", lambda db: db.table(meta_table).update(values).eq("id", document_id))
+
+
+async def delete_document_chunks(user_id: str, document_id: str, purpose: str = "chat") -> None:
+    """Remove every chunk of a document (and its local-index partition) before it is (re)processed."""
+    _, chunk_table, fk_col = _tables_for(purpose)
+    await run_query(
+        f"{chunk_table}.delete", lambda db: db.table(chunk_table).delete().eq(fk_col, document_id)
+    )
+    if LOCAL_INDEX_ENABLED:
+        # Partition được nạp lại từ DB ở lần tìm kiếm sau
+        local_index.invalidate(chunk_table, user_id)
+
 
 async def process_document(user_id: str, document_id: str, purpose: str = "chat"):
     """
     Full pipeline: Download -> Extract -> Chunk -> Embed -> Save
     purpose: 'chat' (user_documents) or 'test' (test_materials)
+
+    Chunks left by an earlier (interrupted) run are deleted first, so retries
+    never duplicate rows. Raises ``NoExtractableText`` when the file has no text;
+    any other failure marks the document failed and is re-raised so the
+    ingestion queue records the real cause in ``last_error``.
     """
     try:
         # 1. Determine tables based on purpose
-        if purpose == "chat":
-            meta_table = "user_documents"
-            chunk_table = "document_chunks"
-            fk_col = "document_id"
-        else:
-            meta_table = "test_materials"
-            chunk_table = "test_material_chunks"
-            fk_col = "material_id"
+        meta_table, chunk_table, fk_col = _tables_for(purpose)
 
         # 2. Get document metadata
-        response = supabase.table(meta_table).select("*").eq("id", document_id).single().execute()
+        response = await run_query(
+            f"{meta_table}.select", lambda db: db.table(meta_table).select("*").eq("id", document_id).single()
+        )
         if not response.data:
             raise ValueError(f"Document {document_id} not found in {meta_table}")
         
@@ -96,105 +122,200 @@ async def process_document(user_id: str, document_id: str, purpose: str = "chat"
         # 3. Download file from Storage
         # Assuming bucket is 'mathmentor-materials' as seen in frontend
         bucket_name = "mathmentor-materials"
-        file_data = supabase.storage.from_(bucket_name).download(source_path)
+        file_data = await timed(
+            "storage.download", lambda db: db.storage.from_(bucket_name).download(source_path)
+        )
         
-        # 4. Extract text
-        ext = Path(file_name).suffix.lower()
-        text = ""
-        if ext == ".pdf":
-            text = extract_text_from_pdf(file_data)
-        elif ext in [".docx", ".doc"]:
-            text = extract_text_from_word(file_data)
-        else:
-            # Try plain text
-            try:
-                text = file_data.decode('utf-8')
-            except:
-                print(f"Unsupported format: {ext}")
-                return
+        # Lần chạy trước (bị ngắt / lỗi giữa chừng) có thể đã insert một phần -> xoá trước khi ghi lại
+        await delete_document_chunks(user_id, document_id, purpose)
+
+        # 4-6. Extract, chunk, embed and save
+        # Trích xuất từng trang (PDF lớn chạy trong process pool) và chunk bằng generator:
+        # chỉ giữ một cửa sổ chunk trong bộ nhớ, mỗi cửa sổ đủ lớn để
+        # embedding_engine chạy song song các batch API
+        window_size = embedding_engine.batch_size * embedding_engine.max_concurrency
+        chunk_count = 0
+        chunks = iter_chunks(iter_document_blocks(file_data, file_name))
+        while True:
+            window = await asyncio.to_thread(lambda: list(islice(chunks, window_size)))
+            if not window:
+                break
+            embeddings = await embed_texts(window)
+
+            for i in range(0, len(window), INSERT_BATCH_SIZE):
+                rows_to_insert = []
+                for offset, (chunk_content, embedding) in enumerate(
+                    zip(window[i:i + INSERT_BATCH_SIZE], embeddings[i:i + INSERT_BATCH_SIZE])
+                ):
+                    if embedding:
+                        rows_to_insert.append({
+                            "user_id": user_id,
+                            fk_col: document_id,
+                            "chunk_index": chunk_count + i + offset,
+                            "content": chunk_content,
+                            "content_length": len(chunk_content),
+                            "source_path": source_path,
+                            "embedding_status": "completed",
+                            "embedding": embedding,
+                            "visibility": doc_record.get("visibility", "private")
+                        })
+
+                if rows_to_insert:
+                    insert_res = await run_query(
+                        f"{chunk_table}.insert", lambda db: db.table(chunk_table).insert(rows_to_insert)
+                    )
+                    print(f"Saved {len(rows_to_insert)} chunks")
+                    if LOCAL_INDEX_ENABLED:
+                        # Có thể phải dựng HNSW -> chạy trong thread, không chặn event loop
+                        await asyncio.to_thread(
+                            _add_to_local_index, chunk_table, fk_col, user_id, file_name, rows_to_insert, insert_res.data
+                        )
+
+            chunk_count += len(window)
 
-        if not text:
+        chunks.close()
+        if not chunk_count:
             print("No text extracted")
             # Update status to failed
-            supabase.table(meta_table).update({"rag_status": "failed"}).eq("id", document_id).execute()
-            return
-
-        # 5. Chunk text
-        chunks = chunk_text(text)
-        print(f"Generated {len(chunks)} chunks")
-        
-        # 6. Embed and Save Chunks
-        # We'll do this in batches to avoid hitting rate limits or timeouts
-        batch_size = 10
-        
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i+batch_size]
-            rows_to_insert = []
-            
-            # Create tasks for parallel embedding generation
-            tasks = [generate_embedding(chunk) for chunk in batch]
-            embeddings = await asyncio.gather(*tasks)
-            
-            for idx, chunk_content in enumerate(batch):
-                real_index = i + idx
-                embedding = embeddings[idx]
-                
-                if embedding:
-                    rows_to_insert.append({
-                        "user_id": user_id,
-                        fk_col: document_id,
-                        "chunk_index": real_index,
-                        "content": chunk_content,
-                        "content_length": len(chunk_content),
-                        "source_path": source_path,
-                        "embedding_status": "completed",
-                        "embedding": embedding,
-                        "visibility": doc_record.get("visibility", "private")
-                    })
-            
-            if rows_to_insert:
-                supabase.table(chunk_table).insert(rows_to_insert).execute()
-                print(f"Saved batch {i//batch_size + 1}")
+            await update_document(meta_table, document_id, {"rag_status": "failed"})
+            raise NoExtractableText(f"No text extracted from {file_name}")
+        print(f"Generated {chunk_count} chunks")
 
         # 7. Update document status
-        supabase.table(meta_table).update({
+        await update_document(meta_table, document_id, {
             "rag_status": "ready",
-            "chunk_count": len(chunks)
-        }).eq("id", document_id).execute()
+            "chunk_count": chunk_count
+        })
         
         print(f"Successfully processed {file_name}")
         return True
 
+    except NoExtractableText:
+        raise
     except Exception as e:
         print(f"Error processing document: {e}")
         # Update status to failed
         try:
-            supabase.table(meta_table).update({"rag_status": "failed"}).eq("id", document_id).execute()
+            await update_document(meta_table, document_id, {"rag_status": "failed"})
+            # Không để lại chunk dở dang trong kết quả tìm kiếm
+            await delete_document_chunks(user_id, document_id, purpose)
         except:
             pass
-        return False
+        raise
+
+def _parse_embedding(value: Any) -> List[float]:
+    # pgvector qua PostgREST trả về chuỗi dạng "[0.1,0.2,...]"
+    if isinstance(value, str):
+        return json.loads(value)
+    return value or []
+
+
+def _add_to_local_index(
+    chunk_table: str,
+    fk_col: str,
+    user_id: str,
+    file_name: str,
+    rows: List[Dict[str, Any]],
+    inserted: Optional[List[Dict[str, Any]]],
+) -> None:
+    """Keep a loaded partition in sync with chunks just inserted by process_document."""
+    ids = [r.get("id") for r in inserted] if inserted and len(inserted) == len(rows) else [None] * len(rows)
+    local_index.add(
+        chunk_table,
+        user_id,
+        [
+            {
+                "id": row_id,
+                fk_col: row[fk_col],
+                "chunk_index": row["chunk_index"],
+                "content": row["content"],
+                "file_name": file_name,
+                "embedding": row["embedding"],
+            }
+            for row_id, row in zip(ids, rows)
+        ],
+    )
+
+
+async def _hydrate_local_index(purpose: str, user_id: str) -> None:
+    """Load every chunk of ``user_id`` for ``purpose`` into the local index."""
+    meta_table, chunk_table, fk_col = _tables_for(purpose)
+    key = (chunk_table, user_id)
+    lock = _hydration_locks.setdefault(key, asyncio.Lock())
+    try:
+        async with lock:
+            if local_index.is_fresh(chunk_table, user_id):
+                return
+            await _load_local_partition(meta_table, chunk_table, fk_col, user_id)
+    finally:
+        # Request đến sau thấy partition còn mới (is_fresh) nên không nạp lại
+        if _hydration_locks.get(key) is lock and not lock.locked():
+            del _hydration_locks[key]
+
+
+async def _load_local_partition(meta_table: str, chunk_table: str, fk_col: str, user_id: str) -> None:
+    """Read every chunk of ``user_id`` from Supabase and replace its local partition."""
+    meta_res = await run_query(
+        f"{meta_table}.select", lambda db: db.table(meta_table).select("id, file_name").eq("user_id", user_id)
+    )
+    file_names = {m["id"]: m.get("file_name") for m in (meta_res.data or [])}
+
+    rows: List[Dict[str, Any]] = []
+    start = 0
+    while True:
+        page_res = await run_query(
+            f"{chunk_table}.select",
+            lambda db: db.table(chunk_table)
+            .select(f"id, {fk_col}, chunk_index, content, embedding")
+            .eq("user_id", user_id)
+            .range(start, start + HYDRATE_PAGE_SIZE - 1),
+        )
+        page = page_res.data or []
+        for row in page:
+            row["embedding"] = _parse_embedding(row.get("embedding"))
+            row["file_name"] = file_names.get(row.get(fk_col))
+        rows.extend(page)
+        if len(page) < HYDRATE_PAGE_SIZE:
+            break
+        start += HYDRATE_PAGE_SIZE
+
+    await asyncio.to_thread(local_index.hydrate, chunk_table, user_id, rows)
+    print(f"🧭 Local index loaded {len(rows)} chunks ({chunk_table}, user {user_id})")
+
 
 async def search_similar_documents(query: str, user_id: str, purpose: str = "chat", limit: int = 5) -> List[Dict]:
     """
     Search for similar documents using vector similarity
     """
     try:
-        # 1. Generate query embedding
-        query_embedding = await generate_embedding(query)
+        # 1. Generate query embedding (cached theo model/task_type/text)
+        query_embedding = await generate_query_embedding(query)
         if not query_embedding:
             return []
         
-        # 2. Call RPC function
+        # 2. Local index (nếu bật), lỗi thì quay về RPC
+        if LOCAL_INDEX_ENABLED and local_index.available and user_id:
+            try:
+                _, chunk_table, _ = _tables_for(purpose)
+                if not local_index.is_fresh(chunk_table, user_id):
+                    await _hydrate_local_index(purpose, user_id)
+                return await asyncio.to_thread(
+                    local_index.search, chunk_table, user_id, query_embedding, k=limit, threshold=MATCH_THRESHOLD
+                )
+            except Exception as e:
+                print(f"Local index search failed, falling back to RPC: {e}")
+
+        # 3. Call RPC function
         rpc_name = "match_documents" if purpose == "chat" else "match_test_materials"
         
         params = {
             "query_embedding": query_embedding,
-            "match_threshold": 0.5, # Adjust threshold as needed
+            "match_threshold": MATCH_THRESHOLD,
             "match_count": limit,
             "p_user_id": user_id
         }
         
-        response = supabase.rpc(rpc_name, params).execute()
+        response = await run_query(f"rpc.{rpc_name}", lambda db: db.rpc(rpc_name, params))
         return response.data if response.data else []
         
     except Exception as e:
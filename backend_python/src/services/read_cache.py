@@ -0,0 +1,157 @@
+"""Read-through cache for per-user reads (node progress, student profiles).
+
+Values are stored as JSON together with an ETag (hash of the JSON), so an
+unchanged resource can be answered with ``304 Not Modified`` straight from the
+cache. Write endpoints call ``invalidate`` for the keys they touch; the TTL
+bounds staleness for writes that bypass the API (e.g. the frontend writing to
+Supabase directly) and across workers that use the in-process backend.
+
+``invalidate`` also bumps a per-key generation stored in the backend; a load
+that overlapped an invalidation is returned to its caller but not cached, so
+an older result can never outlive the write that invalidated it.
+
+The backend is pluggable: an in-process LRU by default, or any Redis-compatible
+server when ``READ_CACHE_URL`` is set (``redis://...``) and ``redis`` is
+installed.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from src.services.cache_backends import MemoryBackend, build_redis_backend
+
+
+def build_backend(url: Optional[str] = None, max_entries: int = 10000):
+    return build_redis_backend(url, "READ_CACHE_URL") or MemoryBackend(max_entries)
+
+
+class CachedValue:
+    __slots__ = ("value", "etag")
+
+    def __init__(self, value: Any, etag: str) -> None:
+        self.value = value
+        self.etag = etag
+
+
+def make_etag(payload: str) -> str:
+    return '"' + hashlib.sha1(payload.encode("utf-8")).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """``If-None-Match`` check (handles lists, ``*`` and weak validators)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class ReadThroughCache:
+    """Namespaced JSON cache with ETags on top of a backend."""
+
+    def __init__(self, backend, namespace: str, ttl_seconds: float = 60.0) -> None:
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0, "stale_loads": 0}
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _generation_key(self, key: str) -> str:
+        return f"{self.namespace}:gen:{key}"
+
+    async def _generation(self, key: str) -> Optional[str]:
+        try:
+            return await self.backend.get(self._generation_key(key))
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"⚠️ Read cache generation get failed ({self.namespace}): {e}")
+            return None
+
+    @staticmethod
+    def encode(value: Any) -> CachedValue:
+        """``value`` normalized through JSON, with its ETag (not stored)."""
+        payload = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+        return CachedValue(json.loads(payload), make_etag(payload))
+
+    async def get(self, key: str) -> Optional[CachedValue]:
+        try:
+            raw = await self.backend.get(self._key(key))
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"⚠️ Read cache get failed ({self.namespace}): {e}")
+            raw = None
+        if raw is None:
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        entry = json.loads(raw)
+        return CachedValue(entry["value"], entry["etag"])
+
+    async def set(self, key: str, value: Any) -> CachedValue:
+        cached = self.encode(value)
+        try:
+            await self.backend.set(
+                self._key(key),
+                json.dumps({"etag": cached.etag, "value": cached.value}, ensure_ascii=False),
+                self.ttl_seconds,
+            )
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"⚠️ Read cache set failed ({self.namespace}): {e}")
+        return cached
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> CachedValue:
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+        generation = await self._generation(key)
+        value = await loader()
+        if await self._generation(key) != generation:
+            # Bị invalidate trong lúc load -> kết quả có thể cũ, không cache
+            self._stats["stale_loads"] += 1
+            return self.encode(value)
+        return await self.set(key, value)
+
+    async def invalidate(self, key: str) -> None:
+        self._stats["invalidations"] += 1
+        try:
+            # Đổi generation trước khi xoá: load nào đang chạy sẽ không ghi đè giá trị cũ
+            await self.backend.set(self._generation_key(key), uuid.uuid4().hex, max(self.ttl_seconds * 2, 60.0))
+            await self.backend.delete(self._key(key))
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"⚠️ Read cache invalidate failed ({self.namespace}): {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            **self._stats,
+        }
+
+
+read_cache_backend = build_backend(
+    os.getenv("READ_CACHE_URL"),
+    max_entries=int(os.getenv("READ_CACHE_MAX_ENTRIES", "10000")),
+)
+_ttl = float(os.getenv("READ_CACHE_TTL_SECONDS", "60"))
+
+node_progress_cache = ReadThroughCache(read_cache_backend, "node_progress", ttl_seconds=_ttl)
+student_profile_cache = ReadThroughCache(read_cache_backend, "student_profile", ttl_seconds=_ttl)
+performance_summary_cache = ReadThroughCache(read_cache_backend, "performance_summary", ttl_seconds=_ttl)
+
+
+def read_cache_stats() -> Dict[str, Any]:
+    return {
+        "backend": read_cache_backend.name,
+        "entries": read_cache_backend.size(),
+        "node_progress": node_progress_cache.stats(),
+        "student_profile": student_profile_cache.stats(),
+        "performance_summary": performance_summary_cache.stats(),
+    }
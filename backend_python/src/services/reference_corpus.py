@@ -0,0 +1,181 @@
+"""In-memory corpus of reference materials (exercises/tests folders).
+
+Files are extracted once, keyed by (mtime, size), persisted to an on-disk cache
+and served from memory. A lightweight polling watcher re-extracts only the
+files that changed, so request handlers never parse PDFs/DOCX themselves.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.utils.file_utils import extract_text_from_file
+
+SUPPORTED_PATTERNS = ("*.pdf", "*.docx", "*.doc")
+CACHE_FORMAT_VERSION = 1
+
+
+class ReferenceCorpus:
+    """Extracted text of every supported file in ``folder``."""
+
+    def __init__(self, name: str, folder: Path, cache_dir: Path) -> None:
+        self.name = name
+        self.folder = Path(folder)
+        self.cache_path = Path(cache_dir) / f"{name}.json"
+        self._lock = threading.Lock()
+        # file name -> {"mtime_ns": int, "size": int, "text": str}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._order: List[str] = []
+        self._combined: Dict[int, str] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self._stats = {"extractions": 0, "refreshes": 0, "last_refresh_ms": 0.0}
+        self._load_cache()
+
+    # ----- persistence -----
+
+    def _load_cache(self) -> None:
+        try:
+            with self.cache_path.open("r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"⚠️ Không đọc được cache tài liệu {self.cache_path}: {e}")
+            return
+
+        if payload.get("version") != CACHE_FORMAT_VERSION:
+            return
+        entries = payload.get("entries") or {}
+        with self._lock:
+            self._entries = {k: v for k, v in entries.items() if isinstance(v, dict)}
+            self._order = [n for n in payload.get("order", []) if n in self._entries]
+            self._combined.clear()
+
+    def _save_cache(self) -> None:
+        with self._lock:
+            payload = {
+                "version": CACHE_FORMAT_VERSION,
+                "order": list(self._order),
+                "entries": dict(self._entries),
+            }
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix(".json.tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print(f"⚠️ Không lưu được cache tài liệu {self.cache_path}: {e}")
+
+    # ----- extraction -----
+
+    def _list_files(self) -> List[Path]:
+        if not self.folder.exists():
+            return []
+        files: List[Path] = []
+        for pattern in SUPPORTED_PATTERNS:
+            files.extend(sorted(self.folder.glob(pattern)))
+        return files
+
+    def refresh(self) -> bool:
+        """Re-extract new/changed files and drop deleted ones.
+
+        Blocking (PDF parsing); call it from a worker thread. Returns True when
+        the corpus changed.
+        """
+        started = time.perf_counter()
+        files = self._list_files()
+        with self._lock:
+            known = dict(self._entries)
+
+        changed = False
+        entries: Dict[str, Dict[str, Any]] = {}
+        for path in files:
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entry = known.get(path.name)
+            if entry and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+                entries[path.name] = entry
+                continue
+
+            print(f"📄 Loading: {path.name}")
+            entries[path.name] = {
+                "mtime_ns": st.st_mtime_ns,
+                "size": st.st_size,
+                "text": extract_text_from_file(str(path)),
+            }
+            self._stats["extractions"] += 1
+            changed = True
+
+        order = [p.name for p in files if p.name in entries]
+        if set(entries) != set(known) or order != self._order:
+            changed = True
+
+        if changed:
+            with self._lock:
+                self._entries = entries
+                self._order = order
+                self._combined.clear()
+            self._save_cache()
+
+        self._stats["refreshes"] += 1
+        self._stats["last_refresh_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return changed
+
+    # ----- serving -----
+
+    def get_text(self, max_files: int = 5) -> str:
+        """Combined text of the first ``max_files`` documents (memoized)."""
+        with self._lock:
+            cached = self._combined.get(max_files)
+            if cached is not None:
+                return cached
+
+            parts = []
+            for file_name in self._order[:max_files]:
+                text = self._entries[file_name].get("text")
+                if text:
+                    parts.append(f"\n\n=== TÀI LIỆU: {file_name} ===\n{text}\n")
+            combined = "".join(parts)
+            self._combined[max_files] = combined
+            return combined
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            files = len(self._order)
+            chars = sum(len(e.get("text") or "") for e in self._entries.values())
+        return {"files": files, "characters": chars, **self._stats}
+
+    # ----- lifecycle -----
+
+    async def start(self, watch_interval_seconds: float = 30.0) -> None:
+        """Extract once (off the event loop) and start the change watcher."""
+        await asyncio.to_thread(self.refresh)
+        print(f"📚 Reference corpus '{self.name}': {self.stats()['files']} file(s) ready")
+        if watch_interval_seconds > 0 and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch(watch_interval_seconds))
+
+    async def stop(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await asyncio.to_thread(self.refresh):
+                    print(f"🔄 Reference corpus '{self.name}' updated")
+            except Exception as e:
+                print(f"⚠️ Reference corpus '{self.name}' refresh failed: {e}")
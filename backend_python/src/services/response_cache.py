@@ -0,0 +1,139 @@
+"""Two-tier cache for LLM-generated responses.
+
+Keys are the SHA-256 of ``namespace`` + the request payload as canonical JSON
+(sorted keys, no whitespace), so logically identical requests share an entry
+regardless of field order. Lookups go to a bounded in-process LRU first
+(entry count and byte budget, TTL) and then to a shared tier that every uvicorn
+worker sees: a SQLite file by default, or a Redis-compatible server when
+``RESPONSE_CACHE_URL`` is set.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from src.services.cache_backends import MemoryBackend, SQLiteBackend, build_redis_backend
+
+_DEFAULT_DB_PATH = Path(__file__).resolve().parents[2] / ".cache" / "response_cache.db"
+
+
+def canonical_json(payload: Any) -> str:
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def response_key(namespace: str, payload: Any) -> str:
+    digest = hashlib.sha256(canonical_json(payload).encode("utf-8")).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+class ResponseCache:
+    def __init__(self, memory: MemoryBackend, shared=None, default_ttl_seconds: float = 600.0) -> None:
+        self.memory = memory
+        self.shared = shared
+        self.default_ttl_seconds = default_ttl_seconds
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"memory_hits": 0, "shared_hits": 0, "misses": 0, "writes": 0, "errors": 0}
+        )
+
+    async def get(self, namespace: str, payload: Any) -> Optional[Any]:
+        key = response_key(namespace, payload)
+        stats = self._stats[namespace]
+        raw = await self.memory.get(key)
+        if raw is not None:
+            stats["memory_hits"] += 1
+            return json.loads(raw)
+
+        if self.shared is not None:
+            try:
+                raw = await self.shared.get(key)
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"⚠️ Response cache read failed ({namespace}): {e}")
+                raw = None
+            if raw is not None:
+                stats["shared_hits"] += 1
+                await self.memory.set(key, raw, self.default_ttl_seconds)
+                return json.loads(raw)
+
+        stats["misses"] += 1
+        return None
+
+    async def set(self, namespace: str, payload: Any, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        key = response_key(namespace, payload)
+        ttl = ttl_seconds or self.default_ttl_seconds
+        raw = canonical_json(value)
+        stats = self._stats[namespace]
+        stats["writes"] += 1
+        await self.memory.set(key, raw, ttl)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, raw, ttl)
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"⚠️ Response cache write failed ({namespace}): {e}")
+
+    async def get_or_compute(
+        self,
+        namespace: str,
+        payload: Any,
+        compute: Callable[[], Awaitable[Any]],
+        ttl_seconds: Optional[float] = None,
+    ) -> Any:
+        """Cached value for ``payload``; otherwise ``await compute()`` and store it.
+
+        ``compute`` must return something JSON-serializable; exceptions are not
+        cached.
+        """
+        cached = await self.get(namespace, payload)
+        if cached is not None:
+            return cached
+        value = await compute()
+        await self.set(namespace, payload, value, ttl_seconds)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        namespaces = {}
+        for namespace, counts in self._stats.items():
+            lookups = counts["memory_hits"] + counts["shared_hits"] + counts["misses"]
+            hits = counts["memory_hits"] + counts["shared_hits"]
+            namespaces[namespace] = {
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                **counts,
+            }
+        return {
+            "shared_backend": self.shared.name if self.shared is not None else None,
+            "memory_entries": self.memory.size(),
+            "memory_bytes": self.memory.size_bytes(),
+            "memory_max_bytes": self.memory.max_bytes,
+            "memory_evictions": self.memory.evictions,
+            "namespaces": namespaces,
+        }
+
+
+def _build_shared_tier():
+    url = os.getenv("RESPONSE_CACHE_URL")
+    redis_backend = build_redis_backend(url, "RESPONSE_CACHE_URL")
+    if redis_backend is not None:
+        return redis_backend
+    db_path = os.getenv("RESPONSE_CACHE_DB", str(_DEFAULT_DB_PATH))
+    if not db_path:
+        return None
+    try:
+        return SQLiteBackend(db_path, table="responses")
+    except Exception as e:
+        print(f"⚠️ Response cache DB disabled ({db_path}): {e}")
+        return None
+
+
+response_cache = ResponseCache(
+    memory=MemoryBackend(
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000")),
+        max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ),
+    shared=_build_shared_tier(),
+    default_ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600")),
+)
@@ -0,0 +1,201 @@
+"""Schema-constrained test generation.
+
+Tests are requested with ``response_schema`` derived from ``TestSchema`` (set
+``STRUCTURED_OUTPUT=0`` for SDKs without structured output) and validated with
+``TestSchema.model_validate_json`` in a single pass. When validation fails, the
+response is parsed leniently and every part (``multipleChoice``,
+``trueFalse``, ``shortAnswer``) is validated on its own: only the broken or
+missing parts are sent back to Gemini with a small repair prompt, instead of the
+frontend regenerating the whole test.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from src.ai_schemas.gemini_schema import to_gemini_schema
+from src.ai_schemas.test_schema import (
+    MultipleChoicePartSchema,
+    ShortAnswerPartSchema,
+    TestSchema,
+    TrueFalsePartSchema,
+)
+from src.services.llm_gateway import llm_gateway
+from src.services.model_registry import model_registry
+from src.utils import json_repair
+
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "1") != "0"
+REPAIR_ATTEMPTS = int(os.getenv("TEST_REPAIR_ATTEMPTS", "1"))
+
+PART_SCHEMAS: Dict[str, Type[BaseModel]] = {
+    "multipleChoice": MultipleChoicePartSchema,
+    "trueFalse": TrueFalsePartSchema,
+    "shortAnswer": ShortAnswerPartSchema,
+}
+PART_LABELS = {
+    "multipleChoice": "PHẦN 1: TRẮC NGHIỆM (4 lựa chọn, answer là chỉ số 0-3)",
+    "trueFalse": "PHẦN 2: ĐÚNG/SAI (mỗi câu 4 mệnh đề, answer là 4 giá trị true/false)",
+    "shortAnswer": "PHẦN 3: TRẢ LỜI NGẮN (answer là chuỗi số, tối đa 6 ký tự)",
+}
+
+_SCHEMAS = {name: to_gemini_schema(schema) for name, schema in PART_SCHEMAS.items()}
+_SCHEMAS["test"] = to_gemini_schema(TestSchema)
+
+_stats = {"generations": 0, "valid_first_pass": 0, "part_repairs": 0, "repaired_parts": 0, "failures": 0}
+
+
+class TestGenerationError(ValueError):
+    """The model did not produce a usable test, even after repairs."""
+
+
+def structured_config(generation_config: Dict[str, Any], schema: str = "test") -> Dict[str, Any]:
+    """``generation_config`` constrained to one of the test schemas."""
+    if not STRUCTURED_OUTPUT:
+        return generation_config
+    return {**generation_config, "response_mime_type": "application/json", "response_schema": _SCHEMAS[schema]}
+
+
+def _format_errors(error: ValidationError, limit: int = 6) -> str:
+    lines = [
+        f"- {'.'.join(str(part) for part in item['loc']) or '(gốc)'}: {item['msg']}"
+        for item in error.errors()[:limit]
+    ]
+    return "\n".join(lines)
+
+
+def _validate_parts(
+    data: Any, required_parts: Iterable[str]
+) -> Tuple[Dict[str, BaseModel], Dict[str, Tuple[Any, Optional[str]]]]:
+    """Valid parts, and the failed ones as ``name -> (raw value, error text)``."""
+    parts = data.get("parts") if isinstance(data, dict) else None
+    if not isinstance(parts, dict):
+        parts = {}
+    valid: Dict[str, BaseModel] = {}
+    failed: Dict[str, Tuple[Any, Optional[str]]] = {}
+    for name, schema in PART_SCHEMAS.items():
+        raw = parts.get(name)
+        if raw is None:
+            if name in required_parts:
+                failed[name] = (None, None)
+            continue
+        try:
+            valid[name] = schema.model_validate(raw)
+        except ValidationError as e:
+            failed[name] = (raw, _format_errors(e))
+    return valid, failed
+
+
+def _repair_prompt(name: str, topic: str, raw: Any, errors: Optional[str]) -> str:
+    if raw is None:
+        return (
+            f'Tạo phần "{name}" ({PART_LABELS[name]}) cho đề kiểm tra Toán 12 về chủ đề "{topic}".\n'
+            "Mỗi câu hỏi phải có đầy đủ dữ liệu cụ thể, dùng LaTeX cho công thức.\n"
+            "Chỉ trả về JSON của phần này."
+        )
+    return (
+        f'Phần "{name}" ({PART_LABELS[name]}) của đề kiểm tra Toán 12 về chủ đề "{topic}" sai định dạng.\n'
+        f"Lỗi:\n{errors}\n"
+        f"Dữ liệu hiện tại:\n{json.dumps(raw, ensure_ascii=False)[:6000]}\n"
+        "Sửa các lỗi trên, giữ nguyên nội dung câu hỏi hợp lệ. Chỉ trả về JSON của phần này."
+    )
+
+
+async def _repair_part(
+    name: str, topic: str, raw: Any, errors: Optional[str],
+    model_name: str, system_instruction: Optional[str], generation_config: Dict[str, Any],
+) -> Optional[BaseModel]:
+    schema = PART_SCHEMAS[name]
+    model = model_registry.get(model_name, system_instruction, structured_config(generation_config, name))
+    for _ in range(REPAIR_ATTEMPTS):
+        _stats["part_repairs"] += 1
+        response = await llm_gateway.generate(model, _repair_prompt(name, topic, raw, errors))
+        try:
+            candidate = json_repair.parse_model_json(response.text)
+        except json.JSONDecodeError as e:
+            errors = f"- JSON không hợp lệ: {e.msg}"
+            continue
+        try:
+            part = schema.model_validate(candidate)
+        except ValidationError as e:
+            raw, errors = candidate, _format_errors(e)
+            continue
+        _stats["repaired_parts"] += 1
+        return part
+    return None
+
+
+def _parse(text: str) -> Tuple[Optional[TestSchema], Any]:
+    """(validated test, None) on the fast path, otherwise (None, leniently parsed data)."""
+    if not json_repair.has_latex_escape(text):
+        try:
+            return TestSchema.model_validate_json(text), None
+        except ValidationError:
+            pass
+    try:
+        return None, json_repair.parse_model_json(text)
+    except json.JSONDecodeError as e:
+        print(f"⚠️ Test JSON unparseable at offset {e.pos}: {e.msg}")
+        return None, {}
+
+
+async def generate_test(
+    prompt: str,
+    topic: str,
+    model_name: str,
+    system_instruction: Optional[str],
+    generation_config: Dict[str, Any],
+    required_parts: Iterable[str] = ("multipleChoice",),
+    coalesce: bool = True,
+) -> Dict[str, Any]:
+    """Generate a test matching ``TestSchema`` and return it as a dict.
+
+    Raises ``TestGenerationError`` when a required part is still invalid after
+    ``TEST_REPAIR_ATTEMPTS`` repair prompts; optional parts that cannot be
+    repaired are dropped.
+    """
+    _stats["generations"] += 1
+    required_parts = tuple(required_parts)
+    model = model_registry.get(model_name, system_instruction, structured_config(generation_config))
+    response = await llm_gateway.generate(model, prompt, coalesce=coalesce)
+
+    test, data = _parse(response.text)
+    if test is not None and all(getattr(test.parts, name) is not None for name in required_parts):
+        _stats["valid_first_pass"] += 1
+        return test.model_dump(exclude_none=True)
+    if test is not None:
+        data = test.model_dump(exclude_none=True)
+
+    valid, failed = _validate_parts(data, required_parts)
+    if failed:
+        print(f"🔧 Repairing test parts for '{topic}': {', '.join(failed)}")
+    repaired = await asyncio.gather(*(
+        _repair_part(name, topic, raw, errors, model_name, system_instruction, generation_config)
+        for name, (raw, errors) in failed.items()
+    ))
+    missing: List[str] = []
+    for name, part in zip(failed, repaired):
+        if part is not None:
+            valid[name] = part
+        elif name in required_parts:
+            missing.append(name)
+        else:
+            print(f"⚠️ Dropping invalid test part '{name}' for '{topic}'")
+    if missing:
+        _stats["failures"] += 1
+        raise TestGenerationError(f"Đề thi thiếu phần hợp lệ: {', '.join(missing)}")
+
+    result: Dict[str, Any] = {
+        "title": (data.get("title") if isinstance(data, dict) else None) or f"KIỂM TRA {topic.upper()}",
+        "parts": {name: part.model_dump() for name, part in valid.items()},
+    }
+    if isinstance(data, dict) and isinstance(data.get("description"), str):
+        result["description"] = data["description"]
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    return {"structured_output": STRUCTURED_OUTPUT, "repair_attempts": REPAIR_ATTEMPTS, **_stats}
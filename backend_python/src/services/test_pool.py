@@ -0,0 +1,285 @@
+"""Pre-generated pool of node tests.
+
+``/api/generate-node-test`` used to call Gemini on every request. The pool keeps
+a few validated tests per node label in SQLite (``TEST_POOL_DB``) and hands
+them out instantly: a user gets a variant they have not seen yet, anonymous
+callers get the least-served one. Whenever a topic runs low on unseen variants
+(or is below ``TEST_POOL_TARGET_SIZE``), background workers generate more, up
+to ``TEST_POOL_MAX_SIZE`` per topic.
+
+On startup the pool is warmed for the known mindmap tree and the most common
+labels in ``mindmap_nodes``; topics first seen at request time are added as
+they come (the test generated for that request seeds the pool).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from src.supabase_client import run_query
+
+_DEFAULT_DB_PATH = Path(__file__).resolve().parents[2] / ".cache" / "test_pool.db"
+
+TestGenerator = Callable[[str], Awaitable[Dict[str, Any]]]
+
+# Cây mindmap lớp 12 mà chat flow dùng làm parent_node_id
+KNOWN_NODE_LABELS = {
+    "ung-dung-dao-ham": "Ứng dụng đạo hàm",
+    "tinh-don-dieu": "Tính đơn điệu",
+    "cuc-tri": "Cực trị",
+    "max-min": "Giá trị lớn nhất - nhỏ nhất",
+}
+
+
+def normalize_topic(topic: str) -> str:
+    return " ".join(topic.split()).casefold()
+
+
+def is_valid_node_test(test: Any) -> bool:
+    """Minimal structural check before a test is stored or served."""
+    if not isinstance(test, dict) or not isinstance(test.get("parts"), dict):
+        return False
+    questions = (test["parts"].get("multipleChoice") or {}).get("questions")
+    return isinstance(questions, list) and len(questions) > 0
+
+
+async def load_mindmap_labels(limit: int) -> List[str]:
+    """Most frequent node labels across users' mindmaps."""
+    if limit <= 0:
+        return []
+    res = await run_query("test_pool.mindmap_labels", lambda db: db.table("mindmap_nodes").select("label").limit(5000))
+    counts = Counter(row["label"].strip() for row in (res.data or []) if (row.get("label") or "").strip())
+    return [label for label, _ in counts.most_common(limit)]
+
+
+class TestPool:
+    def __init__(
+        self,
+        db_path: str,
+        target_size: int = 3,
+        low_watermark: int = 1,
+        max_size: int = 12,
+        refill_concurrency: int = 2,
+        mindmap_topics: int = 20,
+    ) -> None:
+        self.db_path = db_path
+        self.target_size = max(1, target_size)
+        self.low_watermark = max(0, low_watermark)
+        self.max_size = max(self.target_size, max_size)
+        self.refill_concurrency = max(1, refill_concurrency)
+        self.mindmap_topics = mindmap_topics
+        self._lock = threading.Lock()
+        self._db = self._open_db(db_path)
+        self._generator: Optional[TestGenerator] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Set[str] = set()
+        self._workers: List[asyncio.Task] = []
+        self._warm_task: Optional[asyncio.Task] = None
+        self._stats = {"hits": 0, "misses": 0, "generated": 0, "rejected": 0, "duplicates": 0, "failures": 0}
+
+    # ----- SQLite -----
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pool_tests ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, topic_key TEXT NOT NULL, topic TEXT NOT NULL,"
+            " digest TEXT NOT NULL, payload TEXT NOT NULL, served INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, UNIQUE (topic_key, digest))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS pool_tests_serve ON pool_tests (topic_key, served, id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pool_served ("
+            " user_id TEXT NOT NULL, test_id INTEGER NOT NULL, served_at REAL NOT NULL,"
+            " PRIMARY KEY (user_id, test_id))"
+        )
+        conn.commit()
+        return conn
+
+    def _insert(self, topic: str, test: Dict[str, Any], served_to: Optional[str]) -> bool:
+        payload = json.dumps(test, ensure_ascii=False, separators=(",", ":"))
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO pool_tests (topic_key, topic, digest, payload, served, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (normalize_topic(topic), topic, digest, payload, 1 if served_to else 0, now),
+            )
+            inserted = cur.rowcount > 0
+            if inserted and served_to:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO pool_served (user_id, test_id, served_at) VALUES (?, ?, ?)",
+                    (served_to, cur.lastrowid, now),
+                )
+            self._db.commit()
+        return inserted
+
+    def _take(self, topic_key: str, user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if user_id:
+                row = self._db.execute(
+                    "SELECT id, payload FROM pool_tests t WHERE topic_key = ? AND NOT EXISTS"
+                    " (SELECT 1 FROM pool_served s WHERE s.user_id = ? AND s.test_id = t.id)"
+                    " ORDER BY served, id LIMIT 1",
+                    (topic_key, user_id),
+                ).fetchone()
+            else:
+                row = self._db.execute(
+                    "SELECT id, payload FROM pool_tests WHERE topic_key = ? ORDER BY served, id LIMIT 1",
+                    (topic_key,),
+                ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE pool_tests SET served = served + 1 WHERE id = ?", (row["id"],))
+            if user_id:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO pool_served (user_id, test_id, served_at) VALUES (?, ?, ?)",
+                    (user_id, row["id"], time.time()),
+                )
+            self._db.commit()
+        return json.loads(row["payload"])
+
+    def _stock(self, topic_key: str, user_id: Optional[str]) -> Dict[str, int]:
+        """Total variants for the topic and how many of them ``user_id`` has not seen."""
+        with self._lock:
+            total = self._db.execute(
+                "SELECT COUNT(*) FROM pool_tests WHERE topic_key = ?", (topic_key,)
+            ).fetchone()[0]
+            seen = 0
+            if user_id:
+                seen = self._db.execute(
+                    "SELECT COUNT(*) FROM pool_served s JOIN pool_tests t ON t.id = s.test_id"
+                    " WHERE s.user_id = ? AND t.topic_key = ?",
+                    (user_id, topic_key),
+                ).fetchone()[0]
+        return {"total": total, "unseen": total - seen}
+
+    def _counts(self) -> Dict[str, int]:
+        with self._lock:
+            topics, tests = self._db.execute(
+                "SELECT COUNT(DISTINCT topic_key), COUNT(*) FROM pool_tests"
+            ).fetchone()
+        return {"topics": topics, "tests": tests}
+
+    # ----- public API -----
+
+    async def take(self, topic: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """A stored test for ``topic`` (unseen by ``user_id`` if given), or None."""
+        topic_key = normalize_topic(topic)
+        test = await asyncio.to_thread(self._take, topic_key, user_id)
+        self._stats["hits" if test is not None else "misses"] += 1
+        stock = await asyncio.to_thread(self._stock, topic_key, user_id)
+        if stock["total"] < self.target_size or (
+            user_id and stock["unseen"] <= self.low_watermark and stock["total"] < self.max_size
+        ):
+            self.request_refill(topic)
+        return test
+
+    async def add(self, topic: str, test: Dict[str, Any], served_to: Optional[str] = None) -> bool:
+        """Store a test generated outside the pool (e.g. on a cache miss)."""
+        if not is_valid_node_test(test):
+            self._stats["rejected"] += 1
+            return False
+        inserted = await asyncio.to_thread(self._insert, topic, test, served_to)
+        if not inserted:
+            self._stats["duplicates"] += 1
+        return inserted
+
+    def request_refill(self, topic: str) -> None:
+        topic_key = normalize_topic(topic)
+        if self._queue is None or topic_key in self._pending:
+            return
+        self._pending.add(topic_key)
+        self._queue.put_nowait(topic)
+
+    async def start(self, generator: TestGenerator, topics: Optional[List[str]] = None) -> None:
+        if self._workers:
+            return
+        self._generator = generator
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"test-pool-worker-{i}")
+            for i in range(self.refill_concurrency)
+        ]
+        self._warm_task = asyncio.create_task(self._warm(topics or []), name="test-pool-warm")
+
+    async def stop(self) -> None:
+        tasks = self._workers + ([self._warm_task] if self._warm_task else [])
+        self._workers, self._warm_task, self._queue = [], None, None
+        self._pending.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ----- background refill -----
+
+    async def _warm(self, topics: List[str]) -> None:
+        try:
+            topics = topics + await load_mindmap_labels(self.mindmap_topics)
+        except Exception as e:
+            print(f"⚠️ Could not load mindmap labels for the test pool: {e}")
+        unique = {normalize_topic(topic): topic for topic in reversed(topics)}
+        for topic in reversed(list(unique.values())):
+            self.request_refill(topic)
+
+    async def _worker(self) -> None:
+        while True:
+            topic = await self._queue.get()
+            try:
+                await self._refill(topic)
+            finally:
+                self._pending.discard(normalize_topic(topic))
+
+    async def _refill(self, topic: str) -> None:
+        topic_key = normalize_topic(topic)
+        stock = await asyncio.to_thread(self._stock, topic_key, None)
+        # Đủ target thì mỗi lần refill chỉ thêm 1 biến thể (cho người dùng đã làm hết)
+        wanted = max(self.target_size - stock["total"], 1)
+        wanted = min(wanted, self.max_size - stock["total"])
+        for _ in range(wanted):
+            try:
+                test = await self._generator(topic)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failures"] += 1
+                print(f"⚠️ Test pool generation failed for '{topic}': {e}")
+                return
+            if await self.add(topic, test):
+                self._stats["generated"] += 1
+
+    async def stats(self) -> Dict[str, Any]:
+        counts = await asyncio.to_thread(self._counts)
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **counts,
+            "target_size": self.target_size,
+            "max_size": self.max_size,
+            "workers": len(self._workers),
+            "refills_pending": len(self._pending),
+            "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            **self._stats,
+        }
+
+
+node_test_pool = TestPool(
+    db_path=os.getenv("TEST_POOL_DB") or str(_DEFAULT_DB_PATH),
+    target_size=int(os.getenv("TEST_POOL_TARGET_SIZE", "3")),
+    low_watermark=int(os.getenv("TEST_POOL_LOW_WATERMARK", "1")),
+    max_size=int(os.getenv("TEST_POOL_MAX_SIZE", "12")),
+    refill_concurrency=int(os.getenv("TEST_POOL_REFILL_CONCURRENCY", "2")),
+    mindmap_topics=int(os.getenv("TEST_POOL_MINDMAP_TOPICS", "20")),
+)
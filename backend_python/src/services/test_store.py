@@ -0,0 +1,242 @@
+"""Store for generated tests.
+
+Each test is one compact JSON file written atomically (temp file +
+``os.replace``), indexed in SQLite by topic / difficulty / test type so entries
+can be looked up, counted and evicted without scanning the folder. The least
+recently used tests are evicted once the store exceeds ``max_entries`` or
+``max_bytes``; the hottest ones are also kept decoded in memory.
+
+``get_or_generate`` runs concurrent identical generations once (single-flight),
+so a whole class requesting the same test costs a single Gemini call.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.utils.singleflight import SingleFlight
+
+Generator = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+def test_key(fields: Dict[str, Any]) -> str:
+    raw = json.dumps(fields, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class TestStore:
+    def __init__(
+        self,
+        folder: Path,
+        max_entries: int = 2000,
+        max_bytes: int = 200 * 1024 * 1024,
+        hot_entries: int = 128,
+    ) -> None:
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.hot_entries = max(0, hot_entries)
+        self._hot: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._stats = {"hot_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._db = sqlite3.connect(str(self.folder / "index.db"), check_same_thread=False, timeout=5)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tests ("
+            " key TEXT PRIMARY KEY, topic TEXT NOT NULL, difficulty TEXT, test_type TEXT,"
+            " num_questions INTEGER, file_name TEXT NOT NULL, size_bytes INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS tests_lookup ON tests (topic, difficulty, test_type)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tests_lru ON tests (last_access)")
+        self._db.commit()
+
+    # ----- memory tier -----
+
+    def _remember(self, key: str, data: Dict[str, Any]) -> None:
+        if not self.hot_entries:
+            return
+        with self._lock:
+            self._hot[key] = data
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.hot_entries:
+                self._hot.popitem(last=False)
+
+    def _hot_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            data = self._hot.get(key)
+            if data is not None:
+                self._hot.move_to_end(key)
+            return data
+
+    # ----- disk tier (runs in a worker thread) -----
+
+    def _touch(self, key: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE tests SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT file_name FROM tests WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with (self.folder / row["file_name"]).open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Test store entry {key} unreadable, dropping it: {e}")
+            self._delete(key)
+            return None
+        self._touch(key)
+        return data
+
+    def _write(self, key: str, meta: Dict[str, Any], data: Dict[str, Any]) -> None:
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        file_name = f"{key}.json"
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix=".tmp_", suffix=".json")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(payload)
+            os.replace(tmp_path, self.folder / file_name)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tests (key, topic, difficulty, test_type, num_questions,"
+                " file_name, size_bytes, created_at, last_access, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (
+                    key,
+                    meta.get("topic", ""),
+                    meta.get("difficulty"),
+                    meta.get("testType"),
+                    meta.get("numQuestions"),
+                    file_name,
+                    len(payload),
+                    now,
+                    now,
+                ),
+            )
+            self._db.commit()
+        self._evict()
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            row = self._db.execute("SELECT file_name FROM tests WHERE key = ?", (key,)).fetchone()
+            self._db.execute("DELETE FROM tests WHERE key = ?", (key,))
+            self._db.commit()
+            self._hot.pop(key, None)
+        if row is not None:
+            try:
+                (self.folder / row["file_name"]).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> None:
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM tests"
+            ).fetchone()
+            if count <= self.max_entries and total <= self.max_bytes:
+                return
+            victims: List[str] = []
+            for row in self._db.execute("SELECT key, size_bytes FROM tests ORDER BY last_access"):
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                victims.append(row["key"])
+                count -= 1
+                total -= row["size_bytes"]
+        for key in victims:
+            self._delete(key)
+        self._stats["evictions"] += len(victims)
+
+    # ----- public API -----
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self._hot_get(key)
+        if data is not None:
+            self._stats["hot_hits"] += 1
+            await asyncio.to_thread(self._touch, key)
+            return data
+        data = await asyncio.to_thread(self._read, key)
+        if data is None:
+            self._stats["misses"] += 1
+            return None
+        self._stats["disk_hits"] += 1
+        self._remember(key, data)
+        return data
+
+    async def put(self, key: str, meta: Dict[str, Any], data: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._write, key, meta, data)
+        self._remember(key, data)
+        self._stats["writes"] += 1
+
+    async def get_or_generate(self, meta: Dict[str, Any], generate: Generator) -> Dict[str, Any]:
+        """Stored test for ``meta``; otherwise generate it once, even under concurrent requests."""
+        key = test_key(meta)
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        async def generate_and_store() -> Dict[str, Any]:
+            # Có thể request khác vừa ghi xong trong lúc chờ
+            existing = await asyncio.to_thread(self._read, key)
+            if existing is not None:
+                return existing
+            data = await generate()
+            try:
+                await self.put(key, meta, data)
+            except Exception as e:
+                print(f"⚠️ Could not store generated test {key}: {e}")
+            return data
+
+        return await self._flight.do(key, generate_and_store)
+
+    def _index_stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM tests"
+            ).fetchone()
+        return {"entries": count, "bytes": total}
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hot_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+        hits = self._stats["hot_hits"] + self._stats["disk_hits"]
+        return {
+            **self._index_stats(),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hot_entries": len(self._hot),
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "single_flight": self._flight.stats(),
+            **self._stats,
+        }
+
+
+_DEFAULT_FOLDER = Path(__file__).resolve().parents[2] / "generated_tests"
+
+test_store = TestStore(
+    folder=Path(os.getenv("TEST_STORE_DIR", str(_DEFAULT_FOLDER))),
+    max_entries=int(os.getenv("TEST_STORE_MAX_ENTRIES", "2000")),
+    max_bytes=int(os.getenv("TEST_STORE_MAX_BYTES", str(200 * 1024 * 1024))),
+    hot_entries=int(os.getenv("TEST_STORE_HOT_ENTRIES", "128")),
+)
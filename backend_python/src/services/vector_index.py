@@ -0,0 +1,342 @@
+"""Optional in-process vector index for RAG retrieval.
+
+Chunks are partitioned by (chunk table, user_id). Small partitions are
+searched by brute force (one float32 matrix product over L2-normalized
+vectors, i.e. cosine similarity); partitions above ``hnsw_threshold`` chunks
+also get an HNSW graph so a top-k query only touches a few hundred vectors.
+The graph is built outside the index lock (searches fall back to brute force
+meanwhile), and partitions are evicted least-recently-used beyond
+``max_partitions`` partitions or ``max_rows`` rows in total.
+
+Every method may do O(n) work: call them from a worker thread
+(``asyncio.to_thread``), not from the event loop.
+
+NumPy is required; without it ``LocalVectorIndex.available`` is False and
+callers keep using the Supabase RPCs.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+def _normalize(matrix: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HNSWGraph:
+    """Minimal HNSW graph over normalized vectors (distance = 1 - cosine)."""
+
+    def __init__(self, dim: int, m: int = 16, ef_construction: int = 100, ef_search: int = 64, seed: int = 42) -> None:
+        self.dim = dim
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_mult = 1 / math.log(m)
+        self._rng = random.Random(seed)
+        self._data = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        self._neighbors: List[List[List[int]]] = []
+        self._entry: Optional[int] = None
+        self._max_level = -1
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _append_vector(self, vector: "np.ndarray") -> int:
+        if self._size == len(self._data):
+            capacity = max(64, len(self._data) * 2)
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[: self._size] = self._data[: self._size]
+            self._data = grown
+        self._data[self._size] = vector
+        self._size += 1
+        return self._size - 1
+
+    def _distances(self, query: "np.ndarray", ids: Sequence[int]) -> "np.ndarray":
+        return 1.0 - self._data[list(ids)] @ query
+
+    def _search_layer(self, query: "np.ndarray", entry_points: List[int], ef: int, level: int) -> List[Tuple[float, int]]:
+        visited = set(entry_points)
+        dists = self._distances(query, entry_points)
+        candidates = [(float(d), i) for d, i in zip(dists, entry_points)]
+        heapq.heapify(candidates)
+        results = [(-d, i) for d, i in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            dist, current = heapq.heappop(candidates)
+            if dist > -results[0][0] and len(results) >= ef:
+                break
+            fresh = [n for n in self._neighbors[current][level] if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for d, n in zip(self._distances(query, fresh), fresh):
+                d = float(d)
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, n))
+                    heapq.heappush(results, (-d, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-d, i) for d, i in results)
+
+    def _prune(self, node: int, level: int, limit: int) -> None:
+        links = self._neighbors[node][level]
+        if len(links) <= limit:
+            return
+        dists = self._distances(self._data[node], links)
+        keep = np.argsort(dists)[:limit]
+        self._neighbors[node][level] = [links[i] for i in keep]
+
+    def add(self, vector: "np.ndarray") -> int:
+        node = self._append_vector(vector)
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        self._neighbors.append([[] for _ in range(level + 1)])
+
+        if self._entry is None:
+            self._entry, self._max_level = node, level
+            return node
+
+        query = self._data[node]
+        entry_points = [self._entry]
+        for lvl in range(self._max_level, level, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, lvl)[0][1]]
+
+        for lvl in range(min(level, self._max_level), -1, -1):
+            found = self._search_layer(query, entry_points, self.ef_construction, lvl)
+            limit = self.m0 if lvl == 0 else self.m
+            selected = [i for _, i in found[:limit]]
+            self._neighbors[node][lvl] = selected
+            for neighbor in selected:
+                self._neighbors[neighbor][lvl].append(node)
+                self._prune(neighbor, lvl, limit)
+            entry_points = [i for _, i in found]
+
+        if level > self._max_level:
+            self._entry, self._max_level = node, level
+        return node
+
+    def search(self, query: "np.ndarray", k: int) -> List[Tuple[float, int]]:
+        """``(similarity, node)`` pairs, best first."""
+        if self._entry is None:
+            return []
+        entry_points = [self._entry]
+        for lvl in range(self._max_level, 0, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, lvl)[0][1]]
+        found = self._search_layer(query, entry_points, max(self.ef_search, k), 0)
+        return [(1.0 - d, i) for d, i in found[:k]]
+
+
+class _Partition:
+    def __init__(self, hnsw_threshold: int) -> None:
+        self.hnsw_threshold = hnsw_threshold
+        self.rows: List[Dict[str, Any]] = []
+        self.loaded_at = time.time()
+        self._chunks: List["np.ndarray"] = []
+        self._matrix: Optional["np.ndarray"] = None
+        self._graph: Optional[HNSWGraph] = None
+        self.building = False
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _matrix_view(self) -> "np.ndarray":
+        if self._chunks:
+            parts = ([self._matrix] if self._matrix is not None else []) + self._chunks
+            self._matrix = np.vstack(parts)
+            self._chunks = []
+        return self._matrix
+
+    def add(self, rows: List[Dict[str, Any]], vectors: "np.ndarray") -> None:
+        if not rows:
+            return
+        vectors = _normalize(vectors)
+        self.rows.extend(rows)
+        self._chunks.append(vectors)
+        if self._graph is not None:
+            for vector in vectors:
+                self._graph.add(vector)
+
+    @property
+    def needs_graph(self) -> bool:
+        return self._graph is None and not self.building and len(self.rows) >= self.hnsw_threshold
+
+    def build_graph(self) -> None:
+        matrix = self._matrix_view()
+        graph = HNSWGraph(dim=matrix.shape[1])
+        for vector in matrix:
+            graph.add(vector)
+        self._graph = graph
+
+    def search(self, query: "np.ndarray", k: int) -> List[Tuple[float, int]]:
+        if not self.rows:
+            return []
+        if self._graph is not None:
+            return self._graph.search(query, k)
+        scores = self._matrix_view() @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(i)) for i in top]
+
+
+class LocalVectorIndex:
+    """Top-k cosine search over chunk embeddings, partitioned per user."""
+
+    def __init__(
+        self,
+        hnsw_threshold: int = 20000,
+        ttl_seconds: float = 300.0,
+        max_partitions: int = 256,
+        max_rows: int = 500_000,
+    ) -> None:
+        self.hnsw_threshold = hnsw_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_partitions = max(1, max_partitions)
+        self.max_rows = max_rows
+        # LRU: partition dùng gần nhất ở cuối
+        self._partitions: "OrderedDict[Tuple[str, str], _Partition]" = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._stats = {"searches": 0, "hydrations": 0, "added_rows": 0, "graph_builds": 0, "evictions": 0}
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def is_fresh(self, table: str, user_id: str) -> bool:
+        partition = self._partitions.get((table, user_id))
+        return partition is not None and time.time() - partition.loaded_at < self.ttl_seconds
+
+    @staticmethod
+    def _split(rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], "np.ndarray"]:
+        metas = []
+        vectors = []
+        for row in rows:
+            embedding = row.get("embedding")
+            if not embedding:
+                continue
+            meta = {k: v for k, v in row.items() if k != "embedding"}
+            metas.append(meta)
+            vectors.append(embedding)
+        if not vectors:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return metas, np.asarray(vectors, dtype=np.float32)
+
+    def _evict(self) -> None:
+        # Gọi khi đang giữ self._lock; luôn giữ lại partition mới nhất
+        while len(self._partitions) > 1 and (
+            len(self._partitions) > self.max_partitions or self._rows > self.max_rows
+        ):
+            _, evicted = self._partitions.popitem(last=False)
+            self._rows -= len(evicted)
+            self._stats["evictions"] += 1
+
+    def _build_graph(self, key: Tuple[str, str], partition: _Partition) -> None:
+        # Dựng HNSW ngoài lock; trong lúc đó search vẫn chạy brute force
+        with self._lock:
+            if not partition.needs_graph:
+                return
+            partition.building = True
+            matrix = partition._matrix_view()
+        try:
+            graph = HNSWGraph(dim=matrix.shape[1])
+            for vector in matrix:
+                graph.add(vector)
+            with self._lock:
+                # Các vector được thêm trong lúc dựng
+                for vector in partition._matrix_view()[len(matrix):]:
+                    graph.add(vector)
+                partition._graph = graph
+        finally:
+            partition.building = False
+        self._stats["graph_builds"] += 1
+
+    def hydrate(self, table: str, user_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Replace the partition with ``rows`` (each carrying an ``embedding``)."""
+        partition = _Partition(self.hnsw_threshold)
+        metas, vectors = self._split(rows)
+        partition.add(metas, vectors)
+        if partition.needs_graph:
+            # Partition chưa được công bố -> dựng graph không cần lock
+            partition.build_graph()
+            self._stats["graph_builds"] += 1
+        key = (table, user_id)
+        with self._lock:
+            previous = self._partitions.pop(key, None)
+            if previous is not None:
+                self._rows -= len(previous)
+            self._partitions[key] = partition
+            self._rows += len(partition)
+            self._evict()
+        self._stats["hydrations"] += 1
+
+    def add(self, table: str, user_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Append freshly inserted chunks to an already loaded partition."""
+        key = (table, user_id)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                return
+            metas, vectors = self._split(rows)
+            partition.add(metas, vectors)
+            self._rows += len(metas)
+            self._evict()
+        self._stats["added_rows"] += len(metas)
+        if partition.needs_graph:
+            self._build_graph(key, partition)
+
+    def invalidate(self, table: str, user_id: str) -> None:
+        """Drop a partition so the next search reloads it."""
+        with self._lock:
+            partition = self._partitions.pop((table, user_id), None)
+            if partition is not None:
+                self._rows -= len(partition)
+
+    def search(
+        self, table: str, user_id: str, query_embedding: List[float], k: int = 5, threshold: float = 0.0
+    ) -> List[Dict[str, Any]]:
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            partition = self._partitions.get((table, user_id))
+            if partition is None:
+                return []
+            self._partitions.move_to_end((table, user_id))
+            hits = partition.search(query, k)
+            results = [
+                {**partition.rows[i], "similarity": score}
+                for score, i in hits
+                if score >= threshold
+            ]
+        self._stats["searches"] += 1
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            partitions = len(self._partitions)
+            rows = self._rows
+            graphs = sum(1 for p in self._partitions.values() if p._graph is not None)
+        return {
+            "available": self.available,
+            "partitions": partitions,
+            "max_partitions": self.max_partitions,
+            "rows": rows,
+            "hnsw_partitions": graphs,
+            **self._stats,
+        }
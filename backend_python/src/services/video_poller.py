@@ -0,0 +1,199 @@
+"""Central status tracking for in-flight video generation jobs.
+
+Instead of one polling loop per segment, every provider job is registered with
+a single ``VideoStatusPoller``. Each tick it checks all jobs that are due in one
+batch (``provider.get_job_statuses`` when the provider has it, otherwise
+concurrent ``get_job_status`` calls); a job whose status did not change is
+polled less and less often (exponential backoff up to ``max_interval``).
+
+Providers that can push completions call ``complete`` directly (see
+``set_completion_callback`` on the provider, or the ``/videos/provider-callback``
+webhook), which skips polling entirely. A pushed job that this process does not
+track (it was submitted by another worker) is looked up with ``resolve``. The
+``apply`` callback persists a status and is expected to touch the database only
+when something actually changed.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ApplyStatus = Callable[[Any, Dict[str, Any]], Awaitable[bool]]
+# provider_job_id -> segment_id (None nếu không có job đang chạy)
+ResolveJob = Callable[[str], Awaitable[Optional[Any]]]
+
+TERMINAL_STATUSES = frozenset({"done", "failed"})
+
+
+@dataclass
+class _TrackedJob:
+    segment_id: Any
+    next_poll_at: float
+    interval: float
+    last_status: str = "processing"
+    errors: int = 0
+
+
+class VideoStatusPoller:
+    def __init__(
+        self,
+        provider: Any,
+        apply: ApplyStatus,
+        base_interval_seconds: float = 2.0,
+        max_interval_seconds: float = 30.0,
+        max_batch: int = 50,
+        max_errors: int = 5,
+        resolve: Optional[ResolveJob] = None,
+    ) -> None:
+        self.provider = provider
+        self.apply = apply
+        self.resolve = resolve
+        self.base_interval_seconds = base_interval_seconds
+        self.max_interval_seconds = max(base_interval_seconds, max_interval_seconds)
+        self.max_batch = max(1, max_batch)
+        self.max_errors = max(1, max_errors)
+        self._jobs: Dict[str, _TrackedJob] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stats = {
+            "ticks": 0,
+            "status_checks": 0,
+            "batched_calls": 0,
+            "pushed_completions": 0,
+            "changes": 0,
+            "provider_errors": 0,
+        }
+        set_callback = getattr(provider, "set_completion_callback", None)
+        if callable(set_callback):
+            set_callback(self.complete)
+
+    # ----- public API -----
+
+    def track(self, segment_id: Any, provider_job_id: str) -> None:
+        """Start following ``provider_job_id`` until it reaches a terminal status."""
+        self._jobs[provider_job_id] = _TrackedJob(
+            segment_id=segment_id,
+            next_poll_at=time.monotonic() + self.base_interval_seconds,
+            interval=self.base_interval_seconds,
+        )
+        self._ensure_started()
+        self._wakeup.set()
+
+    def untrack(self, provider_job_id: str) -> None:
+        self._jobs.pop(provider_job_id, None)
+
+    def is_tracking(self, provider_job_id: str) -> bool:
+        return provider_job_id in self._jobs
+
+    async def complete(self, provider_job_id: str, payload: Dict[str, Any]) -> bool:
+        """Push path: apply a status reported by the provider (callback / webhook)."""
+        job = self._jobs.get(provider_job_id)
+        if job is None:
+            # Job do worker khác gửi -> tìm segment trong DB
+            segment_id = await self.resolve(provider_job_id) if self.resolve is not None else None
+            if segment_id is None:
+                return False
+            self._stats["pushed_completions"] += 1
+            await self.apply(segment_id, payload)
+            return True
+        self._stats["pushed_completions"] += 1
+        await self._apply(provider_job_id, job, payload)
+        return True
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    # ----- loop -----
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="video-status-poller")
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            due = sorted(
+                (job_id for job_id, job in self._jobs.items() if job.next_poll_at <= now),
+                key=lambda job_id: self._jobs[job_id].next_poll_at,
+            )[: self.max_batch]
+            if due:
+                self._stats["ticks"] += 1
+                await self._poll(due)
+                continue
+
+            self._wakeup.clear()
+            timeout = None
+            if self._jobs:
+                timeout = max(0.0, min(job.next_poll_at for job in self._jobs.values()) - now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, job_ids: List[str]) -> None:
+        self._stats["status_checks"] += len(job_ids)
+        batch = getattr(self.provider, "get_job_statuses", None)
+        if callable(batch):
+            self._stats["batched_calls"] += 1
+            try:
+                statuses = await batch(job_ids)
+                results: List[Any] = [statuses.get(job_id) for job_id in job_ids]
+            except Exception as e:
+                results = [e] * len(job_ids)
+        else:
+            results = await asyncio.gather(
+                *(self.provider.get_job_status(job_id) for job_id in job_ids), return_exceptions=True
+            )
+
+        for job_id, payload in zip(job_ids, results):
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if isinstance(payload, BaseException) or payload is None:
+                self._stats["provider_errors"] += 1
+                job.errors += 1
+                if job.errors >= self.max_errors:
+                    await self._apply(job_id, job, {
+                        "status": "failed",
+                        "video_url": None,
+                        "error_message": f"status_check_failed: {payload}",
+                    })
+                else:
+                    self._backoff(job)
+                continue
+            job.errors = 0
+            await self._apply(job_id, job, payload)
+
+    async def _apply(self, job_id: str, job: _TrackedJob, payload: Dict[str, Any]) -> None:
+        status = payload.get("status") or "processing"
+        try:
+            changed = await self.apply(job.segment_id, payload)
+        except Exception as e:
+            print(f"⚠️ Could not store status of video job {job_id}: {e}")
+            self._backoff(job)
+            return
+        if changed:
+            self._stats["changes"] += 1
+        if status in TERMINAL_STATUSES:
+            self._jobs.pop(job_id, None)
+            return
+        if status != job.last_status:
+            # Trạng thái vừa đổi -> poll lại sớm
+            job.last_status = status
+            job.interval = self.base_interval_seconds
+            job.next_poll_at = time.monotonic() + job.interval
+        else:
+            self._backoff(job)
+
+    def _backoff(self, job: _TrackedJob) -> None:
+        job.interval = min(job.interval * 2, self.max_interval_seconds)
+        job.next_poll_at = time.monotonic() + job.interval
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tracked_jobs": len(self._jobs), **self._stats}
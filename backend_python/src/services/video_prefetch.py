@@ -0,0 +1,143 @@
+"""How far ahead of the viewer node video segments should be generated.
+
+``trigger_next_segment`` used to start segment N+1 only once playback was 20 s
+into segment N, which stalls whenever generation takes longer than the 10 s
+left. The planner instead keeps, per viewing session (video + viewer), the
+playback rate measured from successive progress reports, and a histogram of
+observed generation latency (queue claim -> ``done``). Every segment the viewer will reach within the
+expected latency (``quantile`` of the histogram, plus ``safety_seconds``) is
+planned now, at least the next one and at most ``max_ahead`` ahead; each planned
+segment comes with the number of seconds until the viewer reaches it, which the
+scheduler uses as priority.
+
+Until ``min_samples`` generations have been observed, ``default_latency_seconds``
+is assumed.
+"""
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class GenerationLatency:
+    """Histogram of segment generation time (fixed second buckets)."""
+
+    BUCKETS_SECONDS = (10, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(self.BUCKETS_SECONDS) + 1)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[bisect_left(self.BUCKETS_SECONDS, seconds)] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        # Cận trên của bucket chứa phân vị q (ước lượng thận trọng)
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.BUCKETS_SECONDS + (self.max_seconds,), self.buckets):
+            seen += n
+            if seen >= rank:
+                return float(min(bound, self.max_seconds))
+        return self.max_seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{b}s" for b in self.BUCKETS_SECONDS] + [f"gt_{self.BUCKETS_SECONDS[-1]}s"]
+        return {
+            "count": self.count,
+            "avg_seconds": round(self.total_seconds / self.count, 2) if self.count else 0.0,
+            "max_seconds": round(self.max_seconds, 2),
+            "p50_seconds": self.quantile(0.5),
+            "p90_seconds": self.quantile(0.9),
+            "buckets": dict(zip(labels, self.buckets)),
+        }
+
+
+class PrefetchPlanner:
+    def __init__(
+        self,
+        segment_duration_seconds: int,
+        max_ahead: int = 3,
+        quantile: float = 0.9,
+        default_latency_seconds: float = 60.0,
+        min_samples: int = 5,
+        safety_seconds: float = 5.0,
+        max_sessions: int = 10_000,
+    ) -> None:
+        self.segment_duration_seconds = segment_duration_seconds
+        self.max_ahead = max(1, max_ahead)
+        self.quantile = quantile
+        self.default_latency_seconds = default_latency_seconds
+        self.min_samples = max(1, min_samples)
+        self.safety_seconds = safety_seconds
+        self.max_sessions = max_sessions
+        self.latency = GenerationLatency()
+        # phiên xem (video_id, viewer_id) -> (thời điểm report, giây đang xem, tốc độ phát ước lượng)
+        self._sessions: "OrderedDict[Any, Tuple[float, int, float]]" = OrderedDict()
+        self._stats = {"plans": 0, "planned_segments": 0}
+
+    def observe_latency(self, seconds: float) -> None:
+        if seconds >= 0:
+            self.latency.observe(seconds)
+
+    def expected_latency(self) -> float:
+        if self.latency.count < self.min_samples:
+            return self.default_latency_seconds
+        return self.latency.quantile(self.quantile) or self.default_latency_seconds
+
+    def playback_rate(self, session: Any, current_second: int) -> float:
+        """Update and return the playback rate of ``session`` from a new progress report."""
+        now = time.monotonic()
+        previous = self._sessions.pop(session, None)
+        rate = 1.0
+        if previous is not None:
+            reported_at, second, rate = previous
+            elapsed = now - reported_at
+            advanced = current_second - second
+            # Bỏ qua tua / báo trùng; tạm dừng kéo tốc độ xuống
+            if elapsed >= 1 and 0 <= advanced <= elapsed * 4:
+                rate = 0.7 * rate + 0.3 * (advanced / elapsed)
+            rate = min(max(rate, 0.25), 4.0)
+        self._sessions[session] = (now, current_second, rate)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return rate
+
+    def plan(self, session: Any, current_second: int, record: bool = True) -> List[Tuple[int, float]]:
+        """Segments to have generated as ``(segment_index, seconds until the viewer reaches it)``.
+
+        With ``record=False`` the plan assumes normal speed and ``session`` is not tracked.
+        """
+        rate = self.playback_rate(session, current_second) if record else 1.0
+        duration = self.segment_duration_seconds
+        current_index = current_second // duration
+        # Segment nào người xem sẽ tới trước khi một job sinh mới kịp xong -> sinh ngay
+        horizon = current_second + (self.expected_latency() + self.safety_seconds) * rate
+        last_index = min(max(int(horizon // duration), current_index + 1), current_index + self.max_ahead)
+        planned = [
+            (index, max(0.0, (index * duration - current_second) / rate))
+            for index in range(current_index, last_index + 1)
+        ]
+        self._stats["plans"] += 1
+        self._stats["planned_segments"] += len(planned)
+        return planned
+
+    def forget(self, session: Any) -> None:
+        self._sessions.pop(session, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "expected_latency_seconds": self.expected_latency(),
+            "viewing_sessions": len(self._sessions),
+            "latency": self.latency.snapshot(),
+            **self._stats,
+        }
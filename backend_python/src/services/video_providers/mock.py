@@ -1,6 +1,6 @@
 import asyncio
 import uuid
-from typing import Dict, Optional
+from typing import Awaitable, Callable, Dict, Optional
 
 from .base import VideoProvider
 
@@ -10,6 +10,11 @@ class MockVideoProvider(VideoProvider):
 
     def __init__(self) -> None:
         self._jobs: Dict[str, Dict[str, Optional[str]]] = {}
+        self._on_complete: Optional[Callable[[str, dict], Awaitable[object]]] = None
+
+    def set_completion_callback(self, callback: Callable[[str, dict], Awaitable[object]]) -> None:
+        """Push finished jobs to ``callback(job_id, status)`` instead of waiting to be polled."""
+        self._on_complete = callback
 
     async def create_video_segment(self, prompt: str, duration_seconds: int, audio_url: str | None = None) -> str:
         job_id = str(uuid.uuid4())
@@ -29,6 +34,8 @@ class MockVideoProvider(VideoProvider):
         if job:
             job["status"] = "done"
             job["video_url"] = f"https://cdn.example.com/videos/{job_id}.mp4"
+            if self._on_complete is not None:
+                await self._on_complete(job_id, dict(job))
 
     async def get_job_status(self, provider_job_id: str) -> dict:
         job = self._jobs.get(provider_job_id)
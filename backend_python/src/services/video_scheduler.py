@@ -0,0 +1,297 @@
+"""Durable scheduling of video segment generation over ``video_segments``.
+
+Segments are queued in the database (``status="pending"``) instead of being
+handed to untracked ``asyncio.create_task`` calls, so a restart loses nothing:
+
+- every worker claims rows with a lease (``lease_owner`` / ``lease_until``) via
+  a conditional ``UPDATE``; leases are renewed while the worker is alive and
+  released on shutdown, so another worker (or the restarted one) picks up
+  segments whose lease expired;
+- a claimed segment that already has a ``provider_job_id`` is resumed (handed
+  to the status poller) rather than submitted again;
+- at most ``max_concurrent_jobs`` segments are in ``processing`` across all
+  workers, matching the provider quota (claims are checked per tick, so
+  concurrent workers can overshoot by one tick's batch at most);
+- pending segments are claimed by ``needed_at`` — the time the viewer will
+  reach them — so the segment being watched next goes first;
+- a segment whose ``content_key`` is already being generated (for another
+  video or viewer) is not submitted again; it waits for that job's result;
+- failed submissions are retried with a delay up to ``max_attempts`` times.
+
+``housekeeping`` (e.g. dropping prefetched segments nobody will watch) runs in
+a thread at most every ``housekeeping_seconds``, before claiming. It returns the
+ids of the videos it changed; those, and every video whose segments the
+scheduler changes, are passed to ``on_change`` (cache invalidation).
+"""
+from __future__ import annotations
+
+import asyncio
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import aliased
+from sqlmodel import select
+
+from src.db import SessionLocal
+from src.video_models import NodeVideo, VideoSegment
+
+# (segment_id, payload) -> id các video bị thay đổi
+StoreStatus = Callable[[Any, Dict[str, Any]], List[Any]]
+OnChange = Callable[[List[Any]], Awaitable[None]]
+
+# (segment_id, node_video_id, provider_job_id, prompt, audio_url)
+_Claim = Tuple[Any, Any, Optional[str], str, Optional[str]]
+
+
+class VideoJobScheduler:
+    def __init__(
+        self,
+        provider: Any,
+        poller: Any,
+        store_status: StoreStatus,
+        segment_duration_seconds: int,
+        max_concurrent_jobs: int = 4,
+        lease_seconds: float = 60.0,
+        tick_seconds: float = 2.0,
+        max_attempts: int = 3,
+        retry_delay_seconds: float = 30.0,
+        housekeeping: Optional[Callable[[], Iterable[Any]]] = None,
+        housekeeping_seconds: float = 15.0,
+        on_change: Optional[OnChange] = None,
+    ) -> None:
+        self.provider = provider
+        self.poller = poller
+        self.store_status = store_status
+        self.segment_duration_seconds = segment_duration_seconds
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        self.lease_seconds = max(5.0, lease_seconds)
+        self.tick_seconds = max(0.1, tick_seconds)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay_seconds = retry_delay_seconds
+        self.housekeeping = housekeeping
+        self.housekeeping_seconds = housekeeping_seconds
+        self.on_change = on_change
+        self.worker_id = f"{socket.gethostname()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._submitting: set = set()
+        self._last_heartbeat = 0.0
+        self._last_housekeeping = 0.0
+        self._stats = {"ticks": 0, "submitted": 0, "resumed": 0, "retries": 0, "failed": 0, "lease_conflicts": 0}
+
+    # ----- public API -----
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="video-job-scheduler")
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # Trả lease để lần khởi động sau (hoặc worker khác) nhận lại ngay
+        await asyncio.to_thread(self._release_leases)
+
+    def notify(self) -> None:
+        """Wake the scheduler (safe from request threads): new work or free capacity."""
+        if self._loop is None or self._wakeup is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # ----- loop -----
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Video scheduler tick failed: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.tick_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tick(self) -> None:
+        self._stats["ticks"] += 1
+        loop = asyncio.get_running_loop()
+        if loop.time() - self._last_heartbeat >= self.lease_seconds / 3:
+            await asyncio.to_thread(self._renew_leases)
+            self._last_heartbeat = loop.time()
+        if self.housekeeping is not None and loop.time() - self._last_housekeeping >= self.housekeeping_seconds:
+            self._last_housekeeping = loop.time()
+            await self._changed(await asyncio.to_thread(self.housekeeping))
+
+        claims = await asyncio.to_thread(self._claim)
+        await self._changed([video_id for _, video_id, _, _, _ in claims])
+        for segment_id, video_id, job_id, prompt, audio_url in claims:
+            if job_id:
+                self._stats["resumed"] += 1
+                self.poller.track(segment_id, job_id)
+            elif segment_id not in self._submitting:
+                self._submitting.add(segment_id)
+                asyncio.create_task(self._submit(segment_id, video_id, prompt, audio_url))
+
+    async def _submit(self, segment_id: Any, video_id: Any, prompt: str, audio_url: Optional[str]) -> None:
+        try:
+            job_id = await self.provider.create_video_segment(prompt, self.segment_duration_seconds, audio_url)
+        except Exception as e:
+            print(f"Error processing segment job: {e}")
+            await self._changed(await asyncio.to_thread(self._submit_failed, segment_id, video_id, str(e)))
+            return
+        finally:
+            self._submitting.discard(segment_id)
+        self._stats["submitted"] += 1
+        await asyncio.to_thread(self._save_job_id, segment_id, job_id)
+        await self._changed([video_id])
+        # Trạng thái tiếp theo do poller (hoặc callback của provider) cập nhật
+        self.poller.track(segment_id, job_id)
+
+    async def _changed(self, video_ids: Optional[Iterable[Any]]) -> None:
+        video_ids = list(video_ids or [])
+        if video_ids and self.on_change is not None:
+            await self.on_change(video_ids)
+
+    # ----- database (chạy trong thread) -----
+
+    def _claim(self) -> List[_Claim]:
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        lease_free = or_(VideoSegment.lease_until.is_(None), VideoSegment.lease_until <= now)
+        with SessionLocal() as session:
+            # 1. Segment đang processing mà mất lease (worker chết / bản cũ) -> nhận lại
+            candidates = session.exec(
+                select(VideoSegment.id, VideoSegment.status, VideoSegment.content_key)
+                .where(VideoSegment.status == "processing", lease_free)
+                .limit(self.max_concurrent_jobs)
+            ).all()
+            # 2. Segment chờ sinh, trong giới hạn quota, ưu tiên segment người xem sắp tới
+            active = session.exec(
+                select(func.count()).select_from(VideoSegment).where(VideoSegment.status == "processing")
+            ).one()
+            free = self.max_concurrent_jobs - active
+            if free > 0:
+                sibling = aliased(VideoSegment)
+                in_flight = (
+                    select(sibling.id)
+                    .where(sibling.content_key == VideoSegment.content_key, sibling.status == "processing")
+                    .exists()
+                )
+                pending = session.exec(
+                    select(VideoSegment.id, VideoSegment.status, VideoSegment.content_key)
+                    .where(VideoSegment.status == "pending", lease_free, ~in_flight)
+                    .order_by(VideoSegment.needed_at, VideoSegment.created_at)
+                    .limit(free)
+                ).all()
+                # Nhiều segment cùng nội dung trong một lượt -> chỉ sinh segment đầu tiên
+                keys = set()
+                for row in pending:
+                    if row[2] is None or row[2] not in keys:
+                        keys.add(row[2])
+                        candidates.append(row)
+
+            claimed = []
+            for segment_id, status, _ in candidates:
+                values = {"status": "processing", "lease_owner": self.worker_id, "lease_until": lease_until}
+                if status == "pending":
+                    values.update(attempts=VideoSegment.attempts + 1, updated_at=now)
+                result = session.execute(
+                    update(VideoSegment)
+                    .where(VideoSegment.id == segment_id, VideoSegment.status == status, lease_free)
+                    .values(**values)
+                )
+                if result.rowcount == 1:
+                    claimed.append(segment_id)
+                else:
+                    self._stats["lease_conflicts"] += 1
+            session.commit()
+            if not claimed:
+                return []
+
+            rows = session.exec(
+                select(
+                    VideoSegment.id,
+                    VideoSegment.node_video_id,
+                    VideoSegment.provider_job_id,
+                    NodeVideo.prompt,
+                    NodeVideo.audio_url,
+                )
+                .join(NodeVideo, NodeVideo.id == VideoSegment.node_video_id)
+                .where(VideoSegment.id.in_(claimed))
+            ).all()
+            # Video cha chuyển sang processing nếu trước đó chưa
+            for video in session.exec(
+                select(NodeVideo).where(
+                    NodeVideo.id.in_(select(VideoSegment.node_video_id).where(VideoSegment.id.in_(claimed))),
+                    NodeVideo.status != "processing",
+                )
+            ).all():
+                video.status = "processing"
+                video.updated_at = now
+                session.add(video)
+            session.commit()
+        return [tuple(row) for row in rows]
+
+    def _renew_leases(self) -> None:
+        with SessionLocal() as session:
+            session.execute(
+                update(VideoSegment)
+                .where(VideoSegment.lease_owner == self.worker_id, VideoSegment.status == "processing")
+                .values(lease_until=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+            )
+            session.commit()
+
+    def _release_leases(self) -> None:
+        with SessionLocal() as session:
+            session.execute(
+                update(VideoSegment)
+                .where(VideoSegment.lease_owner == self.worker_id, VideoSegment.status == "processing")
+                .values(lease_owner=None, lease_until=None)
+            )
+            session.commit()
+
+    def _save_job_id(self, segment_id: Any, job_id: str) -> None:
+        with SessionLocal() as session:
+            session.execute(
+                update(VideoSegment).where(VideoSegment.id == segment_id).values(provider_job_id=job_id)
+            )
+            session.commit()
+
+    def _submit_failed(self, segment_id: Any, video_id: Any, error: str) -> List[Any]:
+        with SessionLocal() as session:
+            segment = session.get(VideoSegment, segment_id)
+            if segment is None:
+                return []
+            if segment.attempts < self.max_attempts:
+                # Trả về hàng đợi, chỉ nhận lại sau retry_delay_seconds
+                self._stats["retries"] += 1
+                segment.status = "pending"
+                segment.error_message = error
+                segment.lease_owner = None
+                segment.lease_until = datetime.utcnow() + timedelta(seconds=self.retry_delay_seconds)
+                segment.updated_at = datetime.utcnow()
+                session.add(segment)
+                session.commit()
+                return [video_id]
+        self._stats["failed"] += 1
+        return self.store_status(segment_id, {"status": "failed", "error_message": error})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": self._task is not None,
+            "max_concurrent_jobs": self.max_concurrent_jobs,
+            "submitting": len(self._submitting),
+            **self._stats,
+        }
@@ -1,119 +1,315 @@
 import asyncio
-from datetime import datetime
-from typing import List, Optional
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
-from fastapi import BackgroundTasks, HTTPException
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlalchemy.orm import joinedload
 from sqlmodel import Session, select
 
 from src.db import SessionLocal
-from src.schemas.video import CreateVideoRequest
+from src.schemas.video import CreateVideoRequest, NodeVideoRead
+from src.services.read_cache import CachedValue, ReadThroughCache, read_cache_backend
 from src.video_models import NodeVideo, VideoSegment
-
-# Import provider
-# from .video_providers.mock import MockVideoProvider
-from .video_providers.google_veo import GoogleVeoProvider
+from src.services.video_poller import TERMINAL_STATUSES, VideoStatusPoller
+from src.services.video_prefetch import PrefetchPlanner
+from src.services.video_scheduler import VideoJobScheduler
 
 SEGMENT_DURATION_SECONDS = 30
-SEGMENT_TRIGGER_OFFSET_SECONDS = 20
+# Không có progress report trong khoảng này -> coi như người xem đã rời đi
+VIEWER_IDLE_SECONDS = int(os.getenv("VIDEO_VIEWER_IDLE_SECONDS", "90"))
+
+# NodeVideoRead đã serialize, theo video id (và "node:<node_id>" -> video id).
+# Mọi thay đổi segment / video đi qua invalidate_videos; TTL giới hạn độ trễ giữa các worker.
+node_video_cache = ReadThroughCache(
+    read_cache_backend, "node_video", ttl_seconds=float(os.getenv("VIDEO_READ_CACHE_TTL_SECONDS", "3"))
+)
+
+
+async def invalidate_videos(video_ids: Iterable[Any], node_id: Optional[str] = None) -> None:
+    for video_id in set(video_ids):
+        await node_video_cache.invalidate(str(video_id))
+    if node_id is not None:
+        await node_video_cache.invalidate(f"node:{node_id}")
+
 
 # --- KHỞI TẠO PROVIDER ---
-# Đảm bảo bạn đã có GOOGLE_API_KEY trong file .env
-provider = GoogleVeoProvider(model="veo-002")
-# Nếu muốn test nhanh mà không tốn tiền, dùng dòng dưới:
-# provider = MockVideoProvider()
+# VIDEO_PROVIDER=mock để test nhanh mà không tốn tiền;
+# mặc định dùng Google Veo (cần GOOGLE_API_KEY trong file .env)
+if os.getenv("VIDEO_PROVIDER", "veo").lower() == "mock":
+    from .video_providers.mock import MockVideoProvider
+
+    provider = MockVideoProvider()
+else:
+    from .video_providers.google_veo import GoogleVeoProvider
+
+    provider = GoogleVeoProvider(model="veo-002")
 # -------------------------
 
-def _create_segment(
-    session: Session,
+def segment_content_key(
+    prompt: str, segment_index: int, duration_seconds: int, audio_url: Optional[str]
+) -> str:
+    """Khoá nội dung của một segment: cùng khoá -> cùng video, sinh một lần và dùng chung."""
+    raw = json.dumps([prompt, segment_index, duration_seconds, audio_url], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _new_segment(
     video: NodeVideo,
     segment_index: int,
     status: str = "pending",
+    needed_at: Optional[datetime] = None,
 ) -> VideoSegment:
     start_second = segment_index * SEGMENT_DURATION_SECONDS
     end_second = start_second + SEGMENT_DURATION_SECONDS
-    segment = VideoSegment(
+    return VideoSegment(
         node_video_id=video.id,
         segment_index=segment_index,
         start_second=start_second,
         end_second=end_second,
         status=status,
+        needed_at=needed_at or datetime.utcnow(),
+        content_key=segment_content_key(video.prompt, segment_index, SEGMENT_DURATION_SECONDS, video.audio_url),
     )
-    session.add(segment)
-    session.commit()
-    session.refresh(segment)
-    return segment
-
-
-def _update_video_status(session: Session, video: NodeVideo) -> None:
-    segments: List[VideoSegment] = session.exec(
-        select(VideoSegment).where(VideoSegment.node_video_id == video.id)
-    ).all()
-    if all(seg.status == "done" for seg in segments):
-        video.status = "done"
-    elif any(seg.status == "failed" for seg in segments):
-        video.status = "failed"
+
+
+def _update_video_status(session: Session, video: NodeVideo) -> bool:
+    """Tính lại status của video cha; chỉ ghi (không commit) khi status đổi."""
+    statuses = set(session.exec(
+        select(VideoSegment.status).where(VideoSegment.node_video_id == video.id)
+    ).all())
+    if statuses and statuses <= {"done"}:
+        status = "done"
+    elif "failed" in statuses:
+        status = "failed"
     else:
-        video.status = "processing"
+        status = "processing"
+    if video.status == status:
+        return False
+    video.status = status
     video.updated_at = datetime.utcnow()
     session.add(video)
+    return True
+
+
+def _store_segment_status(segment_id, payload: dict) -> List[Any]:
+    """Ghi status mới của segment (và video cha) nếu thực sự thay đổi; trả về id các video bị đổi."""
+    status = payload.get("status") or "processing"
+    video_url = payload.get("video_url")
+    error_message = payload.get("error_message")
+    with SessionLocal() as session:
+        segment = session.get(VideoSegment, segment_id)
+        if not segment:
+            return []
+        if (segment.status, segment.video_url, segment.error_message) == (status, video_url, error_message):
+            return []
+        if segment.status == "processing" and status == "done":
+            # updated_at được đặt lúc scheduler nhận segment -> thời gian sinh thực tế
+            prefetch_planner.observe_latency((datetime.utcnow() - segment.updated_at).total_seconds())
+        segment.status = status
+        segment.video_url = video_url
+        segment.error_message = error_message
+        segment.updated_at = datetime.utcnow()
+        session.add(segment)
+        video_ids = {segment.node_video_id}
+        if status == "done" and segment.content_key:
+            # Segment cùng nội dung đang chờ (video khác / người xem khác) dùng luôn kết quả này
+            for sibling in session.exec(
+                select(VideoSegment).where(
+                    VideoSegment.content_key == segment.content_key,
+                    VideoSegment.status == "pending",
+                )
+            ).all():
+                sibling.status = "done"
+                sibling.video_url = video_url
+                sibling.error_message = None
+                sibling.updated_at = segment.updated_at
+                session.add(sibling)
+                video_ids.add(sibling.node_video_id)
+        session.flush()
+
+        for video in session.exec(select(NodeVideo).where(NodeVideo.id.in_(video_ids))).all():
+            _update_video_status(session, video)
+        session.commit()
+        return list(video_ids)
+
+
+async def _apply_segment_status(segment_id, payload: dict) -> bool:
+    video_ids = await asyncio.to_thread(_store_segment_status, segment_id, payload)
+    if not video_ids:
+        return False
+    await invalidate_videos(video_ids)
+    if payload.get("status") in TERMINAL_STATUSES:
+        # Một job xong -> còn chỗ trong quota cho segment kế tiếp
+        video_scheduler.notify()
+    return True
+
+
+def _segment_for_job(provider_job_id: str) -> Optional[Any]:
+    with SessionLocal() as session:
+        return session.exec(
+            select(VideoSegment.id).where(
+                VideoSegment.provider_job_id == provider_job_id,
+                VideoSegment.status == "processing",
+            )
+        ).first()
+
+
+async def _resolve_job(provider_job_id: str) -> Optional[Any]:
+    return await asyncio.to_thread(_segment_for_job, provider_job_id)
+
+
+# Một poller chung cho mọi segment đang sinh (thay cho vòng lặp poll 5s mỗi segment)
+video_poller = VideoStatusPoller(
+    provider,
+    _apply_segment_status,
+    resolve=_resolve_job,
+    base_interval_seconds=float(os.getenv("VIDEO_POLL_BASE_SECONDS", "2")),
+    max_interval_seconds=float(os.getenv("VIDEO_POLL_MAX_SECONDS", "30")),
+)
+
+
+def _cancel_abandoned_segments() -> List[Any]:
+    """Bỏ các segment prefetch chưa gửi provider của video không còn ai xem."""
+    cutoff = datetime.utcnow() - timedelta(seconds=VIEWER_IDLE_SECONDS)
+    with SessionLocal() as session:
+        return _cancel_pending_segments(session, select(NodeVideo.id).where(NodeVideo.last_viewed_at < cutoff))
+
+
+def _cancel_pending_segments(session: Session, video_ids) -> List[Any]:
+    speculative = (
+        VideoSegment.status == "pending",
+        VideoSegment.segment_index > 0,
+        VideoSegment.node_video_id.in_(video_ids),
+    )
+    affected = session.exec(select(VideoSegment.node_video_id).where(*speculative).distinct()).all()
+    if not affected:
+        return []
+    session.execute(delete(VideoSegment).where(*speculative))
+    for video in session.exec(select(NodeVideo).where(NodeVideo.id.in_(affected))).all():
+        _update_video_status(session, video)
     session.commit()
+    return list(affected)
 
 
-async def _process_segment_job(
-    segment_id: str, prompt: str, audio_url: Optional[str]
-) -> None:
-    """Hàm xử lý job sinh video (chạy background)"""
-    try:
-        # 1. Tạo job
-        with SessionLocal() as session:
-            segment = session.get(VideoSegment, segment_id)
-            if not segment:
-                return
-            job_id = await provider.create_video_segment(prompt, SEGMENT_DURATION_SECONDS, audio_url)
-            segment.provider_job_id = job_id
-            segment.status = "processing"
-            segment.updated_at = datetime.utcnow()
+prefetch_planner = PrefetchPlanner(
+    segment_duration_seconds=SEGMENT_DURATION_SECONDS,
+    max_ahead=int(os.getenv("VIDEO_PREFETCH_MAX_AHEAD", "3")),
+    default_latency_seconds=float(os.getenv("VIDEO_PREFETCH_DEFAULT_LATENCY_SECONDS", "60")),
+)
+
+
+# Hàng đợi bền vững trên bảng video_segments (thay cho asyncio.create_task không được giữ lại)
+video_scheduler = VideoJobScheduler(
+    provider,
+    video_poller,
+    _store_segment_status,
+    segment_duration_seconds=SEGMENT_DURATION_SECONDS,
+    max_concurrent_jobs=int(os.getenv("VIDEO_MAX_CONCURRENT_JOBS", "4")),
+    lease_seconds=float(os.getenv("VIDEO_JOB_LEASE_SECONDS", "60")),
+    max_attempts=int(os.getenv("VIDEO_JOB_MAX_ATTEMPTS", "3")),
+    housekeeping=_cancel_abandoned_segments,
+    on_change=invalidate_videos,
+)
+
+
+def _plan_segments(
+    session: Session,
+    video: NodeVideo,
+    current_second: int,
+    plan: Optional[List[Tuple[int, float]]] = None,
+    viewed_at: Optional[datetime] = None,
+) -> bool:
+    """Xếp hàng các segment người xem sắp tới (theo prefetch_planner); True nếu segment / video đổi.
+
+    ``last_viewed_at`` chỉ được ghi khi truyền ``viewed_at`` (report_progress ghi có điều tiết).
+    """
+    now = datetime.utcnow()
+    if plan is None:
+        # Chưa có người xem (lúc tạo video) -> không ghi phiên playback-rate
+        plan = prefetch_planner.plan(None, current_second, record=False)
+    existing = {
+        segment.segment_index: segment
+        for segment in session.exec(
+            select(VideoSegment).where(
+                VideoSegment.node_video_id == video.id,
+                VideoSegment.segment_index.in_([index for index, _ in plan]),
+            )
+        ).all()
+    }
+    missing = [index for index, _ in plan if index not in existing]
+    # Segment đã có người sinh (cùng prompt / audio, kể cả video khác) -> dùng lại video_url
+    ready = {}
+    if missing:
+        keys = {
+            segment_content_key(video.prompt, index, SEGMENT_DURATION_SECONDS, video.audio_url): index
+            for index in missing
+        }
+        ready = {
+            keys[key]: video_url
+            for key, video_url in session.exec(
+                select(VideoSegment.content_key, VideoSegment.video_url).where(
+                    VideoSegment.content_key.in_(list(keys)),
+                    VideoSegment.status == "done",
+                )
+            ).all()
+        }
+    added = queued = False
+    for index, lead_seconds in plan:
+        needed_at = now + timedelta(seconds=lead_seconds)
+        segment = existing.get(index)
+        if segment is None:
+            segment = _new_segment(video, index, needed_at=needed_at)
+            if index in ready:
+                segment.status = "done"
+                segment.video_url = ready[index]
+            else:
+                queued = True
             session.add(segment)
-            session.commit()
-
-        # 2. Polling trạng thái
-        while True:
-            status_payload = await provider.get_job_status(job_id)
-            with SessionLocal() as session:
-                segment = session.get(VideoSegment, segment_id)
-                if not segment:
-                    return
-                segment.status = status_payload.get("status", "processing")
-                segment.video_url = status_payload.get("video_url")
-                segment.error_message = status_payload.get("error_message")
-                segment.updated_at = datetime.utcnow()
-                session.add(segment)
-                
-                # Cập nhật trạng thái video cha
-                video = session.get(NodeVideo, segment.node_video_id)
-                if video:
-                    _update_video_status(session, video)
-                session.commit()
-
-                if segment.status in {"done", "failed"}:
-                    break
-            await asyncio.sleep(5) # Đợi 5s rồi poll tiếp
-
-    except Exception as e:
-        print(f"Error processing segment job: {e}")
-        # Cập nhật trạng thái lỗi nếu crash
-        with SessionLocal() as session:
-            segment = session.get(VideoSegment, segment_id)
-            if segment:
-                segment.status = "failed"
-                segment.error_message = str(e)
-                session.add(segment)
-                session.commit()
-
-
-def create_video(
-    session: Session, payload: CreateVideoRequest, background_tasks: BackgroundTasks
-) -> NodeVideo:
+            added = True
+        elif segment.status == "pending" and (
+            segment.needed_at is None or segment.needed_at > needed_at + timedelta(seconds=1)
+        ):
+            # Người xem tới gần hơn dự kiến -> tăng ưu tiên
+            segment.needed_at = needed_at
+            session.add(segment)
+            queued = True
+    if viewed_at is not None:
+        video.last_viewed_at = viewed_at
+        session.add(video)
+    session.flush()
+    status_changed = _update_video_status(session, video)
+    session.commit()
+    if queued:
+        video_scheduler.notify()
+    return added or queued or status_changed
+
+
+def create_video(session: Session, payload: CreateVideoRequest) -> NodeVideo:
+    # Cùng node + prompt + audio đã có video (chưa hỏng) -> dùng lại thay vì sinh lại
+    same_audio = (
+        NodeVideo.audio_url.is_(None) if payload.audio_url is None else NodeVideo.audio_url == payload.audio_url
+    )
+    video = session.exec(
+        select(NodeVideo)
+        .where(
+            NodeVideo.node_id == payload.node_id,
+            NodeVideo.prompt == payload.prompt,
+            same_audio,
+            NodeVideo.status != "failed",
+        )
+        .order_by(NodeVideo.created_at.desc())
+    ).first()
+    if video:
+        _plan_segments(session, video, current_second=0, viewed_at=datetime.utcnow())
+        session.refresh(video)
+        return video
+
     video = NodeVideo(
         node_id=payload.node_id,
         prompt=payload.prompt,
@@ -124,75 +320,201 @@ def create_video(
     session.commit()
     session.refresh(video)
 
-    first_segment = _create_segment(session, video, segment_index=0, status="processing")
-    
-    # Sử dụng asyncio.create_task để xử lý async job độc lập
-    asyncio.create_task(
-        _process_segment_job(
-            first_segment.id, 
-            payload.prompt, 
-            payload.audio_url
-        )
-    )
-    
+    # Segment đầu tiên (người xem cần ngay) và các segment prefetch phía sau
+    _plan_segments(session, video, current_second=0, viewed_at=datetime.utcnow())
+    session.refresh(video)
+
     return video
 
 
+def _video_with_segments():
+    # Một query duy nhất: video + segments (JOIN), thay vì lazy load rồi list_segments lần nữa
+    return select(NodeVideo).options(joinedload(NodeVideo.segments))
+
+
 def get_video(session: Session, video_id: str) -> NodeVideo:
-    video = session.get(NodeVideo, video_id)
+    video = session.exec(_video_with_segments().where(NodeVideo.id == _video_uuid(video_id))).unique().first()
     if not video:
         raise HTTPException(status_code=404, detail="Node video not found")
-    video.segments  # trigger relationship load
     return video
 
+
 def get_video_by_node_id(session: Session, node_id: str) -> Optional[NodeVideo]:
-    statement = select(NodeVideo).where(NodeVideo.node_id == node_id)
-    video = session.exec(statement).first()
-    if video:
-        video.segments
-    return video
+    statement = _video_with_segments().where(NodeVideo.node_id == node_id).order_by(NodeVideo.created_at.desc())
+    return session.exec(statement).unique().first()
 
-def list_segments(session: Session, video_id: str) -> List[VideoSegment]:
-    statement = (
-        select(VideoSegment)
-        .where(VideoSegment.node_video_id == video_id)
-        .order_by(VideoSegment.segment_index)
-    )
-    return session.exec(statement).all()
 
+# ----- read path (cache NodeVideoRead đã serialize) -----
 
-def trigger_next_segment(
-    session: Session, video_id: str, current_second: int, background_tasks: BackgroundTasks
-) -> Optional[VideoSegment]:
-    video = get_video(session, video_id)
-    if current_second < 0:
-        raise HTTPException(status_code=400, detail="current_second must be non-negative")
+def _video_uuid(video_id) -> uuid.UUID:
+    try:
+        return video_id if isinstance(video_id, uuid.UUID) else uuid.UUID(str(video_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Node video not found")
+
+
+def _serialize(video: NodeVideo) -> Dict[str, Any]:
+    return NodeVideoRead.model_validate(video).model_dump(mode="json")
 
-    current_index = current_second // SEGMENT_DURATION_SECONDS
-    position_in_segment = current_second % SEGMENT_DURATION_SECONDS
 
-    if position_in_segment < SEGMENT_TRIGGER_OFFSET_SECONDS:
+def _load_video(video_id) -> Dict[str, Any]:
+    with SessionLocal() as session:
+        return _serialize(get_video(session, video_id))
+
+
+def _load_video_by_node(node_id: str) -> Optional[Dict[str, Any]]:
+    with SessionLocal() as session:
+        video = get_video_by_node_id(session, node_id)
+        return _serialize(video) if video else None
+
+
+async def read_video(video_id) -> CachedValue:
+    key = str(_video_uuid(video_id))
+    return await node_video_cache.get_or_load(key, lambda: asyncio.to_thread(_load_video, key))
+
+
+async def read_video_by_node(node_id: str) -> Optional[CachedValue]:
+    mapping = await node_video_cache.get(f"node:{node_id}")
+    if mapping is not None:
+        return await read_video(mapping.value)
+    payload = await asyncio.to_thread(_load_video_by_node, node_id)
+    if payload is None:
         return None
+    await node_video_cache.set(f"node:{node_id}", payload["id"])
+    return await node_video_cache.set(payload["id"], payload)
 
-    next_segment_index = current_index + 1
-    existing = session.exec(
-        select(VideoSegment).where(
-            VideoSegment.node_video_id == video.id,
-            VideoSegment.segment_index == next_segment_index,
-        )
-    ).first()
-    if existing:
-        return existing
-
-    segment = _create_segment(session, video, next_segment_index, status="processing")
-    
-    # Sử dụng asyncio.create_task để xử lý async job độc lập
-    asyncio.create_task(
-        _process_segment_job(
-            segment.id, 
-            video.prompt, 
-            video.audio_url
+
+# ----- write path -----
+
+def _create_video(payload: CreateVideoRequest) -> str:
+    with SessionLocal() as session:
+        return str(create_video(session, payload).id)
+
+
+async def request_video(payload: CreateVideoRequest) -> CachedValue:
+    """Create (or reuse) the video for ``payload`` and return its serialized read model."""
+    video_id = await asyncio.to_thread(_create_video, payload)
+    await invalidate_videos([video_id], node_id=payload.node_id)
+    return await read_video(video_id)
+
+
+# video id -> lần cuối ghi last_viewed_at (monotonic), để progress report không ghi DB mỗi lần
+# Người xem đang hoạt động trong worker này: video_id -> {viewer_id: lần report cuối (monotonic)}
+_viewers: Dict[str, Dict[str, float]] = {}
+# (video_id, viewer_id) -> (lúc ghi last_viewed_at (monotonic), giá trị đã ghi)
+_viewed_written: Dict[Tuple[str, str], Tuple[float, datetime]] = {}
+
+
+def _active_viewers(video_id: str, now: float) -> Dict[str, float]:
+    viewers = _viewers.get(video_id, {})
+    for viewer_id, seen_at in list(viewers.items()):
+        if now - seen_at >= VIEWER_IDLE_SECONDS:
+            del viewers[viewer_id]
+    return viewers
+
+
+def _prune_viewers(now: float) -> None:
+    for video_id in list(_viewers):
+        if not _active_viewers(video_id, now):
+            del _viewers[video_id]
+    for session_key, (written_at, _) in list(_viewed_written.items()):
+        if now - written_at >= VIEWER_IDLE_SECONDS:
+            del _viewed_written[session_key]
+
+
+def _apply_plan(
+    video_id: str, current_second: int, plan: List[Tuple[int, float]], viewed_at: Optional[datetime]
+) -> bool:
+    with SessionLocal() as session:
+        video = session.get(NodeVideo, _video_uuid(video_id))
+        if not video:
+            raise HTTPException(status_code=404, detail="Node video not found")
+        return _plan_segments(session, video, current_second, plan, viewed_at=viewed_at)
+
+
+def _cancel_for_video(video_id: str, viewed_at: datetime) -> List[Any]:
+    with SessionLocal() as session:
+        # last_viewed_at mới hơn lần ghi của người vừa rời -> còn người xem (ở worker khác)
+        idle = select(NodeVideo.id).where(
+            NodeVideo.id == _video_uuid(video_id),
+            NodeVideo.last_viewed_at <= viewed_at,
         )
-    )
-    
-    return segment
\ No newline at end of file
+        return _cancel_pending_segments(session, idle)
+
+
+def _needs_planning(segment: Optional[Dict[str, Any]], now: datetime, lead_seconds: float) -> bool:
+    # Cùng ngưỡng 1s với _plan_segments: chỉ khi thiếu segment hoặc phải tăng ưu tiên
+    if segment is None:
+        return True
+    if segment["status"] != "pending":
+        return False
+    needed_at = segment.get("needed_at")
+    if needed_at is None:
+        return True
+    return datetime.fromisoformat(needed_at) > now + timedelta(seconds=lead_seconds + 1)
+
+
+async def report_progress(
+    video_id: str, current_second: int, stopped: bool = False, viewer_id: str = ""
+) -> List[Dict[str, Any]]:
+    """Handle a playback progress report; return the video's segments (serialized).
+
+    A video is shared by every viewer of its node, so playback is tracked per
+    ``viewer_id`` and pending prefetch segments are only cancelled when the
+    last viewer stops; otherwise the ``last_viewed_at`` housekeeping cleans up.
+
+    Served from the cached read model: the database is only touched when the
+    plan needs a segment that does not exist yet or whose ``needed_at`` must
+    move earlier, or when this viewer's ``last_viewed_at`` write is due
+    (every ``VIEWER_IDLE_SECONDS / 3``). A segment merely waiting for a free
+    job slot costs nothing.
+    """
+    if current_second < 0:
+        raise HTTPException(status_code=400, detail="current_second must be non-negative")
+    cached = await read_video(video_id)
+    key = cached.value["id"]
+    session_key = (key, viewer_id)
+    now = time.monotonic()
+
+    if stopped:
+        prefetch_planner.forget(session_key)
+        written = _viewed_written.pop(session_key, None)
+        viewers = _active_viewers(key, now)
+        viewers.pop(viewer_id, None)
+        if not viewers:
+            _viewers.pop(key, None)
+        # Còn người khác đang xem (hoặc người này chưa từng ghi ở worker này) -> giữ hàng đợi
+        if viewers or written is None:
+            return cached.value["segments"]
+        # Người xem cuối cùng rời trang -> huỷ các segment prefetch chưa gửi provider
+        if await asyncio.to_thread(_cancel_for_video, key, written[1]):
+            await invalidate_videos([key])
+            cached = await read_video(key)
+        return cached.value["segments"]
+
+    if len(_viewers) > 10_000 or len(_viewed_written) > 10_000:
+        _prune_viewers(now)
+    _viewers.setdefault(key, {})[viewer_id] = now
+
+    plan = prefetch_planner.plan(session_key, current_second)
+    segments = {segment["segment_index"]: segment for segment in cached.value["segments"]}
+    utc_now = datetime.utcnow()
+    viewed_stale = now - _viewed_written.get(session_key, (float("-inf"), None))[0] >= VIEWER_IDLE_SECONDS / 3
+    if viewed_stale or any(_needs_planning(segments.get(index), utc_now, lead) for index, lead in plan):
+        viewed_at = None
+        if viewed_stale:
+            viewed_at = utc_now
+            _viewed_written[session_key] = (now, viewed_at)
+        if await asyncio.to_thread(_apply_plan, key, current_second, plan, viewed_at):
+            await invalidate_videos([key])
+            cached = await read_video(key)
+    return cached.value["segments"]
+
+
+def video_stats() -> Dict[str, Any]:
+    return {
+        "read_cache": node_video_cache.stats(),
+        "poller": video_poller.stats(),
+        "scheduler": video_scheduler.stats(),
+        "prefetch": prefetch_planner.stats(),
+    }
@@ -1,5 +1,10 @@
+import asyncio
 import os
-from supabase import create_client, Client
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Optional
+
+from supabase import AsyncClient, create_client, Client, acreate_client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,4 +12,99 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
+# Client đồng bộ: chỉ dùng cho code chạy trong thread / script, không gọi trực tiếp trong async route
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+class LatencyHistogram:
+    """Per-operation latency histogram (fixed millisecond buckets)."""
+
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self) -> None:
+        self._ops: Dict[str, Dict[str, Any]] = {}
+
+    def observe(self, name: str, seconds: float, failed: bool = False) -> None:
+        op = self._ops.get(name)
+        if op is None:
+            op = self._ops[name] = {
+                "count": 0,
+                "errors": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "buckets": [0] * (len(self.BUCKETS_MS) + 1),
+            }
+        ms = seconds * 1000
+        op["count"] += 1
+        op["errors"] += int(failed)
+        op["total_ms"] += ms
+        op["max_ms"] = max(op["max_ms"], ms)
+        op["buckets"][bisect_left(self.BUCKETS_MS, ms)] += 1
+
+    @classmethod
+    def _percentile(cls, op: Dict[str, Any], q: float) -> Optional[float]:
+        # Cận trên của bucket chứa phân vị q (ước lượng, đủ cho dashboard)
+        rank = q * op["count"]
+        seen = 0
+        for bound, n in zip(cls.BUCKETS_MS + (round(op["max_ms"], 2),), op["buckets"]):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{b}ms" for b in self.BUCKETS_MS] + ["gt_5000ms"]
+        result = {}
+        for name, op in sorted(self._ops.items()):
+            count = op["count"]
+            result[name] = {
+                "count": count,
+                "errors": op["errors"],
+                "avg_ms": round(op["total_ms"] / count, 2) if count else 0.0,
+                "max_ms": round(op["max_ms"], 2),
+                "p50_ms": self._percentile(op, 0.5),
+                "p95_ms": self._percentile(op, 0.95),
+                "buckets": dict(zip(labels, op["buckets"])),
+            }
+        return result
+
+
+db_latency = LatencyHistogram()
+
+_async_client: Optional[AsyncClient] = None
+_async_client_lock: Optional[asyncio.Lock] = None
+
+
+async def get_async_supabase() -> AsyncClient:
+    """Shared async client; its PostgREST session keeps a pooled HTTP/2 connection."""
+    global _async_client, _async_client_lock
+    if _async_client is not None:
+        return _async_client
+    if _async_client_lock is None:
+        _async_client_lock = asyncio.Lock()
+    async with _async_client_lock:
+        if _async_client is None:
+            _async_client = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+    return _async_client
+
+
+async def run_query(name: str, build: Callable[[AsyncClient], Any]) -> Any:
+    """Execute ``build(client)`` (a PostgREST query builder) and record its latency.
+
+    Example: ``await run_query("node_progress.select", lambda db: db.table("node_progress").select("*"))``
+    """
+    return await timed(name, lambda client: build(client).execute())
+
+
+async def timed(name: str, call: Callable[[AsyncClient], Any]) -> Any:
+    """Like ``run_query`` for calls that are awaited directly (e.g. Storage downloads)."""
+    client = await get_async_supabase()
+    started = time.perf_counter()
+    failed = False
+    try:
+        return await call(client)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        db_latency.observe(name, time.perf_counter() - started, failed)
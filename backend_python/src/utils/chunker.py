@@ -0,0 +1,171 @@
+"""Streaming text chunker for RAG ingestion.
+
+``iter_chunks`` takes an iterable of text pieces (typically one per PDF page or
+DOCX paragraph) and lazily yields chunks that:
+- never cut through a ``$...$`` / ``$$...$$`` formula or a word,
+- end on sentence boundaries, preferring paragraph boundaries,
+- stay under a token budget, with a few trailing sentences carried over as
+  overlap so context is not lost between neighbouring chunks.
+
+Token counts are estimated from characters (``CHARS_PER_TOKEN``); that is
+close enough for sizing embedding inputs and needs no tokenizer download.
+
+A piece that does not end a sentence is carried into the next one (a sentence
+running across a PDF page break), but never more than one chunk's worth of
+text; sources whose pieces are whole paragraphs (DOCX) end each with a blank
+line so nothing is carried.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Iterable, Iterator, List
+
+CHARS_PER_TOKEN = 4
+DEFAULT_MAX_TOKENS = 300
+DEFAULT_OVERLAP_TOKENS = 40
+
+# Công thức toán được coi là một khối không tách được
+_MATH_RE = re.compile(r"\$\$.+?\$\$|\$[^$\n]+?\$", re.DOTALL)
+# Ranh giới câu: dấu kết câu + khoảng trắng (chỉ áp dụng ngoài công thức)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+|\n(?=\s*(?:[-•*]|\d+[.)])\s)")
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+_SPACES_RE = re.compile(r"[ \t\r\f\v]+")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def _iter_paragraphs(pages: Iterable[str], max_tail_chars: int) -> Iterator[str]:
+    """Paragraphs across page boundaries; only the unfinished tail (at most ``max_tail_chars``) is buffered."""
+    tail = ""
+    for page in pages:
+        if not page:
+            continue
+        parts = _PARAGRAPH_BREAK_RE.split(tail + page.replace("\r\n", "\n"))
+        tail = parts.pop()
+        for part in parts:
+            if part.strip():
+                yield part
+        # Trang kết thúc thường là hết đoạn; giữ lại nếu câu còn dang dở
+        # Đuôi quá một chunk (tiêu đề / gạch đầu dòng không có dấu câu) cũng được nhả ra
+        if tail.rstrip().endswith((".", "!", "?", "…", ":", "$")) or len(tail) > max_tail_chars:
+            yield tail
+            tail = ""
+        elif tail:
+            tail = tail.rstrip("\n") + "\n"
+    if tail.strip():
+        yield tail
+
+
+def _split_sentences(paragraph: str) -> List[str]:
+    """Sentences of one paragraph, keeping math spans intact."""
+    sentences: List[str] = []
+    current: List[str] = []
+    pos = 0
+    for match in _MATH_RE.finditer(paragraph):
+        _split_plain(paragraph[pos:match.start()], current, sentences)
+        current.append(match.group(0))
+        pos = match.end()
+    _split_plain(paragraph[pos:], current, sentences)
+    if current:
+        sentences.append("".join(current))
+    return [s for s in (_clean(s) for s in sentences) if s]
+
+
+def _split_plain(text: str, current: List[str], sentences: List[str]) -> None:
+    pieces = _SENTENCE_END_RE.split(text)
+    for i, piece in enumerate(pieces):
+        if i > 0:
+            sentences.append("".join(current))
+            current.clear()
+        current.append(piece)
+
+
+def _clean(text: str) -> str:
+    # Dòng xuống trong đoạn PDF chỉ là ngắt dòng hiển thị
+    return _SPACES_RE.sub(" ", text.replace("\n", " ")).strip()
+
+
+def _split_oversized(sentence: str, max_tokens: int) -> Iterator[str]:
+    """Split a sentence longer than the budget on word boundaries."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    words: List[str] = []
+    size = 0
+    for word in sentence.split(" "):
+        # Từ dài bất thường (chuỗi không có khoảng trắng): cắt cứng
+        while len(word) > max_chars:
+            if words:
+                yield " ".join(words)
+                words, size = [], 0
+            yield word[:max_chars]
+            word = word[max_chars:]
+        if words and size + len(word) + 1 > max_chars:
+            yield " ".join(words)
+            words, size = [], 0
+        words.append(word)
+        size += len(word) + 1
+    if words:
+        yield " ".join(words)
+
+
+def iter_chunks(
+    pages: Iterable[str],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+    dedupe: bool = True,
+) -> Iterator[str]:
+    """Lazily chunk ``pages`` (any iterable of text) into token-bounded chunks."""
+    max_tokens = max(1, max_tokens)
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    seen = set()
+
+    units: List[str] = []
+    separators: List[str] = []
+    size = 0
+    fresh = False  # chunk hiện tại có nội dung mới ngoài phần overlap
+
+    def emit() -> Iterator[str]:
+        nonlocal units, separators, size, fresh
+        if fresh:
+            chunk = "".join(sep + unit for sep, unit in zip(separators, units)).strip()
+            digest = hashlib.sha1(chunk.encode("utf-8")).digest()
+            if not dedupe or digest not in seen:
+                seen.add(digest)
+                yield chunk
+        # Giữ vài câu cuối làm overlap cho chunk tiếp theo
+        kept: List[str] = []
+        kept_size = 0
+        for unit in reversed(units):
+            tokens = estimate_tokens(unit)
+            if kept_size + tokens > overlap_tokens:
+                break
+            kept.insert(0, unit)
+            kept_size += tokens
+        units = kept
+        separators = [" "] * len(kept)
+        size = kept_size
+        fresh = False
+
+    for paragraph in _iter_paragraphs(pages, max_tokens * CHARS_PER_TOKEN):
+        separator = "\n\n"
+        for sentence in _split_sentences(paragraph):
+            pieces = (
+                _split_oversized(sentence, max_tokens)
+                if estimate_tokens(sentence) > max_tokens
+                else (sentence,)
+            )
+            for piece in pieces:
+                tokens = estimate_tokens(piece)
+                if fresh and size + tokens > max_tokens:
+                    yield from emit()
+                while units and size + tokens > max_tokens:
+                    size -= estimate_tokens(units.pop(0))
+                    separators.pop(0)
+                units.append(piece)
+                separators.append(separator if units[:-1] else "")
+                size += tokens
+                fresh = True
+                separator = " "
+    yield from emit()
@@ -1,34 +1,182 @@
-"""Shared helpers for reading and extracting text from files."""
+"""Shared helpers for reading and extracting text from files.
+
+Extraction is lazy: ``iter_document_blocks`` yields one PDF page / DOCX
+paragraph at a time so callers (the RAG chunker) never need the whole document
+as one string. Large PDFs are split into page ranges and extracted in a process
+pool, since PyPDF2 text extraction is pure-Python and CPU bound.
+"""
+import io
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
+from typing import Deque, Iterator, List, Optional, Union
+
 import PyPDF2
 from docx import Document
 
+Source = Union[str, os.PathLike, bytes]
+
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _as_file(source: Source):
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text from a PDF file path."""
+
+def _describe(source: Source) -> str:
+    return "<upload>" if isinstance(source, (bytes, bytearray)) else str(source)
+
+
+def iter_pdf_pages(source: Source, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """Yield the text of each PDF page (from a path or raw bytes)."""
     try:
-        with open(pdf_path, "rb") as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+        pdf_reader = PyPDF2.PdfReader(_as_file(source))
+        pages = pdf_reader.pages
     except Exception as exc:  # pragma: no cover - defensive logging
-        print(f"Error reading PDF {pdf_path}: {exc}")
-        return ""
+        print(f"Error reading PDF {_describe(source)}: {exc}")
+        return
+    stop = len(pages) if stop is None else min(stop, len(pages))
+    for index in range(start, stop):
+        try:
+            yield pages[index].extract_text() or ""
+        except Exception as exc:  # pragma: no cover - defensive logging
+            print(f"Error reading PDF page {index} of {_describe(source)}: {exc}")
+
+
+def iter_docx_paragraphs(source: Source) -> Iterator[str]:
+    """Yield the text of each paragraph of a Word (.docx) file."""
+    try:
+        doc = Document(_as_file(source))
+    except Exception as exc:  # pragma: no cover - defensive logging
+        print(f"Error reading Word file {_describe(source)}: {exc}")
+        return
+    for paragraph in doc.paragraphs:
+        yield paragraph.text
+
+
+# ----- process pool -----
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn: không fork cả event loop / thread của uvicorn vào worker
+        _process_pool = ProcessPoolExecutor(
+            max_workers=max(1, EXTRACTION_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
 
 
-def extract_text_from_word(docx_path: str) -> str:
-    """Extract text from a Word (.docx) file path."""
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def _extract_pdf_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    return list(iter_pdf_pages(pdf_path, start, stop))
+
+
+def _count_pdf_pages(pdf_path: str) -> int:
     try:
-        doc = Document(docx_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        return len(PyPDF2.PdfReader(pdf_path).pages)
     except Exception as exc:  # pragma: no cover - defensive logging
-        print(f"Error reading Word file {docx_path}: {exc}")
-        return ""
+        print(f"Error reading PDF {pdf_path}: {exc}")
+        return 0
+
+
+def iter_pdf_pages_parallel(pdf_path: str, pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[str]:
+    """Like ``iter_pdf_pages`` but extracts page ranges in the process pool.
+
+    Pages are still yielded in order; only ``EXTRACTION_WORKERS`` ranges are in
+    flight at a time so memory stays bounded for very long documents.
+    """
+    page_count = _count_pdf_pages(pdf_path)
+    if page_count <= pages_per_task or EXTRACTION_WORKERS <= 1:
+        yield from iter_pdf_pages(pdf_path)
+        return
+
+    pool = _get_process_pool()
+    ranges = iter(range(0, page_count, pages_per_task))
+    pending: Deque[Future] = deque()
+
+    def submit_next() -> None:
+        start = next(ranges, None)
+        if start is not None:
+            pending.append(pool.submit(_extract_pdf_page_range, pdf_path, start, start + pages_per_task))
+
+    for _ in range(EXTRACTION_WORKERS):
+        submit_next()
+    try:
+        while pending:
+            pages = pending.popleft().result()
+            submit_next()
+            yield from pages
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# ----- public API -----
+
+def iter_document_blocks(source: Source, file_name: Optional[str] = None) -> Iterator[str]:
+    """Yield text blocks (pages / paragraphs) of a PDF, Word or plain text file.
+
+    ``source`` is a path or the raw file bytes; ``file_name`` decides the format
+    when bytes are given.
+    """
+    if file_name is None and not isinstance(source, (bytes, bytearray)):
+        file_name = str(source)
+    extension = Path(file_name or "").suffix.lower()
+
+    if extension == ".pdf":
+        if not isinstance(source, (bytes, bytearray)):
+            yield from iter_pdf_pages_parallel(str(source))
+            return
+        # Process pool cần đường dẫn: ghi bytes ra file tạm một lần thay vì pickle cho từng task
+        handle, tmp_path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(handle, "wb") as tmp:
+                tmp.write(source)
+            yield from iter_pdf_pages_parallel(tmp_path)
+        finally:
+            os.unlink(tmp_path)
+        return
+
+    if extension in [".docx", ".doc"]:
+        # Mỗi paragraph Word là một đoạn trọn vẹn -> kết thúc bằng dòng trống để chunker không nối sang đoạn sau
+        for paragraph in iter_docx_paragraphs(source):
+            yield paragraph + "\n\n"
+        return
+
+    if isinstance(source, (bytes, bytearray)):
+        try:
+            yield source.decode("utf-8")
+        except UnicodeDecodeError:
+            print(f"Unsupported file format: {extension}")
+        return
+    if extension in [".txt", ".md"]:
+        yield Path(source).read_text(encoding="utf-8")
+        return
+
+    print(f"Unsupported file format: {extension}")
+
+
+def extract_text_from_pdf(pdf_path: Source) -> str:
+    """Extract text from a PDF file path (or bytes)."""
+    return "".join(page + "\n" for page in iter_pdf_pages(pdf_path))
+
+
+def extract_text_from_word(docx_path: Source) -> str:
+    """Extract text from a Word (.docx) file path (or bytes)."""
+    return "".join(paragraph + "\n" for paragraph in iter_docx_paragraphs(docx_path))
 
 
 def extract_text_from_file(file_path: str) -> str:
@@ -0,0 +1,261 @@
+"""Tolerant, single-pass recovery of the JSON object in a model response.
+
+Gemini answers usually contain one JSON object, but often wrapped in markdown
+fences or prose and with LaTeX written straight into strings (``"$\\frac{1}{2}$"``
+where JSON needs ``"$\\\\frac{1}{2}$"``). ``repair_json`` scans the text once
+from the first ``{`` to the matching ``}`` and, copying untouched runs by slice:
+- doubles backslashes that start LaTeX commands instead of JSON escapes
+  (``\\frac``, ``\\lim``, ``\\infty``, ``\\theta``...),
+- escapes raw newlines / tabs / control characters inside strings,
+- accepts smart quotes as string delimiters outside strings,
+- escapes stray ``"`` inside strings and drops trailing commas,
+- ignores everything after the outermost object.
+
+``parse_model_json`` first tries ``json``'s C decoder from the first ``{`` (the
+usual case with ``response_mime_type="application/json"``) and only falls back
+to the repair scan when that fails or would silently turn a LaTeX command into
+a control character (``"\\frac"`` decodes as form feed + ``rac``). On failure
+it raises ``JSONRepairError`` (a ``json.JSONDecodeError``) whose ``pos`` /
+``lineno`` / ``colno`` point into the original response.
+"""
+from __future__ import annotations
+
+import json
+import re
+import time
+from bisect import bisect_right
+from typing import Any, Dict, List, Tuple
+
+# Ký tự cần xử lý ngoài / trong chuỗi; phần còn lại được copy nguyên đoạn
+_STRUCTURAL = re.compile(r'[{}\[\]"“”]')
+_IN_STRING = re.compile(r'["\\\x00-\x1f“”]')
+_LETTERS = re.compile(r"[A-Za-z]+")
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_BACKSLASH_WORD = re.compile(r"(\\+)([bfnrt][A-Za-z]*)")
+_DECODER = json.JSONDecoder()
+
+_SMART_QUOTES = "“”"
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+# Sau dấu " đóng chuỗi chỉ có thể là một trong các ký tự này
+_AFTER_STRING = frozenset(",:}]")
+
+# Lệnh LaTeX bắt đầu bằng b/f/n/r/t (trùng với escape JSON \b \f \n \r \t)
+_LATEX_COMMANDS = frozenset(
+    {
+        "bar", "beta", "because", "begin", "bf", "big", "bigcap", "bigcup", "binom",
+        "bmod", "bot", "boxed", "bullet",
+        "flat", "forall", "frac", "frown",
+        "nabla", "ne", "nearrow", "neg", "neq", "ni", "nleq", "ngeq", "nmid", "not",
+        "notin", "nu", "nwarrow",
+        "rangle", "rbrace", "rceil", "rfloor", "rho", "right", "rightarrow",
+        "rightleftharpoons", "rm",
+        "tan", "tanh", "tau", "text", "textbf", "textit", "textrm", "tfrac", "therefore",
+        "theta", "tilde", "times", "to", "top", "triangle", "triangleq",
+    }
+)
+_LATEX_PREFIXES = ("big", "frac", "right", "text", "theta", "triangle")
+
+_stats = {"calls": 0, "fast_path": 0, "failures": 0, "repaired": 0, "total_ms": 0.0}
+
+
+class JSONRepairError(json.JSONDecodeError):
+    """Unrecoverable response; ``pos`` is an offset into the original text."""
+
+
+def is_latex_command(word: str) -> bool:
+    """Whether ``word`` (the letters after a backslash) names a LaTeX command."""
+    return word in _LATEX_COMMANDS or word.startswith(_LATEX_PREFIXES)
+
+
+def _has_latex_escape(text: str, start: int, end: int) -> bool:
+    """Whether ``text[start:end]`` has a JSON escape that is really a LaTeX command."""
+    for m in _BACKSLASH_WORD.finditer(text, start, end):
+        if len(m.group(1)) % 2 and is_latex_command(m.group(2)):
+            return True
+    return False
+
+
+def has_latex_escape(text: str) -> bool:
+    """Whether strict JSON decoding of ``text`` would mangle a LaTeX command."""
+    return _has_latex_escape(text, 0, len(text))
+
+
+def _closes_string(text: str, pos: int) -> bool:
+    """Whether the quote ending at ``pos`` is followed by a structural character."""
+    n = len(text)
+    while pos < n and text[pos] in " \t\r\n":
+        pos += 1
+    return pos >= n or text[pos] in _AFTER_STRING
+
+
+class _Output:
+    """Repaired text as slices of the input between edits.
+
+    Untouched runs are only sliced when the next edit (or the end) is reached;
+    each edit also records (output offset, input offset) marks used to map
+    ``json.loads`` errors back onto the original response.
+    """
+
+    __slots__ = ("text", "chunks", "flushed", "length", "out_marks", "in_marks")
+
+    def __init__(self, text: str, start: int) -> None:
+        self.text = text
+        self.chunks: List[str] = []
+        self.flushed = start
+        self.length = 0
+        self.out_marks: List[int] = [0]
+        self.in_marks: List[int] = [start]
+
+    def replace(self, start: int, end: int, value: str) -> None:
+        """Output ``value`` instead of ``text[start:end]``."""
+        if start > self.flushed:
+            self.chunks.append(self.text[self.flushed:start])
+            self.length += start - self.flushed
+        self.out_marks.append(self.length)
+        self.in_marks.append(start)
+        if value:
+            self.chunks.append(value)
+            self.length += len(value)
+        self.flushed = end
+        self.out_marks.append(self.length)
+        self.in_marks.append(end)
+
+    @property
+    def edits(self) -> int:
+        return (len(self.out_marks) - 1) // 2
+
+    def finish(self, end: int) -> str:
+        self.chunks.append(self.text[self.flushed:end])
+        self.flushed = end
+        return "".join(self.chunks)
+
+    def source_offset(self, out_pos: int) -> int:
+        i = bisect_right(self.out_marks, out_pos) - 1
+        return self.in_marks[i] + (out_pos - self.out_marks[i])
+
+
+def _scan_string(text: str, pos: int, out: _Output) -> int:
+    """Scan a string body starting after its opening quote; return the index after the closing quote."""
+    n = len(text)
+    while True:
+        m = _IN_STRING.search(text, pos)
+        if m is None:
+            raise JSONRepairError("Unterminated string", text, pos)
+        i = m.start()
+        ch = text[i]
+
+        if ch == '"' or ch in _SMART_QUOTES:
+            if _closes_string(text, i + 1):
+                if ch != '"':
+                    out.replace(i, i + 1, '"')
+                return i + 1
+            # Dấu " nằm giữa nội dung -> escape; ngoặc kép cong giữ nguyên
+            if ch == '"':
+                out.replace(i, i + 1, '\\"')
+            pos = i + 1
+            continue
+
+        if ch == "\\":
+            if i + 1 >= n:
+                raise JSONRepairError("Unterminated string", text, i)
+            nxt = text[i + 1]
+            if nxt in '"\\/':
+                pos = i + 2
+            elif nxt == "u" and _HEX4.match(text, i + 2):
+                pos = i + 6
+            elif nxt in "bfnrt" and not is_latex_command(_LETTERS.match(text, i + 1).group(0)):
+                pos = i + 2
+            else:
+                # \lim, \infty, \frac, \{ ... không phải escape JSON -> nhân đôi
+                out.replace(i, i + 1, "\\\\")
+                pos = i + 1
+            continue
+
+        out.replace(i, i + 1, _CONTROL_ESCAPES.get(ch, " "))
+        pos = i + 1
+
+
+def repair_json(text: str) -> str:
+    """The outermost JSON object in ``text`` as strict JSON (see module docstring)."""
+    return _repair(text)[0]
+
+
+def _repair(text: str) -> Tuple[str, _Output]:
+    if not text:
+        raise JSONRepairError("Empty response", text or "", 0)
+    start = text.find("{")
+    if start < 0:
+        raise JSONRepairError("No JSON object found", text, 0)
+
+    out = _Output(text, start)
+    stack: List[str] = []
+    pos = start
+    while True:
+        m = _STRUCTURAL.search(text, pos)
+        if m is None:
+            raise JSONRepairError("Unterminated JSON object", text, start)
+        i = m.start()
+        ch = text[i]
+
+        if ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack or stack[-1] != ch:
+                raise JSONRepairError(f"Unexpected '{ch}'", text, i)
+            stack.pop()
+            # Dấu phẩy thừa trước } hoặc ]
+            j = i - 1
+            while text[j] in " \t\r\n":
+                j -= 1
+            if text[j] == "," and j >= out.flushed:
+                out.replace(j, j + 1, "")
+            if not stack:
+                return out.finish(i + 1), out
+        else:
+            if ch != '"':
+                out.replace(i, i + 1, '"')
+            pos = _scan_string(text, i + 1, out)
+            continue
+        pos = i + 1
+
+
+def parse_model_json(text: str) -> Any:
+    """Decode the JSON object in a model response, repairing it if needed."""
+    started = time.perf_counter()
+    _stats["calls"] += 1
+    try:
+        start = text.find("{") if text else -1
+        if start >= 0:
+            try:
+                value, end = _DECODER.raw_decode(text, start)
+            except json.JSONDecodeError:
+                pass
+            else:
+                if isinstance(value, dict) and not _has_latex_escape(text, start, end):
+                    _stats["fast_path"] += 1
+                    return value
+
+        repaired, out = _repair(text)
+        try:
+            value = json.loads(repaired)
+        except json.JSONDecodeError as e:
+            raise JSONRepairError(e.msg, text, out.source_offset(e.pos)) from None
+        if out.edits:
+            _stats["repaired"] += 1
+        return value
+    except JSONRepairError:
+        _stats["failures"] += 1
+        raise
+    finally:
+        _stats["total_ms"] += (time.perf_counter() - started) * 1000
+
+
+def stats() -> Dict[str, Any]:
+    calls = _stats["calls"] or 1
+    return {
+        "calls": _stats["calls"],
+        "fast_path": _stats["fast_path"],
+        "failures": _stats["failures"],
+        "repaired": _stats["repaired"],
+        "avg_ms": round(_stats["total_ms"] / calls, 3),
+    }
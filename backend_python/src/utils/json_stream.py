@@ -0,0 +1,288 @@
+"""Incremental parser for streamed JSON chat replies.
+
+The chat model answers with one JSON object (``reply``, ``mindmap_insights``,
+``geogebra``). ``ChatStreamParser`` consumes the text chunk by chunk and:
+- emits the decoded ``reply`` string as deltas while it is still being written,
+- emits every other top-level key once its value is complete.
+
+If the model does not answer with a JSON object at all, everything is streamed
+as reply text so the student still sees the answer.
+
+``\\b \\f \\n \\r \\t`` followed by letters are held back until the word ends: a
+LaTeX command (``\\frac``, ``\\beta``, ``\\times``) keeps its backslash, the same
+way ``json_repair`` decodes the non-streamed reply.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.json_repair import is_latex_command
+
+Event = Tuple[str, Any]
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+# Parser states
+_START = "start"
+_RAW = "raw"
+_EXPECT_KEY = "expect_key"
+_KEY = "key"
+_AFTER_KEY = "after_key"
+_BEFORE_VALUE = "before_value"
+_STREAM_STRING = "stream_string"
+_VALUE = "value"
+_AFTER_VALUE = "after_value"
+_END = "end"
+
+
+class ChatStreamParser:
+    """Feed model text chunks, get back ``(event, payload)`` tuples.
+
+    ``("reply", "delta text")`` is emitted for the streamed key, and
+    ``(key, parsed_value)`` for every other top-level key.
+    """
+
+    def __init__(self, streamed_key: str = "reply") -> None:
+        self.streamed_key = streamed_key
+        self.values: Dict[str, Any] = {}
+        self._state = _START
+        self._prefix: List[str] = []
+        self._key: List[str] = []
+        self._current_key = ""
+        self._reply: List[str] = []
+        # streamed string decoding
+        self._escape = False
+        self._unicode: Optional[List[str]] = None
+        self._high_surrogate: Optional[int] = None
+        self._latex: Optional[List[str]] = None
+        # raw value capture
+        self._raw: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._raw_escape = False
+
+    @property
+    def reply(self) -> str:
+        return "".join(self._reply)
+
+    # ----- public API -----
+
+    def feed(self, chunk: str) -> List[Event]:
+        events: List[Event] = []
+        delta: List[str] = []
+        for ch in chunk:
+            completed = self._step(ch, delta)
+            if completed is not None:
+                if delta:
+                    events.append((self.streamed_key, "".join(delta)))
+                    delta = []
+                events.append(completed)
+        if delta:
+            events.append((self.streamed_key, "".join(delta)))
+        return events
+
+    def close(self) -> List[Event]:
+        """Flush a trailing scalar value (object never closed) at end of stream."""
+        events: List[Event] = []
+        if self._state == _START and self._prefix:
+            text = "".join(self._prefix)
+            self._reply.append(text)
+            events.append((self.streamed_key, text))
+        elif self._state == _VALUE and self._raw:
+            completed = self._complete_value()
+            if completed is not None:
+                events.append(completed)
+        elif self._state == _STREAM_STRING and self._latex is not None:
+            delta: List[str] = []
+            self._flush_latex(delta)
+            events.append((self.streamed_key, "".join(delta)))
+        self._state = _END
+        return events
+
+    # ----- state machine -----
+
+    def _step(self, ch: str, delta: List[str]) -> Optional[Event]:
+        state = self._state
+
+        if state == _STREAM_STRING:
+            self._stream_char(ch, delta)
+            return None
+
+        if state == _VALUE:
+            return self._value_char(ch)
+
+        if state == _START:
+            if ch == "{":
+                self._state = _EXPECT_KEY
+                return None
+            self._prefix.append(ch)
+            # Bỏ qua ```json ở đầu; nếu không phải JSON thì stream nguyên văn
+            meaningful = "".join(self._prefix).replace("`", "").strip()
+            if meaningful and not "json".startswith(meaningful.lower()):
+                self._state = _RAW
+                text = "".join(self._prefix)
+                self._reply.append(text)
+                delta.append(text)
+            return None
+
+        if state == _RAW:
+            self._reply.append(ch)
+            delta.append(ch)
+            return None
+
+        if state == _EXPECT_KEY:
+            if ch == '"':
+                self._key = []
+                self._state = _KEY
+            elif ch == "}":
+                self._state = _END
+            return None
+
+        if state == _KEY:
+            if ch == '"' and not (self._key and self._key[-1] == "\\"):
+                self._current_key = "".join(self._key)
+                self._state = _AFTER_KEY
+            else:
+                self._key.append(ch)
+            return None
+
+        if state == _AFTER_KEY:
+            if ch == ":":
+                self._state = _BEFORE_VALUE
+            return None
+
+        if state == _BEFORE_VALUE:
+            if ch.isspace():
+                return None
+            if self._current_key == self.streamed_key and ch == '"':
+                self._state = _STREAM_STRING
+                return None
+            self._raw = []
+            self._depth = 0
+            self._in_string = False
+            self._raw_escape = False
+            self._state = _VALUE
+            return self._value_char(ch)
+
+        if state == _AFTER_VALUE:
+            if ch == ",":
+                self._state = _EXPECT_KEY
+            elif ch == "}":
+                self._state = _END
+            return None
+
+        return None
+
+    def _emit_text(self, text: str, delta: List[str]) -> None:
+        self._reply.append(text)
+        delta.append(text)
+
+    def _flush_latex(self, delta: List[str]) -> None:
+        word = "".join(self._latex)
+        self._latex = None
+        if is_latex_command(word):
+            self._emit_text("\\" + word, delta)
+        else:
+            self._emit_text(_SIMPLE_ESCAPES[word[0]] + word[1:], delta)
+
+    def _stream_char(self, ch: str, delta: List[str]) -> None:
+        if self._latex is not None:
+            # Đang gom chữ sau \b \f \n \r \t để biết có phải lệnh LaTeX không
+            if ch.isascii() and ch.isalpha():
+                self._latex.append(ch)
+                return
+            self._flush_latex(delta)
+
+        if self._unicode is not None:
+            self._unicode.append(ch)
+            if len(self._unicode) < 4:
+                return
+            hex_digits = "".join(self._unicode)
+            self._unicode = None
+            try:
+                code = int(hex_digits, 16)
+            except ValueError:
+                self._emit_text("\\u" + hex_digits, delta)
+                return
+            if 0xD800 <= code < 0xDC00:
+                self._high_surrogate = code
+                return
+            if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+            self._emit_text(chr(code), delta)
+            return
+
+        if self._escape:
+            self._escape = False
+            if ch == "u":
+                self._unicode = []
+            elif ch in "bfnrt":
+                self._latex = [ch]
+            elif ch in _SIMPLE_ESCAPES:
+                self._emit_text(_SIMPLE_ESCAPES[ch], delta)
+            else:
+                # Escape không hợp lệ (thường là LaTeX như \lim, \sqrt): giữ nguyên
+                self._emit_text("\\" + ch, delta)
+            return
+
+        if ch == "\\":
+            self._escape = True
+        elif ch == '"':
+            self.values[self.streamed_key] = self.reply
+            self._state = _AFTER_VALUE
+        else:
+            self._emit_text(ch, delta)
+
+    def _value_char(self, ch: str) -> Optional[Event]:
+        if self._in_string:
+            self._raw.append(ch)
+            if self._raw_escape:
+                self._raw_escape = False
+            elif ch == "\\":
+                self._raw_escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._depth == 0:
+                    return self._complete_value()
+            return None
+
+        if ch in ",}" and self._depth == 0:
+            # Kết thúc một giá trị scalar (số, true/false, null)
+            completed = self._complete_value()
+            self._state = _EXPECT_KEY if ch == "," else _END
+            return completed
+
+        self._raw.append(ch)
+        if ch == '"':
+            self._in_string = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                return self._complete_value()
+        return None
+
+    def _complete_value(self) -> Optional[Event]:
+        raw = "".join(self._raw).strip()
+        self._raw = []
+        self._state = _AFTER_VALUE
+        if not raw:
+            return None
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            value = None
+        self.values[self._current_key] = value
+        return (self._current_key, value)
@@ -0,0 +1,43 @@
+"""Single-flight deduplication for async calls.
+
+Concurrent ``do(key, fn)`` calls with the same key share one execution of
+``fn``: the first caller starts it, later callers await the same result (or
+exception). The call runs in its own task, so a caller that disconnects does
+not cancel the work the others are waiting for.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self._stats["calls"] += 1
+        task = self._calls.get(key)
+        if task is not None:
+            self._stats["shared"] += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Đánh dấu exception đã được lấy khi mọi caller đều đã huỷ
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": self.in_flight(), **self._stats}
@@ -13,10 +13,15 @@ class NodeVideo(SQLModel, table=True):
     prompt: str
     audio_url: Optional[str] = None
     status: str = Field(default="processing")
+    # Lần cuối nhận progress report (để huỷ prefetch khi người xem rời đi)
+    last_viewed_at: Optional[datetime] = Field(default=None, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
     updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
-    segments: List["VideoSegment"] = Relationship(back_populates="node_video")
+    segments: List["VideoSegment"] = Relationship(
+        back_populates="node_video",
+        sa_relationship_kwargs={"order_by": "VideoSegment.segment_index"},
+    )
 
 
 class VideoSegment(SQLModel, table=True):
@@ -27,10 +32,17 @@ class VideoSegment(SQLModel, table=True):
     segment_index: int = Field(index=True)
     start_second: int
     end_second: int
-    status: str = Field(default="pending")
+    status: str = Field(default="pending", index=True)
     provider_job_id: Optional[str] = None
     video_url: Optional[str] = None
     error_message: Optional[str] = None
+    # Hàng đợi sinh video: thời điểm người xem cần tới segment + lease của worker
+    needed_at: Optional[datetime] = Field(default_factory=datetime.utcnow, index=True)
+    lease_owner: Optional[str] = Field(default=None, index=True)
+    lease_until: Optional[datetime] = None
+    attempts: int = Field(default=0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    # sha256(prompt, segment_index, duration, audio_url): segment cùng nội dung chỉ sinh một lần
+    content_key: Optional[str] = Field(default=None, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
     updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
@@ -0,0 +1,32 @@
+-- One-off migration for the video segment queue (node_videos / video_segments).
+-- Run once (psql or the Supabase SQL editor) before deploying the scheduler; app
+-- workers do not alter tables at startup. A fresh database can instead be created
+-- with `python -c "from src.db import init_db; init_db()"`.
+begin;
+
+-- Hai người chạy cùng lúc thì người sau chờ, không lỗi trùng cột
+select pg_advisory_xact_lock(hashtext('video_queue_migration'));
+
+alter table public.node_videos add column if not exists "last_viewed_at" timestamp without time zone null;
+
+alter table public.video_segments add column if not exists "needed_at" timestamp without time zone null;
+
+alter table public.video_segments add column if not exists "lease_owner" character varying null;
+
+alter table public.video_segments add column if not exists "lease_until" timestamp without time zone null;
+
+alter table public.video_segments add column if not exists "attempts" integer not null default 0;
+
+alter table public.video_segments add column if not exists "content_key" character varying null;
+
+create index IF not exists ix_node_videos_last_viewed_at on public.node_videos using btree (last_viewed_at) TABLESPACE pg_default;
+
+create index IF not exists ix_video_segments_status on public.video_segments using btree (status) TABLESPACE pg_default;
+
+create index IF not exists ix_video_segments_needed_at on public.video_segments using btree (needed_at) TABLESPACE pg_default;
+
+create index IF not exists ix_video_segments_lease_owner on public.video_segments using btree (lease_owner) TABLESPACE pg_default;
+
+create index IF not exists ix_video_segments_content_key on public.video_segments using btree (content_key) TABLESPACE pg_default;
+
+commit;
@@ -52,6 +52,9 @@ export default function LectureVideoPage() {
   const [creating, setCreating] = useState(false);
   const [currentSegmentIndex, setCurrentSegmentIndex] = useState(0);
   const videoRef = useRef<HTMLVideoElement>(null);
+  const lastReportedSecondRef = useRef<number | null>(null);
+  // Id phiên xem của tab này: video dùng chung giữa nhiều học sinh, backend đếm người xem theo id này
+  const [viewerId] = useState(() => `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`);
   const [playback, setPlayback] = useState({
     isPlaying: false,
     volume: 0.8,
@@ -132,16 +135,17 @@ export default function LectureVideoPage() {
 
   const segments = video?.segments || [];
   const currentSegment = useMemo(() => segments[currentSegmentIndex], [segments, currentSegmentIndex]);
-  const nextSegment = segments[currentSegmentIndex + 1];
 
-  // Gửi progress report về backend
-  const reportProgress = async (currentSecond: number) => {
+  // Gửi progress report về backend (backend dựa vào đó để sinh trước các segment sắp xem)
+  const reportProgress = async (currentSecond: number, stopped = false) => {
     if (!video?.id) return;
+    lastReportedSecondRef.current = stopped ? null : currentSecond;
     try {
       await fetch(`${API_BASE_URL}/videos/${video.id}/progress`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ current_second: currentSecond }),
+        body: JSON.stringify({ current_second: currentSecond, stopped, viewer_id: viewerId }),
+        keepalive: stopped,
       });
     } catch (err) {
       console.error("Failed to report progress:", err);
@@ -186,12 +190,27 @@ export default function LectureVideoPage() {
     // Tính global second để report về backend
     const globalSecond = currentSegment.start_second + Math.floor(localProgress);
 
-    // Report progress khi xem được 20s trong segment
-    if (localProgress >= 20 && nextSegment && nextSegment.status === "pending") {
+    // Report progress mỗi 5s xem (hoặc khi tua)
+    const lastReported = lastReportedSecondRef.current;
+    if (lastReported === null || Math.abs(globalSecond - lastReported) >= 5) {
       reportProgress(globalSecond);
     }
   };
 
+  // Rời trang -> báo backend huỷ các segment sinh trước chưa bắt đầu
+  const videoId = video?.id;
+  useEffect(() => {
+    if (!videoId) return;
+    return () => {
+      void fetch(`${API_BASE_URL}/videos/${videoId}/progress`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ current_second: 0, stopped: true, viewer_id: viewerId }),
+        keepalive: true,
+      });
+    };
+  }, [videoId, viewerId]);
+
   const togglePlay = () => {
     const video = videoRef.current;
     if (!video) return;